@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     # Third-party apps
     'rest_framework',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
 
     # Local apps
@@ -96,6 +97,21 @@ DATABASES = {
     }
 }
 
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -138,6 +154,13 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Where stored content lives: 's3' (the AWS settings below) or 'local'
+# (files under VAULT_LOCAL_STORAGE_ROOT, served by the API)
+VAULT_STORAGE_BACKEND = os.getenv('VAULT_STORAGE_BACKEND', 's3')
+VAULT_LOCAL_STORAGE_ROOT = os.getenv('VAULT_LOCAL_STORAGE_ROOT', str(BASE_DIR / 'storage'))
+# Scheme and host the signed URLs of local storage point at, as clients reach the API
+VAULT_LOCAL_STORAGE_BASE_URL = os.getenv('VAULT_LOCAL_STORAGE_BASE_URL', 'http://localhost:8000')
+
 # AWS S3 Configuration
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
@@ -145,6 +168,67 @@ AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
 AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME')
 AWS_S3_FILE_OVERWRITE = False
 AWS_DEFAULT_ACL = None
+# Connections kept open to S3, shared by all threads of a worker
+VAULT_S3_MAX_POOL_CONNECTIONS = int(os.getenv('VAULT_S3_MAX_POOL_CONNECTIONS', 50))
+# Attempts per S3 request, retried with adaptive (client-side rate limited) backoff
+VAULT_S3_MAX_ATTEMPTS = int(os.getenv('VAULT_S3_MAX_ATTEMPTS', 5))
+# Managed uploads and copies: objects from this size are sent in parts of at least the chunk size
+# (larger for large objects) by up to VAULT_S3_MAX_CONCURRENCY threads, see s3_utils.transfer_config
+VAULT_S3_MULTIPART_THRESHOLD = int(os.getenv('VAULT_S3_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+VAULT_S3_MULTIPART_CHUNK_SIZE = int(os.getenv('VAULT_S3_MULTIPART_CHUNK_SIZE', 16 * 1024 * 1024))
+VAULT_S3_MAX_CONCURRENCY = int(os.getenv('VAULT_S3_MAX_CONCURRENCY', 16))
+# Seconds a folder listing stays cached (it is also invalidated by every change to the user's files)
+VAULT_LISTING_CACHE_TIMEOUT = int(os.getenv('VAULT_LISTING_CACHE_TIMEOUT', 60))
+# Presigned URLs are cached and reused for this many seconds (see S3Client.generate_presigned_urls)
+VAULT_PRESIGNED_URL_CACHE_WINDOW = int(os.getenv('VAULT_PRESIGNED_URL_CACHE_WINDOW', 5 * 60))
+
+# Upload pipeline
+# Size of each multipart part streamed to S3 (S3 requires at least 5 MB)
+VAULT_UPLOAD_PART_SIZE = int(os.getenv('VAULT_UPLOAD_PART_SIZE', 8 * 1024 * 1024))
+# How much of the start of each upload is kept in memory to sniff its content
+VAULT_THUMBNAIL_SNIFF_SIZE = int(os.getenv('VAULT_THUMBNAIL_SNIFF_SIZE', 64 * 1024))
+# Seconds an upload session may sit idle before it is expired and cleaned up
+VAULT_UPLOAD_SESSION_TTL = int(os.getenv('VAULT_UPLOAD_SESSION_TTL', 24 * 60 * 60))
+# Seconds a verifier may spend hashing a completed upload session before another verifier retries it,
+# and how many tries a session gets before it fails
+VAULT_UPLOAD_VERIFY_TIMEOUT = int(os.getenv('VAULT_UPLOAD_VERIFY_TIMEOUT', 60 * 60))
+VAULT_UPLOAD_VERIFY_MAX_ATTEMPTS = int(os.getenv('VAULT_UPLOAD_VERIFY_MAX_ATTEMPTS', 3))
+VAULT_UPLOAD_VERIFY_THREADS = int(os.getenv('VAULT_UPLOAD_VERIFY_THREADS', 4))
+# Seconds quota reserved by an upload request is held at most, should the request die without
+# releasing it (`reconcile_quotas` gives it back). Upload sessions hold theirs until they expire
+VAULT_QUOTA_RESERVATION_TTL = int(os.getenv('VAULT_QUOTA_RESERVATION_TTL', 6 * 60 * 60))
+# Seconds an unreferenced stored file is kept (and can be revived by a
+# re-upload of the same content) before `reclaim_storage` deletes it
+VAULT_ORPHAN_GRACE_PERIOD = int(os.getenv('VAULT_ORPHAN_GRACE_PERIOD', 60 * 60))
+
+# Compression of uploads (zstd when the zstandard package is installed, gzip otherwise)
+VAULT_COMPRESSION_ENABLED = os.getenv('VAULT_COMPRESSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Content is stored compressed only if its first VAULT_THUMBNAIL_SNIFF_SIZE bytes shrink by at least this fraction
+VAULT_COMPRESSION_MIN_SAVING = float(os.getenv('VAULT_COMPRESSION_MIN_SAVING', 0.2))
+# Codec level, unset for the codec's default
+VAULT_COMPRESSION_LEVEL = int(os.getenv('VAULT_COMPRESSION_LEVEL', 0)) or None
+
+# Downloads proxied by the API are read from storage and sent in pieces of this size
+VAULT_DOWNLOAD_CHUNK_SIZE = int(os.getenv('VAULT_DOWNLOAD_CHUNK_SIZE', 1024 * 1024))
+# Threads running blocking storage calls for the async views and downloads streamed under ASGI (see vault/async_utils.py)
+VAULT_ASYNC_STORAGE_THREADS = int(os.getenv('VAULT_ASYNC_STORAGE_THREADS', 64))
+
+# Content-defined chunking (api/chunks/), FastCDC cut points are kept between these sizes
+VAULT_CHUNK_MIN_SIZE = int(os.getenv('VAULT_CHUNK_MIN_SIZE', 256 * 1024))
+VAULT_CHUNK_AVG_SIZE = int(os.getenv('VAULT_CHUNK_AVG_SIZE', 1024 * 1024))
+VAULT_CHUNK_MAX_SIZE = int(os.getenv('VAULT_CHUNK_MAX_SIZE', 4 * 1024 * 1024))
+
+# Thumbnail worker (python manage.py run_thumbnail_worker)
+VAULT_THUMBNAIL_WORKERS = int(os.getenv('VAULT_THUMBNAIL_WORKERS', os.cpu_count() or 1))
+# Seconds before a job left running by a crashed worker is picked up again
+VAULT_THUMBNAIL_JOB_TIMEOUT = int(os.getenv('VAULT_THUMBNAIL_JOB_TIMEOUT', 10 * 60))
+VAULT_THUMBNAIL_MAX_ATTEMPTS = int(os.getenv('VAULT_THUMBNAIL_MAX_ATTEMPTS', 3))
+# Seconds a single video thumbnail may take, including waiting for a free slot
+VAULT_VIDEO_THUMBNAIL_TIMEOUT = int(os.getenv('VAULT_VIDEO_THUMBNAIL_TIMEOUT', 30))
+# Videos decoded at once across all thumbnail worker processes
+VAULT_VIDEO_THUMBNAIL_CONCURRENCY = int(os.getenv('VAULT_VIDEO_THUMBNAIL_CONCURRENCY', 2))
+# Preview sizes (px) served by files/<id>/preview/
+VAULT_RENDITION_SIZES = (128, 512, 1024)
 
 
 CORS_ALLOWED_ORIGINS = [
@@ -188,7 +272,8 @@ CORS_ALLOW_HEADERS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Builds request.user from the token without a query, see vault/auth_utils.py
+        'vault.auth_utils.StatelessJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -203,7 +288,8 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'UPDATE_LAST_LOGIN': True,
+    # Logins would write the user row every time
+    'UPDATE_LAST_LOGIN': False,
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
     'VERIFYING_KEY': None,
@@ -214,3 +300,6 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
+
+# Seconds before a token revoked in another process is rejected here too
+VAULT_REVOKED_TOKENS_REFRESH = int(os.getenv('VAULT_REVOKED_TOKENS_REFRESH', 5))
@@ -1,9 +1,9 @@
 from django.contrib import admin
-from .models import StoredFile, UserFile
+from .models import StoredFile, UserFile, ThumbnailJob
 
 @admin.register(StoredFile)
 class StoredFileAdmin(admin.ModelAdmin):
-    list_display = ('file_hash', 's3_key', 'size', 'ref_count', 'created_at')
+    list_display = ('file_hash', 's3_key', 'size', 'ref_count', 'thumbnail_status', 'created_at')
     search_fields = ('file_hash', 's3_key')
 
 @admin.register(UserFile)
@@ -11,3 +11,8 @@ class UserFileAdmin(admin.ModelAdmin):
     list_display = ('name', 'user', 'stored_file', 'created_at', 'updated_at', 'is_deleted')
     list_filter = ('user', 'is_deleted')
     search_fields = ('name', 'user__username')
+
+@admin.register(ThumbnailJob)
+class ThumbnailJobAdmin(admin.ModelAdmin):
+    list_display = ('stored_file', 'source_name', 'status', 'attempts', 'run_after', 'updated_at')
+    list_filter = ('status',)
@@ -0,0 +1,128 @@
+"""
+Serving under ASGI (uvicorn) without tying up threads on transfers.
+
+The file views (upload, list, delete) are `AsyncAPIView`s with `async def`
+handlers. Django reads the request body on the event loop before it calls
+them, so a slow client costs a buffer, not a thread. The views run the ORM
+through sync_to_async and talk to storage through its async methods (the
+`a` prefixed ones, see StorageBackend), so S3 latency is awaited instead of
+blocking a thread either.
+
+Responses are different: a StreamingHttpResponse over a sync iterator is
+read into a list before the first byte is sent. That costs memory
+proportional to the file, and the thread stays busy for the whole transfer.
+Under ASGI, downloads are therefore streamed from an async iterator. Each
+piece is read from storage in a shared thread pool, and the event loop
+sends it to the client at the client's pace. Under WSGI, the plain sync
+responses stay in use, including FileResponse's sendfile.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
+from rest_framework.views import APIView
+
+_executor = None
+_executor_lock = Lock()
+
+
+def storage_executor():
+    """The pool blocking storage reads run in, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.VAULT_ASYNC_STORAGE_THREADS, thread_name_prefix='vault-storage'
+            )
+        return _executor
+
+
+async def run_in_storage_pool(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(storage_executor(), partial(func, *args, **kwargs))
+
+
+async def aiter_in_pool(iterator):
+    """
+    Iterate a blocking iterator from async code, one item at a time in the
+    storage pool. The iterator is closed when the consumer stops early, for
+    example when the client disconnects.
+    """
+    done = object()
+    try:
+        while True:
+            item = await run_in_storage_pool(next, iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await run_in_storage_pool(close)
+
+
+def is_asgi(request):
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+def streaming_response(request, content, **kwargs):
+    """A StreamingHttpResponse over the blocking iterator `content` that streams under ASGI too"""
+    if is_asgi(request):
+        content = aiter_in_pool(content)
+    return StreamingHttpResponse(content, **kwargs)
+
+
+def _read_file(file, read_size):
+    with file:
+        yield from iter(lambda: file.read(read_size), b'')
+
+
+def file_response(request, path, **kwargs):
+    """Serve a local file, with sendfile under WSGI servers that support it. Raises OSError if it can't be opened."""
+    file = open(path, 'rb')
+    if not is_asgi(request):
+        return FileResponse(file, **kwargs)
+    response = streaming_response(request, _read_file(file, settings.VAULT_DOWNLOAD_CHUNK_SIZE), **kwargs)
+    response['Content-Length'] = str(os.fstat(file.fileno()).st_size)
+    return response
+
+
+async def request_data(request):
+    """A DRF request's parsed body, read in a thread: under WSGI it may still be arriving"""
+    return await sync_to_async(lambda: request.data)()
+
+
+class AsyncAPIView(APIView):
+    """
+    An APIView whose handlers are `async def`, which Django then serves as an
+    async view. Authentication and permission checks may query the database,
+    so they run through sync_to_async, like everything else that does.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            # OPTIONS and the not-allowed handler are APIView's sync ones
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
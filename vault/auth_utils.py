@@ -0,0 +1,105 @@
+"""
+Stateless JWT authentication.
+
+simplejwt's JWTAuthentication loads the User row on every request. Here the
+user is built from the token alone: a User instance with only its primary
+key loaded, whose other fields are fetched from the database on first
+access (Django's deferred fields). The many views that only filter by
+`request.user` authenticate without a query, and the ones that read the
+profile or the email load just that.
+
+Revoked access tokens (logged out before they expire) are checked against
+a set of token ids kept in the process and reloaded from the database every
+VAULT_REVOKED_TOKENS_REFRESH seconds, whatever the cache backend. A
+revocation therefore takes effect in every process within that interval.
+
+Requests that write (any method but GET, HEAD and OPTIONS) check that the
+user still exists and is active, with one indexed query, so the token of a
+deleted user is refused with a 401 instead of failing on a foreign key at
+commit. Reads filter by the user and simply find nothing; the ones that need
+the user's row or profile raise UserNotFound when it is gone.
+"""
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import RevokedToken
+
+_revoked = {'ids': frozenset(), 'loaded_at': None}
+_revoked_lock = threading.Lock()
+
+
+def revoked_token_ids():
+    """The ids (jti) of unexpired revoked access tokens"""
+    loaded_at = _revoked['loaded_at']
+    if loaded_at is not None and time.monotonic() - loaded_at < settings.VAULT_REVOKED_TOKENS_REFRESH:
+        return _revoked['ids']
+
+    with _revoked_lock:
+        ids = frozenset(RevokedToken.objects.filter(expires_at__gt=timezone.now()).values_list('jti', flat=True))
+        _revoked['ids'] = ids
+        _revoked['loaded_at'] = time.monotonic()
+    return ids
+
+
+def revoke_token(token):
+    """Revoke a validated access token until it expires"""
+    expires_at = datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=token[api_settings.JTI_CLAIM], expires_at=expires_at)
+    except IntegrityError:
+        return  # Already revoked
+    RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+
+    def invalidate():
+        # This process sees the revocation on its next request, the others on their next reload
+        _revoked['loaded_at'] = None
+
+    transaction.on_commit(invalidate)
+
+
+class UserNotFound(AuthenticationFailed):
+    """The token is valid but its user has been deleted or deactivated"""
+    default_detail = 'User not found.'
+    default_code = 'user_not_found'
+
+
+def lazy_user(user_id):
+    """A User with only its primary key loaded, other fields load on first access"""
+    return User.from_db(DEFAULT_DB_ALIAS, ['id'], [user_id])
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that trusts the token's claims instead of loading the user"""
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None and request.method not in SAFE_METHODS:
+            user = result[0]
+            if not User.objects.filter(pk=user.pk, is_active=True).exists():
+                raise UserNotFound()
+        return result
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if token.get(api_settings.JTI_CLAIM) in revoked_token_ids():
+            raise InvalidToken({'detail': 'Token has been revoked.', 'code': 'token_not_valid'})
+        return token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+        return lazy_user(user_id)
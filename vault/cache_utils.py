@@ -0,0 +1,90 @@
+"""
+Cached folder listings.
+
+A listing response is cached per user and request, under the user's
+listing version: a counter on their profile row. Every change that shows
+up in a user's listings bumps it in the same transaction, which
+invalidates all of that user's cached listings at once, in every worker
+process whatever the cache backend:
+- files uploaded, replaced or deleted
+- folders created, moved or deleted
+- thumbnails finished
+
+A lookup costs one indexed read of the version and one cache get. Entries
+expire after VAULT_LISTING_CACHE_TIMEOUT seconds, well before the
+presigned URLs in them do; a rebuilt entry gets a new ETag, so clients
+pick up the fresh URLs.
+"""
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .compression_utils import GZIP, ZSTD, accepts_encoding
+from .models import UserFile, UserProfile
+
+
+def listing_version(user_id):
+    return UserProfile.objects.filter(user_id=user_id).values_list('listing_version', flat=True).first()
+
+
+def listing_cache_key(user_id, request):
+    """
+    Cache key of the listing `request` asks for under the user's current
+    listing version, covering everything the response depends on
+    """
+    params = {
+        'query': sorted(request.query_params.lists()),
+        # Absolute URLs in the response, and whether compressed files can be presigned
+        'base_url': request.build_absolute_uri('/'),
+        'encodings': [encoding for encoding in (ZSTD, GZIP) if accepts_encoding(request, encoding)],
+    }
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return f'vault:listing:{user_id}:{listing_version(user_id)}:{digest}'
+
+
+def get_cached_listing(key):
+    """The cached listing under `key`, with 'etag' and 'data', or None"""
+    return cache.get(key)
+
+
+def cache_listing(key, data):
+    """Cache a listing, returns the entry"""
+    entry = {'etag': f'"{uuid.uuid4().hex}"', 'data': data}
+    cache.set(key, entry, timeout=settings.VAULT_LISTING_CACHE_TIMEOUT)
+    return entry
+
+
+def invalidate_listings(user_ids):
+    """
+    Bump the users' listing versions in the current transaction. Listings
+    read before it commits are cached under the old version, so they are
+    never served afterwards. Call it with the users' profiles locked, as
+    every quota change does, or outside a transaction.
+    """
+    user_ids = set(user_ids)
+    if user_ids:
+        UserProfile.objects.filter(user_id__in=user_ids).update(listing_version=F('listing_version') + 1)
+
+
+def invalidate_stored_file_listings(stored_file_ids):
+    """
+    Invalidate the listings of every user with a file on these stored files
+    (e.g. a new thumbnail). Callers may hold stored file locks, so the
+    profiles are only locked once the transaction commits, in a stable order.
+    """
+    user_ids = list(
+        UserFile.objects.filter(stored_file__in=stored_file_ids, is_deleted=False).values_list('user_id', flat=True).distinct()
+    )
+
+    def bump():
+        with transaction.atomic():
+            list(UserProfile.objects.select_for_update().filter(user_id__in=user_ids).order_by('pk').values_list('pk'))
+            invalidate_listings(user_ids)
+
+    if user_ids:
+        transaction.on_commit(bump)
@@ -0,0 +1,275 @@
+"""
+Content-defined chunking for sub-file deduplication.
+
+Chunk boundaries are found with FastCDC: a Gear rolling hash over the bytes
+after the minimum chunk size, cut where the hash's top bits are all zero.
+A stricter mask before the average size and a looser one after it
+(normalized chunking) keep chunk sizes close to the average. Since cut
+points depend only on nearby content, an edit changes the chunks around it
+and the rest of the file still deduplicates against earlier versions.
+
+The Gear table is the first 8 bytes (big-endian) of SHA-256(bytes([i])) for
+each byte value i, so clients can compute the same boundaries.
+"""
+import hashlib
+import json
+from collections import Counter
+from io import BytesIO
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.utils import timezone
+
+from .models import Chunk, FileChunk, StoredFile, UserChunk
+from .storage import storage
+from .upload_utils import acquire_stored_file
+
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)]
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+READ_SIZE = 1024 * 1024
+MANIFEST_PREFIX = b'vault-chunk-manifest-v1\n'
+
+
+def chunking_params():
+    """
+    The chunk sizes in use, as clients need them to cut matching chunks.
+    `file_hash` says what a chunked file's hash is: the manifest hash, not
+    the SHA-256 of its content, so a chunked upload and a whole-file upload
+    of the same bytes are two stored files.
+    """
+    return {
+        'algorithm': 'fastcdc',
+        'min_size': settings.VAULT_CHUNK_MIN_SIZE,
+        'avg_size': settings.VAULT_CHUNK_AVG_SIZE,
+        'max_size': settings.VAULT_CHUNK_MAX_SIZE,
+        'file_hash': 'manifest',
+    }
+
+
+def cut_masks(avg_size):
+    """Masks over the hash's top bits, 2 bits stricter and looser than the average"""
+    bits = max(avg_size.bit_length() - 1, 3)
+    return (
+        ((1 << (bits + 2)) - 1) << (HASH_BITS - bits - 2),
+        ((1 << (bits - 2)) - 1) << (HASH_BITS - bits + 2),
+    )
+
+
+def cut_point(data, start, end, min_size, avg_size, max_size, masks):
+    """Offset in `data` where the chunk starting at `start` ends, at most `end`"""
+    if end - start <= min_size:
+        return end
+    end = min(end, start + max_size)
+    normal = min(end, start + avg_size)
+    strict_mask, loose_mask = masks
+    gear = GEAR
+    fingerprint = 0
+
+    # Cut-point skipping: no boundary can fall inside the minimum size
+    i = start + min_size
+    while i < normal:
+        fingerprint = ((fingerprint << 1) + gear[data[i]]) & HASH_MASK
+        if not fingerprint & strict_mask:
+            return i + 1
+        i += 1
+    while i < end:
+        fingerprint = ((fingerprint << 1) + gear[data[i]]) & HASH_MASK
+        if not fingerprint & loose_mask:
+            return i + 1
+        i += 1
+    return end
+
+
+def iter_chunks(stream, min_size=None, avg_size=None, max_size=None):
+    """Split a binary stream into content-defined chunks, yielding bytes"""
+    min_size = min_size or settings.VAULT_CHUNK_MIN_SIZE
+    avg_size = avg_size or settings.VAULT_CHUNK_AVG_SIZE
+    max_size = max_size or settings.VAULT_CHUNK_MAX_SIZE
+    masks = cut_masks(avg_size)
+
+    buffer = b''
+    eof = False
+    while True:
+        # Keep a full maximum chunk buffered so cut points never depend on read sizes
+        while not eof and len(buffer) < max_size:
+            data = stream.read(max(READ_SIZE, max_size - len(buffer)))
+            if not data:
+                eof = True
+            buffer += data
+        if not buffer:
+            return
+
+        start = 0
+        while len(buffer) - start >= max_size or (eof and start < len(buffer)):
+            end = cut_point(buffer, start, len(buffer), min_size, avg_size, max_size, masks)
+            yield buffer[start:end]
+            start = end
+        buffer = buffer[start:]
+
+
+def chunk_key(chunk_hash):
+    return f'chunks/{chunk_hash}'
+
+
+def manifest_hash(chunk_hashes):
+    """
+    Identity of a chunked stored file. Derived from the chunk hashes the
+    server verified, so it needs no read-back of the whole content.
+    """
+    return hashlib.sha256(MANIFEST_PREFIX + '\n'.join(chunk_hashes).encode()).hexdigest()
+
+
+def store_chunk(user, chunk_hash, body):
+    """
+    Store a chunk the user uploaded, unreferenced until a file uses it. A
+    chunk that is already stored only has its grace period renewed. Either
+    way the user may use it from now on. Returns False if the upload to S3
+    failed.
+    """
+    now = timezone.now()
+    renewed = Chunk.objects.filter(chunk_hash=chunk_hash).update(
+        orphaned_at=Case(When(ref_count=0, then=Value(now)), default=F('orphaned_at'))
+    )
+    if not renewed:
+        key = chunk_key(chunk_hash)
+        if not storage.upload_fileobj(BytesIO(body), key):
+            return False
+        try:
+            with transaction.atomic():
+                Chunk.objects.create(chunk_hash=chunk_hash, s3_key=key, size=len(body), orphaned_at=now)
+        except IntegrityError:
+            pass  # Stored by a concurrent upload of the same chunk
+    grant_chunks(user, Chunk.objects.filter(chunk_hash=chunk_hash))
+    return True
+
+
+def grant_chunks(user, chunks):
+    UserChunk.objects.bulk_create((UserChunk(user=user, chunk=chunk) for chunk in chunks), ignore_conflicts=True)
+
+
+def missing_chunks(user, chunk_hashes):
+    """
+    The chunks among `chunk_hashes` the user has to upload: those that are
+    not stored, and those the user never uploaded. Whether other users
+    stored a chunk is never revealed, a hash is no proof of having it.
+    """
+    granted = set(
+        UserChunk.objects.filter(user=user, chunk__chunk_hash__in=set(chunk_hashes)).values_list('chunk__chunk_hash', flat=True)
+    )
+    return [chunk_hash for chunk_hash in dict.fromkeys(chunk_hashes) if chunk_hash not in granted]
+
+
+def create_chunked_stored_file(user, chunk_hashes):
+    """
+    Assemble a chunked stored file from chunks the user uploaded, holding
+    one reference. Returns (stored_file, created), or (None, missing_hashes)
+    when some chunks are not stored for the user (or were reclaimed
+    meanwhile), and (None, []) when the manifest could not be written to S3.
+    """
+    missing = missing_chunks(user, chunk_hashes)
+    if missing:
+        return None, missing
+
+    file_hash = manifest_hash(chunk_hashes)
+    stored_file = acquire_stored_file(file_hash)
+    if stored_file is not None:
+        return stored_file, False
+
+    chunks = {chunk.chunk_hash: chunk for chunk in Chunk.objects.filter(chunk_hash__in=set(chunk_hashes))}
+    missing = [chunk_hash for chunk_hash in dict.fromkeys(chunk_hashes) if chunk_hash not in chunks]
+    if missing:
+        return None, missing
+
+    manifest = json.dumps({'chunks': chunk_hashes}).encode()
+    if not storage.upload_fileobj(BytesIO(manifest), f'manifests/{file_hash}'):
+        return None, []
+
+    entries = []
+    offset = 0
+    for index, chunk_hash in enumerate(chunk_hashes):
+        entries.append((index, offset, chunks[chunk_hash]))
+        offset += chunks[chunk_hash].size
+
+    while True:
+        try:
+            with transaction.atomic():
+                stored_file = StoredFile.objects.create(
+                    file_hash=file_hash, s3_key=f'manifests/{file_hash}', size=offset, chunked=True, ref_count=1
+                )
+                if not reference_chunks(Counter(chunk_hashes)):
+                    # A reclaimer deleted a chunk after it was looked up
+                    raise Chunk.DoesNotExist
+                FileChunk.objects.bulk_create(
+                    FileChunk(stored_file=stored_file, index=index, offset=chunk_offset, chunk=chunk)
+                    for index, chunk_offset, chunk in entries
+                )
+            return stored_file, True
+        except Chunk.DoesNotExist:
+            return None, missing_chunks(user, chunk_hashes)
+        except IntegrityError:
+            stored_file = acquire_stored_file(file_hash)
+            if stored_file is not None:
+                return stored_file, False
+            # The other row was reclaimed in between, try inserting again
+
+
+def reference_chunks(counts):
+    """Take `counts[hash]` references on each chunk, False if any is gone"""
+    by_count = {}
+    for chunk_hash, count in counts.items():
+        by_count.setdefault(count, []).append(chunk_hash)
+    # One UPDATE per distinct repeat count, usually just one
+    updated = 0
+    for count, chunk_hashes in by_count.items():
+        updated += Chunk.objects.filter(chunk_hash__in=chunk_hashes).update(
+            ref_count=F('ref_count') + count, orphaned_at=None
+        )
+    return updated == len(counts)
+
+
+def release_file_chunks(stored_files):
+    """Drop the chunk references of stored files about to be deleted"""
+    entries = FileChunk.objects.filter(stored_file__in=stored_files)
+    references = entries.filter(chunk=OuterRef('pk')).values('chunk').annotate(count=Count('pk')).values('count')
+    Chunk.objects.filter(pk__in=entries.values('chunk')).update(
+        ref_count=F('ref_count') - Subquery(references),
+        orphaned_at=Case(When(ref_count=Subquery(references), then=Value(timezone.now())), default=F('orphaned_at')),
+    )
+
+
+def iter_stored_content(stored_file, read_size=READ_SIZE, byte_range=None):
+    """
+    Iterate over the stored bytes of a file, or of the inclusive (first,
+    last) `byte_range` of them, reassembling chunked files chunk by chunk.
+    Only `read_size` bytes are held at a time. The database is queried
+    here, so the iterator itself only reads storage and can run in any
+    thread. It raises IOError if an object cannot be read, which aborts a
+    streaming response that has already started.
+    """
+    if stored_file.chunked:
+        entries = FileChunk.objects.filter(stored_file=stored_file)
+        if byte_range is not None:
+            # Only the chunks overlapping the range
+            entries = entries.filter(offset__lte=byte_range[1], offset__gt=Value(byte_range[0]) - F('chunk__size'))
+        pieces = list(entries.order_by('index').values_list('chunk__s3_key', 'offset', 'chunk__size'))
+    else:
+        pieces = [(stored_file.s3_key, 0, stored_file.stored_size)]
+    return _iter_pieces(pieces, read_size, byte_range)
+
+
+def _iter_pieces(pieces, read_size, byte_range):
+    for key, offset, size in pieces:
+        piece_range = None
+        if byte_range is not None:
+            first, last = max(byte_range[0] - offset, 0), min(byte_range[1] - offset, size - 1)
+            if (first, last) != (0, size - 1):
+                piece_range = (first, last)
+        body = storage.get_object_stream(key, byte_range=piece_range)
+        if body is None:
+            raise IOError(f"Could not read {key} from storage")
+        try:
+            yield from body.iter_chunks(chunk_size=read_size)
+        finally:
+            body.close()
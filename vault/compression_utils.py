@@ -0,0 +1,97 @@
+"""
+Transparent compression of stored content.
+
+Uploads are sampled (the same head that is sniffed for thumbnails) and
+compressed on the fly when the sample shrinks enough, with zstd if the
+`zstandard` package is installed and gzip otherwise. Images, video and
+audio are never compressed, they are compressed already and previews read
+them as-is. The choice depends on the content alone, so every upload of the
+same content picks the same encoding and so the same object key.
+The object carries a matching Content-Encoding, so clients that accept the
+encoding download it as stored; for the others the API decompresses it.
+"""
+import zlib
+
+from django.conf import settings
+
+from .thumbnail_utils import detect_media_kind
+
+try:
+    import zstandard
+except ImportError:  # Optional, gzip is used without it
+    zstandard = None
+
+IDENTITY = 'identity'
+ZSTD = 'zstd'
+GZIP = 'gzip'
+ENCODING_CHOICES = [(IDENTITY, 'Identity'), (ZSTD, 'Zstandard'), (GZIP, 'Gzip')]
+KEY_SUFFIXES = {IDENTITY: '', ZSTD: '.zst', GZIP: '.gz'}
+# zlib's wbits for a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def stored_object_key(file_hash, encoding):
+    """
+    Content is keyed by hash and encoding, so uploads of the same content
+    with different encodings never overwrite each other's object.
+    """
+    return file_hash + KEY_SUFFIXES[encoding]
+
+
+def compressor(encoding):
+    """A streaming compressor with compress(data) and flush()"""
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=settings.VAULT_COMPRESSION_LEVEL or 3).compressobj()
+    return zlib.compressobj(settings.VAULT_COMPRESSION_LEVEL or 6, zlib.DEFLATED, GZIP_WBITS)
+
+
+def choose_encoding(sample):
+    """The encoding to store content starting with `sample` in"""
+    if not settings.VAULT_COMPRESSION_ENABLED or not sample or detect_media_kind(sample):
+        return IDENTITY
+
+    encoding = ZSTD if zstandard is not None else GZIP
+    sample_compressor = compressor(encoding)
+    compressed_size = len(sample_compressor.compress(sample)) + len(sample_compressor.flush())
+    if compressed_size > len(sample) * (1 - settings.VAULT_COMPRESSION_MIN_SAVING):
+        return IDENTITY
+    return encoding
+
+
+def decode_stream(chunks, encoding):
+    """Decompress an iterable of encoded chunks as a stream"""
+    if encoding == IDENTITY:
+        yield from chunks
+        return
+
+    decompressor = zstandard.ZstdDecompressor().decompressobj() if encoding == ZSTD else zlib.decompressobj(GZIP_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if encoding == GZIP:
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+def accepts_encoding(request, encoding):
+    """Whether the request's Accept-Encoding allows `encoding`"""
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        token, _, params = item.strip().partition(';')
+        if token.strip().lower() in (encoding, '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def presignable(stored_file, request=None):
+    """
+    Whether a client may download the stored object directly. Chunked
+    content, and compressed content for clients that don't accept its
+    encoding, is served through the API instead.
+    """
+    if stored_file.chunked:
+        return False
+    if stored_file.encoding == IDENTITY:
+        return True
+    return request is not None and accepts_encoding(request, stored_file.encoding)
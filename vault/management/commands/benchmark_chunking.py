@@ -0,0 +1,105 @@
+import hashlib
+import os
+import random
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from vault.chunk_utils import iter_chunks
+
+READ_SIZE = 1024 * 1024
+
+
+def synthetic_versions(count, size, edits, seed):
+    """A random base file followed by versions that each add a few small inserts, deletes and overwrites"""
+    rng = random.Random(seed)
+    data = bytearray(rng.randbytes(size))
+    yield 'v0', bytes(data)
+    for version in range(1, count):
+        for _ in range(edits):
+            offset = rng.randrange(len(data))
+            edit = rng.choice(('insert', 'delete', 'overwrite'))
+            length = rng.randint(1, 4096)
+            if edit == 'insert':
+                data[offset:offset] = rng.randbytes(length)
+            elif edit == 'delete':
+                del data[offset:offset + length]
+            else:
+                data[offset:offset + length] = rng.randbytes(len(data[offset:offset + length]))
+        yield f'v{version}', bytes(data)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare whole-file deduplication with content-defined chunking: bytes that would be stored "
+        "and hashing throughput. Pass files (e.g. successive versions of a document) or use --synthetic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Files to store, in order.')
+        parser.add_argument('--synthetic', type=int, metavar='VERSIONS',
+                            help='Generate this many edited versions of a random file instead.')
+        parser.add_argument('--size', type=int, default=32 * 1024 * 1024, help='Size of the synthetic file.')
+        parser.add_argument('--edits', type=int, default=5, help='Edits per synthetic version.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--min-size', type=int, default=settings.VAULT_CHUNK_MIN_SIZE)
+        parser.add_argument('--avg-size', type=int, default=settings.VAULT_CHUNK_AVG_SIZE)
+        parser.add_argument('--max-size', type=int, default=settings.VAULT_CHUNK_MAX_SIZE)
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            inputs = synthetic_versions(options['synthetic'], options['size'], options['edits'], options['seed'])
+        elif options['paths']:
+            inputs = ((path, path) for path in options['paths'])
+        else:
+            raise CommandError("Pass files to benchmark or --synthetic VERSIONS.")
+
+        total = 0
+        files, file_bytes, file_seconds = set(), 0, 0.0
+        chunks, chunk_bytes, chunk_count, chunk_seconds = set(), 0, 0, 0.0
+
+        for name, source in inputs:
+            # Whole-file scheme: one SHA-256 over the content
+            started = time.perf_counter()
+            sha256 = hashlib.sha256()
+            size = 0
+            with self.open(source) as stream:
+                for data in iter(lambda: stream.read(READ_SIZE), b''):
+                    sha256.update(data)
+                    size += len(data)
+            file_seconds += time.perf_counter() - started
+            total += size
+            if sha256.digest() not in files:
+                files.add(sha256.digest())
+                file_bytes += size
+
+            # Chunked scheme: FastCDC boundaries plus one SHA-256 per chunk
+            started = time.perf_counter()
+            new_bytes = 0
+            with self.open(source) as stream:
+                for chunk in iter_chunks(stream, options['min_size'], options['avg_size'], options['max_size']):
+                    chunk_count += 1
+                    digest = hashlib.sha256(chunk).digest()
+                    if digest not in chunks:
+                        chunks.add(digest)
+                        new_bytes += len(chunk)
+            chunk_seconds += time.perf_counter() - started
+            chunk_bytes += new_bytes
+            self.stdout.write(f"{name}: {size} bytes, {new_bytes} new in chunks")
+
+        if not total:
+            raise CommandError("Nothing to benchmark.")
+        self.report('Whole file', total, file_bytes, file_seconds, len(files))
+        self.report('Chunked', total, chunk_bytes, chunk_seconds, len(chunks))
+        self.stdout.write(f"Chunks referenced: {chunk_count}, average size {total // max(chunk_count, 1)} bytes")
+
+    def open(self, source):
+        return BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+
+    def report(self, scheme, total, stored, seconds, objects):
+        self.stdout.write(self.style.SUCCESS(
+            f"{scheme}: stored {stored} of {total} bytes in {objects} object(s), "
+            f"dedup ratio {total / max(stored, 1):.2f}x, {total / max(seconds, 1e-9) / 1024 / 1024:.1f} MiB/s"
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from vault.upload_utils import expire_upload_sessions, expired_upload_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete expired upload sessions, aborting unfinished uploads. Run it periodically (e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Sessions to expire per batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        while True:
+            count = expire_upload_sessions(expired_upload_sessions()[:batch_size])
+            total += count
+            if count < batch_size:
+                break
+        self.stdout.write(self.style.SUCCESS(f"Expired {total} upload session(s)."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from vault.storage_utils import purge_deleted_folders, reclaim_orphaned_chunks, reclaim_orphaned_files
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete stored files and chunks orphaned for longer than VAULT_ORPHAN_GRACE_PERIOD from S3 "
+        "and purge deleted folders. Run it periodically (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows to reclaim per batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        files = 0
+        while True:
+            count = reclaim_orphaned_files(batch_size)
+            files += count
+            if count < batch_size:
+                break
+
+        # After the files, whose reclaiming orphans their chunks
+        chunks = 0
+        while True:
+            count = reclaim_orphaned_chunks(batch_size)
+            chunks += count
+            if count < batch_size:
+                break
+
+        folders = 0
+        while True:
+            # A batch purges one level of a tree, the next finds its parents
+            count = purge_deleted_folders(batch_size)
+            folders += count
+            if not count:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f"Reclaimed {files} stored file(s) and {chunks} chunk(s), purged {folders} folder(s)."))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from vault.quota_utils import reconcile_quotas
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every user's storage_used from the sizes of their live files and storage_reserved "
+        "from their unexpired quota reservations, correcting any drift. Run it periodically (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Profiles to reconcile per transaction.')
+
+    def handle(self, *args, **options):
+        corrected = 0
+        for batch in reconcile_quotas(max(1, options['batch_size'])):
+            for user_id, used, actual_used, reserved, actual_reserved in batch:
+                self.stdout.write(
+                    f"user {user_id}: storage_used {used} -> {actual_used}, storage_reserved {reserved} -> {actual_reserved}"
+                )
+            corrected += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Corrected {corrected} profile(s)."))
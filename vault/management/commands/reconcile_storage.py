@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from vault.reconcile_utils import Checkpoint, Reconciler, key_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the bucket with the database and report objects no row refers to and rows "
+        "whose object is missing. With --repair, unreferenced objects are deleted and missing "
+        "thumbnails and renditions are queued to be rendered again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Key ranges to scan in parallel.')
+        parser.add_argument('--repair', action='store_true', help='Fix what is found instead of only reporting it.')
+        parser.add_argument('--checkpoint', help='JSON file to save progress to and resume from.')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Seconds an object must have existed before it is treated as unreferenced.')
+        parser.add_argument('--page-size', type=int, default=1000, help='Objects to list per request (at most 1000).')
+
+    def handle(self, *args, **options):
+        partitions = key_partitions()
+        try:
+            checkpoint = Checkpoint(options['checkpoint'], partitions)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = threading.Lock()
+
+        def report(finding, key):
+            with output:
+                self.stdout.write(f"{finding}\t{key}")
+
+        reconciler = Reconciler(
+            repair=options['repair'], min_age=options['min_age'], page_size=min(options['page_size'], 1000),
+            checkpoint=checkpoint, report=report,
+        )
+
+        def scan(index):
+            try:
+                reconciler.scan(index, *partitions[index])
+            finally:
+                connection.close()
+
+        pending = [index for index in range(len(partitions)) if not checkpoint.is_done(index)]
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            futures = [pool.submit(scan, index) for index in pending]
+            errors = [future.exception() for future in futures if future.exception()]
+        if errors:
+            raise CommandError(f"{len(errors)} key range(s) could not be scanned, run again to resume: {errors[0]}")
+
+        counts = reconciler.counts
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {counts['objects']} object(s): {counts['unreferenced']} unreferenced, "
+            f"{counts['missing_content']} missing content, {counts['missing_chunk']} missing chunk(s), "
+            f"{counts['missing_thumbnail']} missing thumbnail(s), "
+            f"{counts['missing_rendition']} missing rendition(s), {counts['repaired']} repaired."
+        ))
@@ -0,0 +1,65 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from vault.thumbnail_queue import claim_thumbnail_jobs, complete_thumbnail_job, fail_thumbnail_job, render_thumbnail
+
+
+def init_worker_process(video_slots):
+    # Spawned processes start from a clean interpreter
+    django.setup()
+    from vault.thumbnail_utils import set_video_thumbnail_limiter
+    set_video_thumbnail_limiter(video_slots)
+
+
+class Command(BaseCommand):
+    help = "Render queued thumbnails in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.VAULT_THUMBNAIL_WORKERS,
+                            help='Number of worker processes.')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait before polling an empty queue again.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is drained instead of polling forever.')
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        poll_interval = options['poll_interval']
+        context = multiprocessing.get_context('spawn')
+        video_slots = context.BoundedSemaphore(settings.VAULT_VIDEO_THUMBNAIL_CONCURRENCY)
+        self.stdout.write(f"Starting thumbnail worker with {processes} process(es)")
+
+        pending = {}
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                 initializer=init_worker_process, initargs=(video_slots,)) as pool:
+            while True:
+                close_old_connections()
+                # Keep every process busy, with one job queued behind each
+                free = processes * 2 - len(pending)
+                if free > 0:
+                    for job in claim_thumbnail_jobs(free):
+                        stored_file = job.stored_file
+                        future = pool.submit(render_thumbnail, stored_file.s3_key, stored_file.file_hash, stored_file.media_kind)
+                        pending[future] = job
+
+                if not pending:
+                    if options['once']:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = pending.pop(future)
+                    try:
+                        complete_thumbnail_job(job, future.result())
+                    except Exception as e:
+                        fail_thumbnail_job(job, e)
+
+        self.stdout.write(self.style.SUCCESS("Thumbnail queue drained."))
@@ -0,0 +1,61 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from vault.upload_utils import claim_upload_verifications, verify_upload_session
+
+
+def verify(session):
+    try:
+        return verify_upload_session(session)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Verify completed upload sessions against their declared SHA-256 and register their files. "
+        "Reading objects back is I/O bound, so sessions are verified in threads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.VAULT_UPLOAD_VERIFY_THREADS,
+                            help='Sessions to verify at once.')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait before polling an empty queue again.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is drained instead of polling forever.')
+
+    def handle(self, *args, **options):
+        threads = max(1, options['threads'])
+        poll_interval = options['poll_interval']
+        self.stdout.write(f"Starting upload verifier with {threads} thread(s)")
+
+        pending = {}
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='vault-verify') as pool:
+            while True:
+                close_old_connections()
+                free = threads - len(pending)
+                if free > 0:
+                    for session in claim_upload_verifications(free):
+                        pending[pool.submit(verify, session)] = session
+
+                if not pending:
+                    if options['once']:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    session = pending.pop(future)
+                    try:
+                        self.stdout.write(f"{session.pk}\t{future.result()}")
+                    except Exception as e:
+                        # Left claimed, so it is retried after VAULT_UPLOAD_VERIFY_TIMEOUT
+                        self.stderr.write(f"{session.pk}\terror: {e}")
+
+        self.stdout.write(self.style.SUCCESS("Upload verification queue drained."))
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_existing_thumbnails(apps, schema_editor):
+    StoredFile = apps.get_model('vault', 'StoredFile')
+    Rendition = apps.get_model('vault', 'Rendition')
+    renditions = [
+        Rendition(stored_file_id=stored_file_id, size=128, format='jpeg', s3_key=s3_key)
+        for stored_file_id, s3_key in StoredFile.objects.filter(thumbnail_status='ready')
+        .exclude(thumbnail_s3_key__isnull=True).values_list('id', 'thumbnail_s3_key')
+    ]
+    Rendition.objects.bulk_create(renditions, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0005_thumbnail_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='media_kind',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.PositiveIntegerField()),
+                ('format', models.CharField(max_length=8)),
+                ('s3_key', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('stored_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='vault.storedfile')),
+            ],
+            options={
+                'unique_together': {('stored_file', 'size', 'format')},
+            },
+        ),
+        migrations.RunPython(index_existing_thumbnails, migrations.RunPython.noop),
+    ]
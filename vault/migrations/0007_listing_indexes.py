@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_stored_file_sizes(apps, schema_editor):
+    StoredFile = apps.get_model('vault', 'StoredFile')
+    UserFile = apps.get_model('vault', 'UserFile')
+    UserFile.objects.update(
+        size=models.Subquery(StoredFile.objects.filter(pk=models.OuterRef('stored_file_id')).values('size')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0006_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfile',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(copy_stored_file_sizes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['user', 'parent', 'created_at', 'id'], name='folder_listing_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'folder', 'is_deleted', 'name', 'id'], name='userfile_listing_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'folder', 'is_deleted', 'created_at', 'id'], name='userfile_listing_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'folder', 'is_deleted', 'size', 'id'], name='userfile_listing_size_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:59
+
+"""
+Rebuilds the listing indexes of 0007 as covering indexes (INCLUDE). 0007
+was released, and may already be applied, before the columns were added, so
+the rebuild is a migration of its own rather than an edit of 0007: a
+database that ran 0007 would otherwise keep the narrower indexes. Postgres
+cannot add INCLUDE columns to an existing index, hence the drop and create.
+"""
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0007_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='folder',
+            name='folder_listing_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='userfile',
+            name='userfile_listing_name_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='userfile',
+            name='userfile_listing_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='userfile',
+            name='userfile_listing_size_idx',
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['user', 'parent', 'created_at', 'id'], include=('name',), name='folder_listing_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'folder', 'is_deleted', 'name', 'id'], include=('stored_file', 'size', 'created_at'), name='userfile_listing_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'folder', 'is_deleted', 'created_at', 'id'], include=('stored_file', 'name', 'size'), name='userfile_listing_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'folder', 'is_deleted', 'size', 'id'], include=('stored_file', 'name', 'created_at'), name='userfile_listing_size_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:01
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0008_covering_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='folder',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector(models.Func(models.F('name'), models.Value('[[:punct:][:space:]]+'), models.Value(' '), models.Value('g'), function='regexp_replace'), config='simple'), name='folder_name_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector(models.Func(models.F('name'), models.Value('[[:punct:][:space:]]+'), models.Value(' '), models.Value('g'), function='regexp_replace'), config='simple'), condition=models.Q(('is_deleted', False)), name='userfile_name_search_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:03
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Cast, Concat
+
+
+def build_folder_paths(apps, schema_editor):
+    Folder = apps.get_model('vault', 'Folder')
+    folder_id = Cast('id', models.TextField())
+    Folder.objects.filter(parent__isnull=True).update(path=Concat(folder_id, models.Value('/'), output_field=models.TextField()))
+
+    # One UPDATE per tree level, each child takes its parent's finished path
+    parent_path = Folder.objects.filter(pk=models.OuterRef('parent_id')).values('path')[:1]
+    while Folder.objects.filter(path='').exclude(parent__path='').update(
+        path=Concat(models.Subquery(parent_path), folder_id, models.Value('/'), output_field=models.TextField())
+    ):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0009_name_search_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(build_folder_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['path'], name='folder_path_idx', opclasses=['text_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0010_folder_paths'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='folder',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='is_deleted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddConstraint(
+            model_name='folder',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False)), fields=('user', 'parent', 'name'), name='unique_live_folder_name'),
+        ),
+    ]
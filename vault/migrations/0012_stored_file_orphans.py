@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:10
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_existing_orphans(apps, schema_editor):
+    # Unreferenced rows left by earlier code start their grace period now
+    StoredFile = apps.get_model('vault', 'StoredFile')
+    StoredFile.objects.filter(ref_count=0).update(orphaned_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0011_folder_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='orphaned_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_orphans, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='storedfile',
+            index=models.Index(condition=models.Q(('ref_count', 0)), fields=['orphaned_at'], name='storedfile_orphaned_idx'),
+        ),
+    ]
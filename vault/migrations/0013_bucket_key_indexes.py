@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:13
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0012_stored_file_orphans'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rendition',
+            index=models.Index(django.db.models.functions.comparison.Collate('s3_key', 'C'), name='rendition_key_c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storedfile',
+            index=models.Index(django.db.models.functions.comparison.Collate('s3_key', 'C'), name='storedfile_key_c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storedfile',
+            index=models.Index(django.db.models.functions.comparison.Collate('thumbnail_s3_key', 'C'), name='storedfile_thumb_key_c_idx'),
+        ),
+    ]
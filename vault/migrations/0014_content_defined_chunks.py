@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:17
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0013_bucket_key_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='chunked',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='Chunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_hash', models.CharField(max_length=64, unique=True)),
+                ('s3_key', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('orphaned_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('ref_count', 0)), fields=['orphaned_at'], name='chunk_orphaned_idx'), models.Index(django.db.models.functions.comparison.Collate('s3_key', 'C'), name='chunk_key_c_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FileChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('offset', models.BigIntegerField()),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='file_chunks', to='vault.chunk')),
+                ('stored_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_chunks', to='vault.storedfile')),
+            ],
+            options={
+                'unique_together': {('stored_file', 'index')},
+            },
+        ),
+    ]
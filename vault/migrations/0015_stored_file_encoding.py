@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:30
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_stored_size(apps, schema_editor):
+    # Everything stored so far is uncompressed
+    StoredFile = apps.get_model('vault', 'StoredFile')
+    StoredFile.objects.update(stored_size=F('size'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0014_content_defined_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='encoding',
+            field=models.CharField(choices=[('identity', 'Identity'), ('zstd', 'Zstandard'), ('gzip', 'Gzip')], default='identity', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='storedfile',
+            name='stored_size',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_stored_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:43
+
+import django.db.models.deletion
+import uuid
+import vault.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0016_revoked_tokens'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='storage_reserved',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='QuotaReservation',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True, default=vault.models.quota_reservation_expiry)),
+                ('upload_session', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='quota_reservation', to='vault.uploadsession')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quota_reservations', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def grant_chunks_of_existing_files(apps, schema_editor):
+    FileChunk = apps.get_model('vault', 'FileChunk')
+    UserChunk = apps.get_model('vault', 'UserChunk')
+    owned = FileChunk.objects.filter(
+        stored_file__user_files__is_deleted=False
+    ).values_list('stored_file__user_files__user_id', 'chunk_id').distinct()
+    UserChunk.objects.bulk_create(
+        (UserChunk(user_id=user_id, chunk_id=chunk_id) for user_id, chunk_id in owned.iterator()),
+        batch_size=1000, ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0018_upload_verification'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_chunks', to='vault.chunk')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_chunks', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'chunk')},
+            },
+        ),
+        migrations.RunPython(grant_chunks_of_existing_files, migrations.RunPython.noop),
+    ]
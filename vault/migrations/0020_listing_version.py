@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vault', '0019_user_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='listing_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -1,15 +1,28 @@
 import uuid
-from django.db import models
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Collate, Concat, Substr
+from django.utils import timezone
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from .compression_utils import ENCODING_CHOICES, IDENTITY
+from .search_utils import name_search_vector
+
 # Create your models here.
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     storage_limit = models.BigIntegerField(default=15 * 1024 * 1024 * 1024)  # 15 GB
     storage_used = models.BigIntegerField(default=0)
+    # Sum of the user's QuotaReservations, bytes held for uploads in progress
+    storage_reserved = models.BigIntegerField(default=0)
+    # Bumped by every change that shows up in the user's listings, see cache_utils
+    listing_version = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
@@ -24,32 +37,234 @@ class Folder(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folders')
     name = models.CharField(max_length=255)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='subfolders')
+    # Materialized path, the ids from the root down to this folder, each
+    # followed by '/'. A subtree is then every folder whose path starts
+    # with this one's, which is a single range scan on folder_path_idx
+    path = models.TextField(default='', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Deleted folders stay until `reclaim_storage` purges them
+    is_deleted = models.BooleanField(default=False)
 
     def __str__(self):
         return f'{self.user.username} - {self.name}'
 
+    def save(self, *args, **kwargs):
+        if not self.path:
+            self.path = (self.parent.path if self.parent_id else '') + f'{self.id}/'
+        super().save(*args, **kwargs)
+
+    @property
+    def ancestor_ids(self):
+        """Ids from the root down to the parent of this folder"""
+        return [uuid.UUID(folder_id) for folder_id in self.path.split('/')[:-2]]
+
+    def subtree(self):
+        """This folder and every folder below it"""
+        return Folder.objects.filter(user_id=self.user_id, path__startswith=self.path)
+
+    def subtree_files(self):
+        """Every live file in this folder or below it"""
+        return UserFile.objects.filter(user_id=self.user_id, folder__path__startswith=self.path, is_deleted=False)
+
+    def subtree_size(self):
+        return self.subtree_files().aggregate(total=models.Sum('size'))['total'] or 0
+
+    def move_to(self, parent):
+        """
+        Re-parent this folder. The paths of the whole subtree are rewritten
+        by one UPDATE, raises ValueError when `parent` is inside the subtree
+        or deleted.
+        """
+        with transaction.atomic():
+            # The owner's profile first, like delete_folder_tree, so moves and
+            # deletes of the user's folders serialize. The paths are then read
+            # again under the lock: a concurrent move may have changed them
+            UserProfile.objects.select_for_update().get(user_id=self.user_id)
+            folder_ids = [self.pk] if parent is None else [self.pk, parent.pk]
+            locked = {
+                pk: (path, is_deleted) for pk, path, is_deleted in
+                Folder.objects.select_for_update().filter(pk__in=folder_ids).order_by('pk').values_list('pk', 'path', 'is_deleted')
+            }
+            old_path, deleted = locked.get(self.pk, ('', True))
+            if deleted:
+                raise ValueError("The folder was deleted.")
+            parent_path = ''
+            if parent is not None:
+                parent_path, deleted = locked.get(parent.pk, ('', True))
+                if deleted:
+                    raise ValueError("The destination folder was deleted.")
+                if parent_path.startswith(old_path):
+                    raise ValueError("A folder cannot be moved into itself.")
+            new_path = parent_path + f'{self.id}/'
+
+            # Same lock order as delete_folder_tree for the rows of the subtree
+            subtree = Folder.objects.filter(user_id=self.user_id, path__startswith=old_path)
+            list(subtree.select_for_update().order_by('pk').values_list('pk', flat=True))
+            Folder.objects.filter(pk=self.pk).update(parent=parent)
+            subtree.update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1), output_field=models.TextField())
+            )
+        self.parent = parent
+        self.path = new_path
+
     class Meta:
-        unique_together = ('user', 'parent', 'name')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'parent', 'name'], condition=models.Q(is_deleted=False), name='unique_live_folder_name'
+            ),
+        ]
+        # Name ordering is served by the unique index above
+        indexes = [
+            models.Index(fields=['user', 'parent', 'created_at', 'id'], include=['name'], name='folder_listing_created_idx'),
+            models.Index(fields=['path'], opclasses=['text_pattern_ops'], name='folder_path_idx'),
+            GinIndex(name_search_vector(), name='folder_name_search_idx'),
+        ]
 
 class StoredFile(models.Model):
+    THUMBNAIL_NONE = 'none'
+    THUMBNAIL_PENDING = 'pending'
+    THUMBNAIL_READY = 'ready'
+    THUMBNAIL_FAILED = 'failed'
+    THUMBNAIL_STATUS_CHOICES = [
+        (THUMBNAIL_NONE, 'None'),
+        (THUMBNAIL_PENDING, 'Pending'),
+        (THUMBNAIL_READY, 'Ready'),
+        (THUMBNAIL_FAILED, 'Failed'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     file_hash = models.CharField(max_length=64, unique=True, db_index=True)
     s3_key = models.CharField(max_length=255, unique=True)
     thumbnail_s3_key = models.CharField(max_length=255, null=True, blank=True)
+    thumbnail_status = models.CharField(max_length=16, choices=THUMBNAIL_STATUS_CHOICES, default=THUMBNAIL_NONE)
+    # 'image' or 'video' when sniffed from the content at upload, blank otherwise
+    media_kind = models.CharField(max_length=16, blank=True)
     size = models.BigIntegerField()
+    # How the object is stored and its size in S3, `size` stays the content's
+    # size as users see it and as quotas count it
+    encoding = models.CharField(max_length=16, choices=ENCODING_CHOICES, default=IDENTITY)
+    stored_size = models.BigIntegerField()
+    # Content stored as shared chunks (see FileChunk), s3_key then holds the
+    # chunk manifest and file_hash is the manifest's hash
+    chunked = models.BooleanField(default=False)
     ref_count = models.PositiveIntegerField(default=0)
+    # When ref_count last dropped to zero, cleared when the content is referenced again
+    orphaned_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.file_hash
 
+    def save(self, *args, **kwargs):
+        if self.stored_size is None:
+            self.stored_size = self.size
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['orphaned_at'], condition=models.Q(ref_count=0), name='storedfile_orphaned_idx'),
+            # Bucket keys in S3 listing order, for reconcile_storage
+            models.Index(Collate('s3_key', 'C'), name='storedfile_key_c_idx'),
+            models.Index(Collate('thumbnail_s3_key', 'C'), name='storedfile_thumb_key_c_idx'),
+        ]
+
+class Chunk(models.Model):
+    """
+    A content-defined piece of one or more chunked stored files, stored once
+    under its SHA-256. ref_count counts FileChunk rows, not files.
+    """
+    chunk_hash = models.CharField(max_length=64, unique=True)
+    s3_key = models.CharField(max_length=255, unique=True)
+    size = models.PositiveIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    # Chunks are uploaded before the file that uses them, so they start orphaned
+    orphaned_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.chunk_hash
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['orphaned_at'], condition=models.Q(ref_count=0), name='chunk_orphaned_idx'),
+            models.Index(Collate('s3_key', 'C'), name='chunk_key_c_idx'),
+        ]
+
+class FileChunk(models.Model):
+    """One entry of a chunked stored file's manifest"""
+    stored_file = models.ForeignKey(StoredFile, on_delete=models.CASCADE, related_name='file_chunks')
+    index = models.PositiveIntegerField()
+    offset = models.BigIntegerField()
+    chunk = models.ForeignKey(Chunk, on_delete=models.PROTECT, related_name='file_chunks')
+
+    class Meta:
+        unique_together = ('stored_file', 'index')
+
+class UserChunk(models.Model):
+    """
+    A chunk the user has uploaded, or used in one of their files. Chunks are
+    only reported as stored to, and assembled into files for, users holding
+    one: a chunk hash alone is no proof of having its bytes.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_chunks')
+    chunk = models.ForeignKey(Chunk, on_delete=models.CASCADE, related_name='user_chunks')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'chunk')
+
+class Rendition(models.Model):
+    """
+    A resized preview of a StoredFile. Renditions are keyed by content, so each
+    size/format is rendered once and shared by every user of the file.
+    """
+    stored_file = models.ForeignKey(StoredFile, on_delete=models.CASCADE, related_name='renditions')
+    size = models.PositiveIntegerField()
+    format = models.CharField(max_length=8)
+    s3_key = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.stored_file_id} - {self.size}px {self.format}'
+
+    class Meta:
+        unique_together = ('stored_file', 'size', 'format')
+        indexes = [models.Index(Collate('s3_key', 'C'), name='rendition_key_c_idx')]
+
+class ThumbnailJob(models.Model):
+    """A queued thumbnail render for a StoredFile, picked up by `run_thumbnail_worker`."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    stored_file = models.OneToOneField(StoredFile, on_delete=models.CASCADE, related_name='thumbnail_job')
+    source_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.stored_file_id} - {self.status}'
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
 class UserFile(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='files')
     stored_file = models.ForeignKey(StoredFile, on_delete=models.CASCADE, related_name='user_files')
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True, related_name='files')
     name = models.CharField(max_length=255)
+    # Copy of stored_file.size so listings can sort by size from an index
+    size = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_deleted = models.BooleanField(default=False)
@@ -60,3 +275,114 @@ class UserFile(models.Model):
     class Meta:
         # A user should not have two files with the same name in the same folder
         unique_together = ('user', 'folder', 'name')
+        # Listing indexes, one per ordering and ending in id for the keyset
+        # tie-break. They carry every UserFile column the listing reads, so a
+        # page is an index-only range scan
+        indexes = [
+            models.Index(fields=['user', 'folder', 'is_deleted', 'name', 'id'],
+                         include=['stored_file', 'size', 'created_at'], name='userfile_listing_name_idx'),
+            models.Index(fields=['user', 'folder', 'is_deleted', 'created_at', 'id'],
+                         include=['stored_file', 'name', 'size'], name='userfile_listing_created_idx'),
+            models.Index(fields=['user', 'folder', 'is_deleted', 'size', 'id'],
+                         include=['stored_file', 'name', 'created_at'], name='userfile_listing_size_idx'),
+            GinIndex(name_search_vector(), condition=models.Q(is_deleted=False), name='userfile_name_search_idx'),
+        ]
+
+def upload_session_expiry():
+    return timezone.now() + timedelta(seconds=settings.VAULT_UPLOAD_SESSION_TTL)
+
+class UploadSession(models.Model):
+    """
+    A multipart upload that is assembled in S3 part by part, either sent
+    straight to S3 through presigned part URLs or resumably through the API.
+    Once completed, `run_upload_verifier` checks the assembled object against
+    the declared hash in the background and registers the file.
+    """
+    UPLOADING = 'uploading'
+    VERIFYING = 'verifying'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (UPLOADING, 'Uploading'),
+        (VERIFYING, 'Verifying'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True, related_name='upload_sessions')
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    file_hash = models.CharField(max_length=64)
+    s3_key = models.CharField(max_length=255, unique=True)
+    upload_id = models.CharField(max_length=1024)
+    part_size = models.BigIntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=UPLOADING)
+    # Set by the verifier: when it claimed the session, and the outcome
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True)
+    user_file = models.ForeignKey('UserFile', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=upload_session_expiry, db_index=True)
+
+    @property
+    def part_count(self):
+        return max(1, -(-self.size // self.part_size))
+
+    def expected_part_size(self, part_number):
+        if part_number < self.part_count:
+            return self.part_size
+        return self.size - (self.part_count - 1) * self.part_size
+
+    def __str__(self):
+        return f'{self.user.username} - {self.name} (upload)'
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'claimed_at'], name='uploadsession_verify_idx')]
+
+class UploadPart(models.Model):
+    """A part of an UploadSession that has been stored in S3."""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='parts')
+    part_number = models.PositiveIntegerField()
+    etag = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.session_id} - part {self.part_number}'
+
+    class Meta:
+        unique_together = ('session', 'part_number')
+
+
+def quota_reservation_expiry():
+    return timezone.now() + timedelta(seconds=settings.VAULT_QUOTA_RESERVATION_TTL)
+
+class QuotaReservation(models.Model):
+    """
+    Quota held for an upload in progress, counted in the user's
+    `storage_reserved` until it is committed or released (see quota_utils).
+    A reservation of an upload session lives as long as the session.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quota_reservations')
+    upload_session = models.OneToOneField(
+        UploadSession, on_delete=models.SET_NULL, null=True, blank=True, related_name='quota_reservation'
+    )
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=quota_reservation_expiry, db_index=True)
+
+    def __str__(self):
+        return f'{self.user_id} - {self.size} bytes reserved'
+
+
+class RevokedToken(models.Model):
+    """An access token revoked before it expires (on logout), checked through the set auth_utils reloads periodically."""
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti
@@ -0,0 +1,47 @@
+"""
+Keyset (cursor) pagination for the folder listing.
+
+Rows are ordered by (field, id) with both columns in the same direction, so
+each page is a range scan on the matching listing index that starts right
+after the last row of the previous page, no matter how deep the page is.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(kind, value, pk):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps({'k': kind, 'v': value, 'id': str(pk)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (kind, value, pk) from an opaque cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return data['k'], data['v'], data['id']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+
+
+def keyset_order(queryset, field, descending):
+    prefix = '-' if descending else ''
+    return queryset.order_by(f'{prefix}{field}', f'{prefix}id')
+
+
+def keyset_seek(queryset, field, descending, value, pk):
+    """Rows strictly after (value, pk) in keyset_order"""
+    op = 'lt' if descending else 'gt'
+    # The first filter bounds the index range scan, the second skips ties already seen
+    return queryset.filter(**{f'{field}__{op}e': value}).filter(
+        Q(**{f'{field}__{op}': value}) | Q(**{f'id__{op}': pk})
+    )
@@ -0,0 +1,133 @@
+"""
+Quota accounting with reservations.
+
+An upload reserves its bytes before the transfer starts, with one
+conditional UPDATE that only succeeds while
+
+    storage_used + storage_reserved + size <= storage_limit
+
+so concurrent uploads can never overshoot the quota between them. The
+reservation is committed by `register_user_file`, which moves the bytes the
+file actually takes into `storage_used`, or released when the upload fails.
+
+Every reservation is also a QuotaReservation row, so bytes held by a request
+that died are not lost: a reservation expires after
+VAULT_QUOTA_RESERVATION_TTL seconds (an upload session's when the session
+does), and `reconcile_quotas` recomputes both counters from the rows they
+summarize and corrects any drift.
+"""
+from django.db import transaction
+from django.db.models import BigIntegerField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache_utils import invalidate_listings
+from .models import QuotaReservation, UserFile, UserProfile
+
+
+def reserve_quota(user_id, size, upload_session=None):
+    """Reserve `size` bytes of the user's quota, returns the QuotaReservation or None when they don't fit"""
+    with transaction.atomic():
+        reserved = UserProfile.objects.filter(
+            user_id=user_id, storage_limit__gte=F('storage_used') + F('storage_reserved') + size
+        ).update(storage_reserved=F('storage_reserved') + size)
+        if not reserved:
+            return None
+        return QuotaReservation.objects.create(user_id=user_id, size=size, upload_session=upload_session)
+
+
+def consume_reservation(reservation):
+    """
+    Delete `reservation` and take its bytes out of `storage_reserved`,
+    returns them (0 when it was already released). The caller must hold the
+    lock on the user's profile, like every quota change.
+    """
+    if reservation is None or reservation.pk is None:
+        return 0
+    deleted, _ = QuotaReservation.objects.filter(pk=reservation.pk).delete()
+    reservation.pk = None
+    if not deleted:
+        return 0
+    UserProfile.objects.filter(user_id=reservation.user_id).update(storage_reserved=F('storage_reserved') - reservation.size)
+    return reservation.size
+
+
+def release_quota(reservation):
+    """Give back a reservation that will not be committed. Releasing it again, or after the commit, does nothing."""
+    if reservation is None or reservation.pk is None:
+        return
+    with transaction.atomic():
+        UserProfile.objects.select_for_update().get(user_id=reservation.user_id)
+        consume_reservation(reservation)
+
+
+def session_reservation(session):
+    return QuotaReservation.objects.filter(upload_session=session).first()
+
+
+def quota_usage(user_id):
+    """The user's quota in bytes: storage_limit, storage_used, storage_reserved and storage_available"""
+    quota = UserProfile.objects.values('storage_limit', 'storage_used', 'storage_reserved').get(user_id=user_id)
+    quota['storage_available'] = max(0, quota['storage_limit'] - quota['storage_used'] - quota['storage_reserved'])
+    return quota
+
+
+def expired_reservations(now=None):
+    now = now or timezone.now()
+    return QuotaReservation.objects.filter(expires_at__lte=now).filter(
+        Q(upload_session__isnull=True) | Q(upload_session__expires_at__lte=now)
+    )
+
+
+def reconcile_quota_batch(profile_ids):
+    """
+    Recompute the quota counters of these profiles from the rows they sum up:
+    `storage_used` from the sizes of the user's live files, and
+    `storage_reserved` from their unexpired reservations (expired ones are
+    deleted). Returns the corrected profiles as
+    (user_id, storage_used, actual_used, storage_reserved, actual_reserved) tuples.
+    """
+    with transaction.atomic():
+        # Locked in a stable order, so uploads and deletes of these users wait
+        # and the sums below see every change they commit
+        locked = list(
+            UserProfile.objects.select_for_update().filter(pk__in=profile_ids).order_by('pk').values_list('pk', 'user_id')
+        )
+        user_ids = [user_id for _, user_id in locked]
+        expired_reservations().filter(user_id__in=user_ids).delete()
+
+        used = UserFile.objects.filter(user_id=OuterRef('user_id'), is_deleted=False).values('user_id').annotate(
+            total=Sum('stored_file__size')
+        ).values('total')
+        reserved = QuotaReservation.objects.filter(user_id=OuterRef('user_id')).values('user_id').annotate(
+            total=Sum('size')
+        ).values('total')
+        actual_used = Coalesce(Subquery(used), Value(0), output_field=BigIntegerField())
+        actual_reserved = Coalesce(Subquery(reserved), Value(0), output_field=BigIntegerField())
+
+        drifted = list(
+            UserProfile.objects.filter(pk__in=[pk for pk, _ in locked])
+            .annotate(actual_used=actual_used, actual_reserved=actual_reserved)
+            .exclude(storage_used=F('actual_used'), storage_reserved=F('actual_reserved'))
+            .values_list('pk', 'user_id', 'storage_used', 'actual_used', 'storage_reserved', 'actual_reserved')
+        )
+        if drifted:
+            UserProfile.objects.filter(pk__in=[row[0] for row in drifted]).update(
+                storage_used=actual_used, storage_reserved=actual_reserved
+            )
+            # Listings show storage_used
+            invalidate_listings(row[1] for row in drifted if row[2] != row[3])
+    return [row[1:] for row in drifted]
+
+
+def reconcile_quotas(batch_size=500):
+    """Reconcile every profile in batches of `batch_size`, yields the corrections of each batch"""
+    last = 0
+    while True:
+        profile_ids = list(
+            UserProfile.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not profile_ids:
+            return
+        yield reconcile_quota_batch(profile_ids)
+        last = profile_ids[-1]
@@ -0,0 +1,271 @@
+"""
+Bucket-vs-database reconciliation.
+
+The key space is cut into ranges (lo, hi]. Each range is scanned on its own
+by listing the bucket from `lo` with ListObjectsV2 and merge-joining it
+against every key the database references in the same range, read in pages
+in the same (bytewise) order. Memory stays bounded by one page of each side,
+whatever the size of the bucket, and ranges can be scanned in parallel and
+resumed from a checkpoint.
+"""
+import heapq
+import json
+import os
+import string
+import threading
+from datetime import timedelta
+from itertools import groupby
+
+from django.db.models import F
+from django.db.models.functions import Collate
+from django.utils import timezone
+
+from .cache_utils import invalidate_stored_file_listings
+from .models import Chunk, Rendition, StoredFile, ThumbnailJob, UploadSession
+from .storage import storage
+
+# S3 lists keys in UTF-8 byte order, which is what the "C" collation sorts by
+BYTE_ORDER = 'C'
+DB_PAGE_SIZE = 5000
+REPAIR_BATCH_SIZE = 1000
+
+# Every column that points at an object in the bucket
+KEY_SOURCES = (
+    ('content', StoredFile, 's3_key'),
+    ('thumbnail', StoredFile, 'thumbnail_s3_key'),
+    ('rendition', Rendition, 's3_key'),
+    ('chunk', Chunk, 's3_key'),
+    # Targets of unfinished upload sessions, they have no object until completed
+    ('upload', UploadSession, 's3_key'),
+)
+
+
+def key_partitions():
+    """
+    Split points for the scan. Content keys are SHA-256 hex digests and
+    chunks and previews live under `chunks/<hash>`, `thumb_<hash>` and
+    `renditions/<hash>`, so splitting each of them on the first hex digit
+    gives evenly sized ranges.
+    """
+    hex_digits = string.digits + 'abcdef'
+    boundaries = sorted(
+        [digit for digit in hex_digits]
+        + [f'chunks/{digit}' for digit in hex_digits]
+        + [f'renditions/{digit}' for digit in hex_digits]
+        + [f'thumb_{digit}' for digit in hex_digits]
+        + ['tmp/']
+    )
+    return list(zip([None] + boundaries, boundaries + [None]))
+
+
+def in_range(key, hi):
+    return hi is None or key <= hi
+
+
+def stored_keys(after, hi):
+    """
+    Yield (key, [(kind, pk), ...]) for every referenced key in (after, hi],
+    in byte order. Each source is read in keyset pages off its index.
+    """
+    def source_keys(kind, model, field):
+        last = after
+        while True:
+            rows = model.objects.annotate(key=Collate(F(field), BYTE_ORDER)).filter(key__isnull=False)
+            if last is not None:
+                rows = rows.filter(key__gt=last)
+            if hi is not None:
+                rows = rows.filter(key__lte=hi)
+            page = list(rows.order_by('key').values_list('key', 'pk')[:DB_PAGE_SIZE])
+            for key, pk in page:
+                yield key, kind, pk
+            if len(page) < DB_PAGE_SIZE:
+                return
+            last = page[-1][0]
+
+    merged = heapq.merge(*(source_keys(*source) for source in KEY_SOURCES), key=lambda row: row[0])
+    for key, rows in groupby(merged, key=lambda row: row[0]):
+        yield key, [(kind, pk) for _, kind, pk in rows]
+
+
+def bucket_keys(after, hi, page_size=1000):
+    """
+    Yield pages of the bucket's objects in (after, hi]. Raises RuntimeError
+    when S3 cannot be listed, so a failed page is never read as missing objects.
+    """
+    while True:
+        result = storage.list_objects(start_after=after or '', max_keys=page_size)
+        if result is None:
+            raise RuntimeError(f"Could not list the bucket after {after!r}")
+        objects, truncated = result
+        page = [obj for obj in objects if in_range(obj['Key'], hi)]
+        if page:
+            yield page
+        if not truncated or len(page) < len(objects) or not objects:
+            return
+        after = objects[-1]['Key']
+
+
+class Checkpoint:
+    """Scan progress per range, saved to a JSON file after every page"""
+
+    def __init__(self, path, partitions):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {'partitions': [list(p) for p in partitions], 'done': [], 'after': {}}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state['partitions'] != self.state['partitions']:
+                raise ValueError(f"{path} was written for different key ranges")
+            self.state = state
+
+    def is_done(self, index):
+        return index in self.state['done']
+
+    def resume_after(self, index):
+        return self.state['after'].get(str(index), self.state['partitions'][index][0])
+
+    def advance(self, index, key):
+        with self.lock:
+            self.state['after'][str(index)] = key
+            self.save()
+
+    def finish(self, index):
+        with self.lock:
+            self.state['done'].append(index)
+            self.state['after'].pop(str(index), None)
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        # Write then rename, so a crash never leaves a truncated checkpoint
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.path)
+
+
+class Reconciler:
+    """
+    Compares the bucket with the database and reports, and optionally repairs:
+
+    * unreferenced objects, no row points at them (deleted on repair)
+    * missing content or chunks, a referenced object that is gone (only
+      reported, the content cannot be recovered)
+    * missing thumbnails and renditions (reset so they are rendered again)
+
+    Objects younger than `min_age` are left alone, uploads store the object
+    before inserting its row.
+    """
+
+    def __init__(self, repair=False, min_age=3600, page_size=1000, checkpoint=None, report=None):
+        self.repair = repair
+        self.page_size = page_size
+        self.cutoff = timezone.now() - timedelta(seconds=min_age)
+        self.checkpoint = checkpoint
+        self.report = report or (lambda finding, key: None)
+        self.lock = threading.Lock()
+        self.counts = {
+            'objects': 0, 'unreferenced': 0, 'missing_content': 0, 'missing_chunk': 0,
+            'missing_thumbnail': 0, 'missing_rendition': 0, 'repaired': 0,
+        }
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def scan(self, index, lo, hi):
+        """Merge-join one key range, resuming after the checkpointed key if any"""
+        after = self.checkpoint.resume_after(index) if self.checkpoint else lo
+        references = stored_keys(after, hi)
+        reference = next(references, None)
+        unreferenced, missing = [], []
+
+        for page in bucket_keys(after, hi, self.page_size):
+            for obj in page:
+                # Referenced keys sorting before this object have no object
+                while reference is not None and reference[0] < obj['Key']:
+                    missing.append(reference)
+                    reference = next(references, None)
+                if reference is not None and reference[0] == obj['Key']:
+                    reference = next(references, None)
+                elif obj['LastModified'] < self.cutoff:
+                    unreferenced.append(obj['Key'])
+            self.count('objects', len(page))
+
+            self.flush(unreferenced, missing)
+            unreferenced, missing = [], []
+            if self.checkpoint:
+                self.checkpoint.advance(index, page[-1]['Key'])
+
+        while reference is not None:
+            missing.append(reference)
+            reference = next(references, None)
+        self.flush(unreferenced, missing)
+        if self.checkpoint:
+            self.checkpoint.finish(index)
+
+    def flush(self, unreferenced, missing):
+        for start in range(0, len(unreferenced), REPAIR_BATCH_SIZE):
+            self.handle_unreferenced(unreferenced[start:start + REPAIR_BATCH_SIZE])
+        for start in range(0, len(missing), REPAIR_BATCH_SIZE):
+            self.handle_missing(missing[start:start + REPAIR_BATCH_SIZE])
+
+    def handle_unreferenced(self, keys):
+        # The scan read the database earlier, drop keys referenced since then
+        referenced = set()
+        for _, model, field in KEY_SOURCES:
+            referenced.update(model.objects.filter(**{f'{field}__in': keys}).values_list(field, flat=True))
+        keys = [key for key in keys if key not in referenced]
+
+        for key in keys:
+            self.report('unreferenced', key)
+        self.count('unreferenced', len(keys))
+        if self.repair and keys:
+            failed = storage.delete_objects(keys)
+            if failed is not None:
+                self.count('repaired', len(keys) - len(failed))
+
+    def handle_missing(self, references):
+        for key, rows in references:
+            # An object may have appeared since it was listed, or a reclaimer
+            # may be deleting it with its row
+            if storage.head_object(key) is not None:
+                continue
+            for kind, pk in rows:
+                if kind == 'upload':
+                    continue
+                if kind in ('content', 'chunk'):
+                    model = StoredFile if kind == 'content' else Chunk
+                    if model.objects.filter(pk=pk, ref_count__gt=0).exists():
+                        self.report(f'missing_{kind}', key)
+                        self.count(f'missing_{kind}')
+                    continue
+
+                self.report(f'missing_{kind}', key)
+                self.count(f'missing_{kind}')
+                if self.repair:
+                    self.repair_preview(kind, pk)
+                    self.count('repaired')
+
+    def repair_preview(self, kind, pk):
+        if kind == 'rendition':
+            # Rendered again on the next preview request
+            Rendition.objects.filter(pk=pk).delete()
+            return
+
+        # Queue the thumbnail again, or drop it if the content is not an image or video
+        stored_file = StoredFile.objects.get(pk=pk)
+        Rendition.objects.filter(stored_file=stored_file, s3_key=stored_file.thumbnail_s3_key).delete()
+        stored_file.thumbnail_s3_key = None
+        if stored_file.media_kind:
+            stored_file.thumbnail_status = StoredFile.THUMBNAIL_PENDING
+            ThumbnailJob.objects.update_or_create(
+                stored_file=stored_file,
+                defaults={'status': ThumbnailJob.QUEUED, 'attempts': 0, 'run_after': timezone.now()}
+            )
+        else:
+            stored_file.thumbnail_status = StoredFile.THUMBNAIL_NONE
+        stored_file.save(update_fields=['thumbnail_s3_key', 'thumbnail_status'])
+        invalidate_stored_file_listings([stored_file.pk])
@@ -0,0 +1,87 @@
+"""
+Resized previews of stored files.
+
+Renditions are rendered the first time a size/format is requested and
+recorded in the `Rendition` index, keyed by the deduplicated StoredFile, so
+each one is computed once no matter how many users share the content.
+"""
+import logging
+import tempfile
+
+from django.conf import settings
+
+from .models import Rendition
+from .storage import storage
+from .thumbnail_utils import generate_image_thumbnail, generate_video_thumbnail
+
+logger = logging.getLogger(__name__)
+
+# Sources up to this size are buffered in memory, larger ones spill to a temp file
+SOURCE_SPOOL_SIZE = 16 * 1024 * 1024
+
+# format name -> (Pillow format, file extension)
+RENDITION_FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp'),
+}
+
+
+def rendition_key(file_hash, size, format):
+    return f"renditions/{file_hash}_{size}.{RENDITION_FORMATS[format][1]}"
+
+
+def render_preview(s3_key, kind, size, format):
+    """Render a preview of the object at `s3_key` fitting in size x size, or None"""
+    pil_format = RENDITION_FORMATS[format][0]
+
+    if kind == 'video':
+        # ffmpeg reads only the ranges it needs, from the file itself on local storage
+        source_url = storage.local_path(s3_key) or storage.generate_presigned_url(
+            s3_key, expiration=settings.VAULT_VIDEO_THUMBNAIL_TIMEOUT + 60
+        )
+        if not source_url:
+            raise RuntimeError(f"Could not presign {s3_key}")
+        return generate_video_thumbnail(source_url, size, pil_format)
+
+    if kind == 'image':
+        body = storage.get_object_stream(s3_key)
+        if body is None:
+            raise RuntimeError(f"Could not read {s3_key} from S3")
+
+        with tempfile.SpooledTemporaryFile(max_size=SOURCE_SPOOL_SIZE) as source:
+            try:
+                for chunk in body.iter_chunks(chunk_size=1024 * 1024):
+                    source.write(chunk)
+            finally:
+                body.close()
+            return generate_image_thumbnail(source, size, pil_format)
+
+    return None
+
+
+def get_or_create_rendition(stored_file, kind, size, format):
+    """Look the rendition up in the index, rendering and storing it on first use"""
+    rendition = Rendition.objects.filter(stored_file=stored_file, size=size, format=format).first()
+    if rendition:
+        return rendition
+
+    try:
+        preview = render_preview(stored_file.s3_key, kind, size, format)
+    except RuntimeError as e:
+        logger.error(f"Failed to render {size}px {format} rendition of {stored_file.file_hash}: {e}")
+        return None
+    if preview is None:
+        return None
+
+    s3_key = rendition_key(stored_file.file_hash, size, format)
+    if not storage.upload_fileobj(preview, s3_key):
+        return None
+
+    # A concurrent request may have rendered the same key, keep whichever row won
+    rendition, _ = Rendition.objects.get_or_create(
+        stored_file=stored_file,
+        size=size,
+        format=format,
+        defaults={'s3_key': s3_key}
+    )
+    return rendition
@@ -1,68 +1,147 @@
 import boto3
+from aiobotocore.session import get_session as get_async_session
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from django.conf import settings
+from django.core.cache import cache
 from botocore.exceptions import NoCredentialsError, ClientError, BotoCoreError
+import asyncio
 import logging
+import threading
+import time
+
+from .async_utils import run_in_storage_pool
+from .storage_backends import StorageBackend
 
 logger = logging.getLogger(__name__)
 
-class S3Client:
+# DeleteObjects accepts at most 1000 keys per request
+MAX_DELETE_KEYS = 1000
+# Managed transfers grow their part size to stay under this many parts
+TARGET_TRANSFER_PARTS = 1000
+MIB = 1024 * 1024
+
+
+def transfer_config(size=None):
+    """
+    TransferConfig for a managed upload or copy of `size` bytes. Objects
+    under the threshold go in one request. Larger ones are split into at
+    least VAULT_S3_MULTIPART_CHUNK_SIZE parts, bigger for big objects so
+    a transfer is at most about TARGET_TRANSFER_PARTS requests, sent by
+    up to VAULT_S3_MAX_CONCURRENCY threads but never more than there are
+    parts.
+    """
+    chunk_size = settings.VAULT_S3_MULTIPART_CHUNK_SIZE
+    concurrency = settings.VAULT_S3_MAX_CONCURRENCY
+    if size:
+        chunk_size = max(chunk_size, -(-size // TARGET_TRANSFER_PARTS // MIB) * MIB)
+        concurrency = max(1, min(concurrency, -(-size // chunk_size)))
+    return TransferConfig(
+        multipart_threshold=settings.VAULT_S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=chunk_size,
+        max_concurrency=concurrency,
+    )
+
+
+class S3Client(StorageBackend):
+    """
+    The boto3 client is created on first use rather than at import, so
+    workers start without a round trip to S3, and it is shared by all
+    threads (boto3 clients are thread-safe, only their creation is not).
+    Use check_connection() to verify the bucket is reachable.
+
+    The async views use the `a` prefixed methods instead, on an aiobotocore
+    client. Its connections belong to the event loop they were opened on,
+    so there is one such client per loop: one per worker under uvicorn.
+    """
+    name = 's3'
+
     def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+        self._async_session = get_async_session()
+        self._async_clients = {}
         # Validate AWS settings
-        if not all([
+        self.configured = all([
             settings.AWS_ACCESS_KEY_ID,
             settings.AWS_SECRET_ACCESS_KEY,
             settings.AWS_STORAGE_BUCKET_NAME,
             settings.AWS_S3_REGION_NAME
-        ]):
+        ])
+        if not self.configured:
             logger.error("Missing AWS configuration. Please check your environment variables.")
-            self.client = None
             self.bucket_name = None
             return
-            
-        try:
-            self.client = boto3.client(
-                's3',
-                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        self.bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+
+    @property
+    def client(self):
+        if self._client is None and self.configured:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    def _client_kwargs(self):
+        return dict(
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=settings.AWS_S3_REGION_NAME,
+            config=Config(
+                signature_version='s3v4',
                 region_name=settings.AWS_S3_REGION_NAME,
-                config=Config(
-                    signature_version='s3v4',
-                    region_name=settings.AWS_S3_REGION_NAME,
-                    s3={
-                        'addressing_style': 'virtual'
-                    }
-                )
+                s3={
+                    'addressing_style': 'virtual'
+                },
+                max_pool_connections=settings.VAULT_S3_MAX_POOL_CONNECTIONS,
+                retries={'mode': 'adaptive', 'total_max_attempts': settings.VAULT_S3_MAX_ATTEMPTS},
+                tcp_keepalive=True,
             )
-            self.bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-            
-            # Test connection by checking if bucket exists
-            self.client.head_bucket(Bucket=self.bucket_name)
-            logger.info(f"Successfully connected to S3 bucket: {self.bucket_name}")
-            
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            if error_code == '404':
-                logger.error(f"S3 bucket '{settings.AWS_STORAGE_BUCKET_NAME}' does not exist")
-            elif error_code == '403':
-                logger.error(f"Access denied to S3 bucket '{settings.AWS_STORAGE_BUCKET_NAME}'")
-            else:
-                logger.error(f"S3 ClientError: {e}")
-            self.client = None
-            self.bucket_name = None
+        )
+
+    def _create_client(self):
+        try:
+            # A session of our own: the default session is not safe to create clients from concurrently
+            return boto3.session.Session().client('s3', **self._client_kwargs())
         except Exception as e:
             logger.error(f"Failed to initialize S3 client: {e}")
-            self.client = None
-            self.bucket_name = None
+            return None
+
+    async def async_client(self):
+        """The aiobotocore client of the running event loop, created on first use"""
+        if not self.configured:
+            return None
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # Async views served under WSGI run on a new loop per request
+            for closed in [other for other in self._async_clients if other.is_closed()]:
+                del self._async_clients[closed]
+            creating = self._async_clients.get(loop)
+            if creating is None:
+                creating = self._async_clients[loop] = loop.create_task(self._create_async_client())
+        client = await creating
+        if client is None:
+            self._async_clients.pop(loop, None)
+        return client
 
-    def upload_fileobj(self, file_obj, key):
+    async def _create_async_client(self):
+        try:
+            return await self._async_session.create_client('s3', **self._client_kwargs()).__aenter__()
+        except Exception as e:
+            logger.error(f"Failed to initialize async S3 client: {e}")
+            return None
+
+    def upload_fileobj(self, file_obj, key, content_encoding=None):
         if not self.client:
             logger.error("S3 client not initialized")
             return False
             
         try:
             logger.info(f"Uploading file to S3: {key}")
-            self.client.upload_fileobj(file_obj, self.bucket_name, key)
+            extra_args = {'ContentEncoding': content_encoding} if content_encoding else None
+            self.client.upload_fileobj(
+                file_obj, self.bucket_name, key, ExtraArgs=extra_args, Config=transfer_config(_remaining_size(file_obj))
+            )
             logger.info(f"Successfully uploaded file to S3: {key}")
             return True
         except NoCredentialsError:
@@ -75,54 +154,289 @@ class S3Client:
             logger.error(f"Unexpected error uploading {key}: {e}")
             return False
 
-    def generate_presigned_url(self, key, expiration=3600):
+    def create_multipart_upload(self, key, content_encoding=None):
+        """Start a multipart upload and return its UploadId"""
         if not self.client:
             logger.error("S3 client not initialized")
             return None
-            
+
         try:
-            logger.info(f"Generating presigned URL for: {key}")
-            response = self.client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': self.bucket_name, 'Key': key},
+            extra_args = {'ContentEncoding': content_encoding} if content_encoding else {}
+            response = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=key, **extra_args)
+            return response['UploadId']
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"Failed to start multipart upload for {key}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error starting multipart upload for {key}: {e}")
+            return None
+
+    def upload_part(self, key, upload_id, part_number, body):
+        """Upload one part of a multipart upload and return its ETag"""
+        if not self.client:
+            logger.error("S3 client not initialized")
+            return None
+
+        try:
+            response = self.client.upload_part(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body
+            )
+            return response['ETag']
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"Failed to upload part {part_number} for {key}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error uploading part {part_number} for {key}: {e}")
+            return None
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        """Assemble a multipart upload from a list of {'PartNumber', 'ETag'} dicts"""
+        if not self.client:
+            logger.error("S3 client not initialized")
+            return False
+
+        try:
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+            logger.info(f"Completed multipart upload for {key} ({len(parts)} parts)")
+            return True
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return False
+        except ClientError as e:
+            logger.error(f"Failed to complete multipart upload for {key}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error completing multipart upload for {key}: {e}")
+            return False
+
+    def abort_multipart_upload(self, key, upload_id):
+        if not self.client:
+            logger.error("S3 client not initialized")
+            return False
+
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+            return True
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return False
+        except ClientError as e:
+            logger.error(f"Failed to abort multipart upload for {key}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error aborting multipart upload for {key}: {e}")
+            return False
+
+    def list_parts(self, key, upload_id):
+        """Return the parts S3 has received for a multipart upload, ordered by part number"""
+        if not self.client:
+            logger.error("S3 client not initialized")
+            return None
+
+        try:
+            parts = []
+            paginator = self.client.get_paginator('list_parts')
+            for page in paginator.paginate(Bucket=self.bucket_name, Key=key, UploadId=upload_id):
+                for part in page.get('Parts', []):
+                    parts.append({'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']})
+            return parts
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"Failed to list parts for {key}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error listing parts for {key}: {e}")
+            return None
+
+    def generate_presigned_part_url(self, key, upload_id, part_number, expiration=3600):
+        """Presigned PUT URL the client can send one multipart part to directly"""
+        if not self.client:
+            logger.error("S3 client not initialized")
+            return None
+
+        try:
+            return self.client.generate_presigned_url(
+                'upload_part',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': key,
+                    'UploadId': upload_id,
+                    'PartNumber': part_number
+                },
                 ExpiresIn=expiration
             )
-            logger.info(f"Generated presigned URL for: {key}")
-            return response
         except NoCredentialsError:
             logger.error("AWS credentials not found")
             return None
         except ClientError as e:
-            logger.error(f"Failed to generate presigned URL for {key}: {e}")
+            logger.error(f"Failed to presign part {part_number} for {key}: {e}")
             return None
         except Exception as e:
-            logger.error(f"Unexpected error generating presigned URL for {key}: {e}")
+            logger.error(f"Unexpected error presigning part {part_number} for {key}: {e}")
+            return None
+
+    def head_object(self, key):
+        """Return the object's metadata, or None if it does not exist"""
+        if not self.client:
+            logger.error("S3 client not initialized")
+            return None
+
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"S3 head failed for {key}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error reading metadata of {key}: {e}")
+            return None
+
+    def get_object_stream(self, key, byte_range=None):
+        """Return a streaming body for the object (or an inclusive byte range of it), read it with iter_chunks()"""
+        if not self.client:
+            logger.error("S3 client not initialized")
+            return None
+
+        try:
+            extra_args = {'Range': 'bytes=%d-%d' % byte_range} if byte_range else {}
+            response = self.client.get_object(Bucket=self.bucket_name, Key=key, **extra_args)
+            return response['Body']
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"S3 get failed for {key}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error reading {key}: {e}")
+            return None
+
+    def copy_object(self, source_key, key, content_encoding=None):
+        """Server-side copy inside the bucket (uses multipart copy for large objects)"""
+        if not self.client:
+            logger.error("S3 client not initialized")
+            return False
+
+        try:
+            logger.info(f"Copying S3 object {source_key} to {key}")
+            # Multipart copies don't carry metadata over, so set it explicitly
+            extra_args = {'ContentEncoding': content_encoding, 'MetadataDirective': 'REPLACE'} if content_encoding else None
+            # Copies are server-side, the size only picks the part size and concurrency
+            size = self.client.head_object(Bucket=self.bucket_name, Key=source_key)['ContentLength']
+            self.client.copy(
+                {'Bucket': self.bucket_name, 'Key': source_key}, self.bucket_name, key,
+                ExtraArgs=extra_args, Config=transfer_config(size)
+            )
+            return True
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return False
+        except ClientError as e:
+            logger.error(f"S3 copy failed for {source_key} -> {key}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error copying {source_key} -> {key}: {e}")
+            return False
+
+    def list_objects(self, start_after='', max_keys=1000):
+        """
+        One ListObjectsV2 page of the keys after `start_after`, in key order.
+        Returns (objects, truncated) where each object has Key, Size and
+        LastModified, or None on failure.
+        """
+        if not self.client:
+            logger.error("S3 client not initialized")
             return None
 
-    def download_fileobj(self, key):
-        """Download file content from S3 and return as bytes"""
+        try:
+            response = self.client.list_objects_v2(
+                Bucket=self.bucket_name, StartAfter=start_after, MaxKeys=max_keys
+            )
+            objects = [
+                {'Key': obj['Key'], 'Size': obj['Size'], 'LastModified': obj['LastModified']}
+                for obj in response.get('Contents', [])
+            ]
+            return objects, response.get('IsTruncated', False)
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"Failed to list objects after {start_after!r}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error listing objects after {start_after!r}: {e}")
+            return None
+
+    def generate_presigned_url(self, key, expiration=3600):
         if not self.client:
             logger.error("S3 client not initialized")
             return None
             
         try:
-            logger.info(f"Downloading file from S3: {key}")
-            from io import BytesIO
-            file_obj = BytesIO()
-            self.client.download_fileobj(self.bucket_name, key, file_obj)
-            file_content = file_obj.getvalue()
-            logger.info(f"Successfully downloaded file from S3: {key}, size: {len(file_content)} bytes")
-            return file_content
+            return self.client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket_name, 'Key': key},
+                ExpiresIn=expiration
+            )
         except NoCredentialsError:
             logger.error("AWS credentials not found")
             return None
         except ClientError as e:
-            logger.error(f"S3 download failed for {key}: {e}")
+            logger.error(f"Failed to generate presigned URL for {key}: {e}")
             return None
         except Exception as e:
-            logger.error(f"Unexpected error downloading {key}: {e}")
+            logger.error(f"Unexpected error generating presigned URL for {key}: {e}")
             return None
 
+    def generate_presigned_urls(self, keys, expiration=3600):
+        """
+        Presign GET URLs for many keys at once, returns {key: url}.
+
+        Signatures are cached per (key, expiry bucket): a URL signed in the
+        current VAULT_PRESIGNED_URL_CACHE_WINDOW is reused until the window
+        ends. It is signed for `expiration` plus one window, so every URL
+        handed out stays valid for at least `expiration` seconds.
+        """
+        keys = set(keys)
+        if not keys or not self.client:
+            return {}
+
+        window = settings.VAULT_PRESIGNED_URL_CACHE_WINDOW
+        now = time.time()
+        bucket = int(now // window)
+        cache_keys = {f"vault:presign:{expiration}:{bucket}:{key}": key for key in keys}
+        urls = {cache_keys[cache_key]: url for cache_key, url in cache.get_many(cache_keys).items()}
+
+        signed = {}
+        for cache_key, key in cache_keys.items():
+            if key not in urls:
+                url = self.generate_presigned_url(key, expiration=expiration + window)
+                if url:
+                    urls[key] = url
+                    signed[cache_key] = url
+        if signed:
+            cache.set_many(signed, timeout=max(1, int((bucket + 1) * window - now)))
+        return urls
+
     def delete_object(self, key):
         if not self.client:
             logger.error("S3 client not initialized")
@@ -143,6 +457,219 @@ class S3Client:
             logger.error(f"Unexpected error deleting {key}: {e}")
             return False
 
+    def delete_objects(self, keys):
+        """
+        Delete many objects with DeleteObjects, up to 1000 keys per request.
+        Returns the set of keys S3 failed to delete, or None if the deletes
+        could not be sent at all.
+        """
+        if not self.client:
+            logger.error("S3 client not initialized")
+            return None
+
+        keys = list(keys)
+        failed = set()
+        try:
+            for start in range(0, len(keys), MAX_DELETE_KEYS):
+                batch = keys[start:start + MAX_DELETE_KEYS]
+                response = self.client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+                for error in response.get('Errors', []):
+                    logger.error(f"S3 delete failed for {error['Key']}: {error.get('Code')} {error.get('Message')}")
+                    failed.add(error['Key'])
+            logger.info(f"Deleted {len(keys) - len(failed)} object(s) from S3")
+            return failed
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"S3 batch delete failed: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error deleting objects: {e}")
+            return None
+
+    async def aupload_fileobj(self, file_obj, key, content_encoding=None):
+        """
+        upload_fileobj on the async client. It has no managed transfers, so
+        large objects are sent here as a multipart upload, with the part size
+        and concurrency of transfer_config().
+        """
+        client = await self.async_client()
+        if not client:
+            logger.error("S3 client not initialized")
+            return False
+
+        extra_args = {'ContentEncoding': content_encoding} if content_encoding else {}
+        config = transfer_config(_remaining_size(file_obj))
+        try:
+            logger.info(f"Uploading file to S3: {key}")
+            body = await run_in_storage_pool(file_obj.read, config.multipart_threshold)
+            if len(body) < config.multipart_threshold:
+                await client.put_object(Bucket=self.bucket_name, Key=key, Body=body, **extra_args)
+            else:
+                await self._aupload_multipart(client, file_obj, key, body, config, extra_args)
+            logger.info(f"Successfully uploaded file to S3: {key}")
+            return True
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return False
+        except ClientError as e:
+            logger.error(f"S3 upload failed for {key}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error uploading {key}: {e}")
+            return False
+
+    async def _aupload_multipart(self, client, file_obj, key, pending, config, extra_args):
+        """Send `pending` and the rest of `file_obj` as parts, at most max_concurrency of them in flight"""
+        upload_id = (await client.create_multipart_upload(Bucket=self.bucket_name, Key=key, **extra_args))['UploadId']
+        slots = asyncio.Semaphore(config.max_concurrency)
+        sending = []
+
+        async def send(part_number, body):
+            try:
+                response = await client.upload_part(
+                    Bucket=self.bucket_name, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body
+                )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            finally:
+                slots.release()
+
+        try:
+            pending = bytearray(pending)
+            more = True
+            while more or pending:
+                while more and len(pending) < config.multipart_chunksize:
+                    data = await run_in_storage_pool(file_obj.read, config.multipart_chunksize)
+                    pending += data
+                    more = bool(data)
+                if not pending:
+                    break
+                await slots.acquire()
+                failed = [task for task in sending if task.done() and task.exception()]
+                if failed:
+                    raise failed[0].exception()
+                body = bytes(pending[:config.multipart_chunksize])
+                del pending[:config.multipart_chunksize]
+                sending.append(asyncio.ensure_future(send(len(sending) + 1, body)))
+            parts = await asyncio.gather(*sending)
+            await client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            for task in sending:
+                task.cancel()
+            await client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+            raise
+
+    async def acreate_multipart_upload(self, key, content_encoding=None):
+        client = await self.async_client()
+        if not client:
+            logger.error("S3 client not initialized")
+            return None
+
+        try:
+            extra_args = {'ContentEncoding': content_encoding} if content_encoding else {}
+            response = await client.create_multipart_upload(Bucket=self.bucket_name, Key=key, **extra_args)
+            return response['UploadId']
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"Failed to start multipart upload for {key}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error starting multipart upload for {key}: {e}")
+            return None
+
+    async def aupload_part(self, key, upload_id, part_number, body):
+        client = await self.async_client()
+        if not client:
+            logger.error("S3 client not initialized")
+            return None
+
+        try:
+            response = await client.upload_part(
+                Bucket=self.bucket_name, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body
+            )
+            return response['ETag']
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"Failed to upload part {part_number} for {key}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error uploading part {part_number} for {key}: {e}")
+            return None
+
+    async def acomplete_multipart_upload(self, key, upload_id, parts):
+        client = await self.async_client()
+        if not client:
+            logger.error("S3 client not initialized")
+            return False
+
+        try:
+            await client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+            )
+            logger.info(f"Completed multipart upload for {key} ({len(parts)} parts)")
+            return True
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return False
+        except ClientError as e:
+            logger.error(f"Failed to complete multipart upload for {key}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error completing multipart upload for {key}: {e}")
+            return False
+
+    async def aabort_multipart_upload(self, key, upload_id):
+        client = await self.async_client()
+        if not client:
+            logger.error("S3 client not initialized")
+            return False
+
+        try:
+            await client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+            return True
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return False
+        except ClientError as e:
+            logger.error(f"Failed to abort multipart upload for {key}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error aborting multipart upload for {key}: {e}")
+            return False
+
+    async def alist_parts(self, key, upload_id):
+        client = await self.async_client()
+        if not client:
+            logger.error("S3 client not initialized")
+            return None
+
+        try:
+            parts = []
+            paginator = client.get_paginator('list_parts')
+            async for page in paginator.paginate(Bucket=self.bucket_name, Key=key, UploadId=upload_id):
+                for part in page.get('Parts', []):
+                    parts.append({'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']})
+            return parts
+        except NoCredentialsError:
+            logger.error("AWS credentials not found")
+            return None
+        except ClientError as e:
+            logger.error(f"Failed to list parts for {key}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error listing parts for {key}: {e}")
+            return None
+
     def check_connection(self):
         """Check if S3 connection is working"""
         if not self.client:
@@ -152,8 +679,22 @@ class S3Client:
             self.client.head_bucket(Bucket=self.bucket_name)
             return True, "S3 connection successful"
         except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code == '404':
+                return False, f"S3 bucket '{self.bucket_name}' does not exist"
+            if error_code == '403':
+                return False, f"Access denied to S3 bucket '{self.bucket_name}'"
             return False, f"S3 connection failed: {e}"
         except Exception as e:
             return False, f"Unexpected error: {e}"
 
-s3_client = S3Client()
+
+def _remaining_size(file_obj):
+    """Bytes left in a seekable file object, None if it can't tell"""
+    try:
+        position = file_obj.tell()
+        size = file_obj.seek(0, 2) - position
+        file_obj.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
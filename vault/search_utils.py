@@ -0,0 +1,66 @@
+"""
+Vault-wide name search.
+
+Names are indexed as a 'simple' tsvector (no stemming, no stop words) of the
+name with punctuation turned into spaces, so "Q3_report-final.pdf" can be
+found as q3, report, final or pdf. Every search term matches as a word
+prefix and results are ranked with ts_rank, favouring shorter names.
+"""
+import re
+import uuid
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField, Func, Value
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = 'simple'
+MAX_SEARCH_TERMS = 8
+
+
+def name_search_vector():
+    """The indexed expression, searches must use it unchanged to hit the GIN index"""
+    words = Func(F('name'), Value('[[:punct:][:space:]]+'), Value(' '), Value('g'), function='regexp_replace')
+    return SearchVector(words, config=SEARCH_CONFIG)
+
+
+def parse_search_query(text):
+    """Turn user input into a prefix tsquery, None if it has no searchable words"""
+    terms = re.findall(r'[^\W_]+', text.lower())[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    # Terms only hold word characters, so they are safe to use as raw tsquery operands
+    return SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config=SEARCH_CONFIG)
+
+
+def search_names(queryset, query):
+    """Rows of `queryset` whose name matches `query`, annotated with a `rank`"""
+    # Normalization 1 divides the rank by 1 + log(length), so tighter names win.
+    # The rank is cast to double precision so it survives a round trip through a cursor
+    rank = Cast(SearchRank(name_search_vector(), query, normalization=Value(1)), FloatField())
+    return queryset.annotate(search=name_search_vector(), rank=rank).filter(search=query)
+
+
+def folder_paths(user, folder_ids):
+    """
+    Map each of `folder_ids` to its path from the root, as a list of
+    {'id', 'name'} dicts ending with the folder itself.
+    """
+    from .models import Folder
+
+    folder_ids = {folder_id for folder_id in folder_ids if folder_id}
+    if not folder_ids:
+        return {}
+
+    # Materialized paths give every ancestor id up front, so two queries
+    # cover any number of folders at any depth
+    paths = dict(Folder.objects.filter(user=user, id__in=folder_ids).values_list('id', 'path'))
+    ancestor_ids = {ancestor_id for path in paths.values() for ancestor_id in path.split('/')[:-1]}
+    names = dict(Folder.objects.filter(user=user, id__in=ancestor_ids).values_list('id', 'name'))
+
+    return {
+        folder_id: [
+            {'id': ancestor_id, 'name': names[ancestor_id]}
+            for ancestor_id in map(uuid.UUID, path.split('/')[:-1])
+        ]
+        for folder_id, path in paths.items()
+    }
@@ -1,7 +1,10 @@
 from django.contrib.auth.models import User
+from django.db import models
+from django.urls import reverse
 from rest_framework import serializers
-from .models import UserFile, StoredFile, Folder, UserProfile
-from .s3_utils import s3_client
+from .compression_utils import presignable
+from .models import UserFile, StoredFile, Folder, UserProfile, UploadSession
+from .storage import storage
 
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -24,39 +27,77 @@ class StoredFileSerializer(serializers.ModelSerializer):
         model = StoredFile
         fields = ('size',)
 
+class UserFileListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Sign every URL of the listing in one cached pass instead of per field
+        files = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        keys = []
+        if 's3_url' in self.child.fields:
+            request = self.context.get('request')
+            keys += [f.stored_file.s3_key for f in files if presignable(f.stored_file, request)]
+        if 'thumbnail_url' in self.child.fields:
+            keys += [f.stored_file.thumbnail_s3_key for f in files if f.stored_file.thumbnail_s3_key]
+        self.context['presigned_urls'] = storage.generate_presigned_urls(keys)
+        return super().to_representation(files)
+
+
 class UserFileSerializer(serializers.ModelSerializer):
-    size = serializers.IntegerField(source='stored_file.size', read_only=True)
+    """Pass `fields=[...]` to only render (and sign URLs for) those fields, `id` is always kept."""
     s3_url = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
+    # 'pending' until the background worker has rendered the thumbnail
+    thumbnail_status = serializers.CharField(source='stored_file.thumbnail_status', read_only=True)
 
     class Meta:
         model = UserFile
-        fields = ('id', 'name', 'size', 'created_at', 's3_url', 'thumbnail_url', 'folder')
+        fields = ('id', 'name', 'size', 'created_at', 's3_url', 'thumbnail_url', 'thumbnail_status', 'folder')
+        list_serializer_class = UserFileListSerializer
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields) - {'id'}:
+                self.fields.pop(field_name)
+
+    def _presigned_url(self, key):
+        urls = self.context.get('presigned_urls')
+        if urls is None:
+            urls = storage.generate_presigned_urls([key])
+        return urls.get(key)
 
     def get_s3_url(self, obj):
-        try:
-            url = s3_client.generate_presigned_url(obj.stored_file.s3_key)
-            print(f"Generated S3 URL for {obj.stored_file.s3_key}: {url}")
-            return url
-        except Exception as e:
-            print(f"Failed to generate S3 URL for {obj.stored_file.s3_key}: {e}")
-            return None
-    
+        request = self.context.get('request')
+        if not presignable(obj.stored_file, request):
+            # No single object the client can use, the API reassembles or decodes it
+            url = reverse('file-content', args=[obj.id])
+            return request.build_absolute_uri(url) if request else url
+        return self._presigned_url(obj.stored_file.s3_key)
+
     def get_thumbnail_url(self, obj):
         if obj.stored_file.thumbnail_s3_key:
-            try:
-                url = s3_client.generate_presigned_url(obj.stored_file.thumbnail_s3_key)
-                print(f"Generated thumbnail URL for {obj.stored_file.thumbnail_s3_key}: {url}")
-                return url
-            except Exception as e:
-                print(f"Failed to generate thumbnail URL for {obj.stored_file.thumbnail_s3_key}: {e}")
-                return None
+            return self._presigned_url(obj.stored_file.thumbnail_s3_key)
         return None
 
 class FolderSerializer(serializers.ModelSerializer):
+    """A parent can only be set with a request in the context, and only to one of its user's folders."""
+    parent = serializers.PrimaryKeyRelatedField(queryset=Folder.objects.none(), allow_null=True, required=False)
+
     class Meta:
         model = Folder
         fields = ('id', 'name', 'parent', 'created_at')
         extra_kwargs = {
             'user': {'read_only': True},
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None:
+            self.fields['parent'].queryset = Folder.objects.filter(user=request.user, is_deleted=False)
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    part_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'name', 'size', 'file_hash', 'folder', 'part_size', 'part_count', 'status', 'error', 'created_at', 'expires_at')
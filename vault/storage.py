@@ -0,0 +1,18 @@
+"""The storage backend chosen by VAULT_STORAGE_BACKEND, shared by the whole app"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .s3_utils import S3Client
+from .storage_backends import LocalStorage
+
+
+def build_storage():
+    backend = settings.VAULT_STORAGE_BACKEND
+    if backend == 's3':
+        return S3Client()
+    if backend == 'local':
+        return LocalStorage(settings.VAULT_LOCAL_STORAGE_ROOT, settings.VAULT_LOCAL_STORAGE_BASE_URL)
+    raise ImproperlyConfigured(f"Unknown VAULT_STORAGE_BACKEND {backend!r}, use 's3' or 'local'")
+
+
+storage = build_storage()
@@ -0,0 +1,438 @@
+"""
+Storage backends: where the bytes of stored files, previews and uploads live.
+
+Every backend implements the `StorageBackend` interface, modelled on the
+subset of S3 the vault uses, and follows S3Client's conventions: failures
+are logged and reported as False or None instead of raised. The backend in
+use is picked by VAULT_STORAGE_BACKEND, see `vault.storage`.
+"""
+import abc
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import quote, unquote
+
+from django.core import signing
+from django.urls import reverse
+
+from .async_utils import run_in_storage_pool
+
+logger = logging.getLogger(__name__)
+
+LOCAL_URL_SALT = 'vault.local-storage'
+SEGMENT_DIR = '+'
+SHARD_DIR = '='
+OBJECT_FILE = '@'
+
+
+class StorageBackend(abc.ABC):
+    """The operations the vault needs from an object store"""
+    name = None
+
+    @abc.abstractmethod
+    def upload_fileobj(self, file_obj, key, content_encoding=None):
+        """Store the contents of a binary file object under `key`, returns True on success"""
+
+    @abc.abstractmethod
+    def create_multipart_upload(self, key, content_encoding=None):
+        """Start a multipart upload and return its upload id"""
+
+    @abc.abstractmethod
+    def upload_part(self, key, upload_id, part_number, body):
+        """Store one part of a multipart upload, bytes or a binary file object, and return its ETag"""
+
+    @abc.abstractmethod
+    def complete_multipart_upload(self, key, upload_id, parts):
+        """Assemble a multipart upload from a list of {'PartNumber', 'ETag'} dicts"""
+
+    @abc.abstractmethod
+    def abort_multipart_upload(self, key, upload_id):
+        """Discard a multipart upload and the parts received, returns True on success"""
+
+    @abc.abstractmethod
+    def list_parts(self, key, upload_id):
+        """The parts received so far as {'PartNumber', 'ETag', 'Size'} dicts, by part number"""
+
+    @abc.abstractmethod
+    def generate_presigned_part_url(self, key, upload_id, part_number, expiration=3600):
+        """A URL a client can PUT one part to directly"""
+
+    @abc.abstractmethod
+    def head_object(self, key):
+        """The object's ContentLength, LastModified (and ContentEncoding), or None if it does not exist"""
+
+    @abc.abstractmethod
+    def get_object_stream(self, key, byte_range=None):
+        """
+        A streaming body for the object, or for the inclusive (first, last)
+        `byte_range` of it. Read it with read() or iter_chunks() and close it.
+        """
+
+    @abc.abstractmethod
+    def copy_object(self, source_key, key, content_encoding=None):
+        """Copy an object to `key`, keeping its encoding unless one is given, returns True on success"""
+
+    @abc.abstractmethod
+    def list_objects(self, start_after='', max_keys=1000):
+        """
+        One page of the keys after `start_after`, in byte order. Returns
+        (objects, truncated) where each object has Key, Size and LastModified.
+        """
+
+    @abc.abstractmethod
+    def generate_presigned_url(self, key, expiration=3600):
+        """A URL anyone can GET the object from until it expires"""
+
+    def generate_presigned_urls(self, keys, expiration=3600):
+        """Presigned URLs for many keys at once, returns {key: url}"""
+        urls = {}
+        for key in set(keys):
+            url = self.generate_presigned_url(key, expiration=expiration)
+            if url:
+                urls[key] = url
+        return urls
+
+    @abc.abstractmethod
+    def delete_object(self, key):
+        """Delete an object, returns True on success (also when it did not exist)"""
+
+    @abc.abstractmethod
+    def delete_objects(self, keys):
+        """Delete many objects, returns the set of keys that could not be deleted or None"""
+
+    @abc.abstractmethod
+    def check_connection(self):
+        """(ok, message)"""
+
+    def local_path(self, key):
+        """A filesystem path holding the object, for backends that have one"""
+        return None
+
+    # Coroutine versions of the calls the async views make. Backends without
+    # an async client run the blocking call in the storage pool
+
+    async def aupload_fileobj(self, file_obj, key, content_encoding=None):
+        return await run_in_storage_pool(self.upload_fileobj, file_obj, key, content_encoding)
+
+    async def acreate_multipart_upload(self, key, content_encoding=None):
+        return await run_in_storage_pool(self.create_multipart_upload, key, content_encoding)
+
+    async def aupload_part(self, key, upload_id, part_number, body):
+        return await run_in_storage_pool(self.upload_part, key, upload_id, part_number, body)
+
+    async def acomplete_multipart_upload(self, key, upload_id, parts):
+        return await run_in_storage_pool(self.complete_multipart_upload, key, upload_id, parts)
+
+    async def aabort_multipart_upload(self, key, upload_id):
+        return await run_in_storage_pool(self.abort_multipart_upload, key, upload_id)
+
+    async def alist_parts(self, key, upload_id):
+        return await run_in_storage_pool(self.list_parts, key, upload_id)
+
+
+class LocalObjectBody:
+    """A file, or a range of it, read like botocore's StreamingBody"""
+
+    def __init__(self, path, start=0, length=None):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = length
+
+    def read(self, amt=None):
+        if self._remaining is not None:
+            amt = self._remaining if amt is None else min(amt, self._remaining)
+        data = self._file.read(-1 if amt is None else amt)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return data
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self._file.close()
+
+
+class LocalStorage(StorageBackend):
+    """
+    Objects stored as files under `root`, for tests, benchmarks and small
+    deployments that have no S3.
+
+    Files live in data/ in a tree that follows the key: a directory per
+    '/'-separated segment, then two levels named after the first and next
+    two bytes of the last segment, so no directory grows past a few
+    thousand entries until one prefix holds hundreds of millions of objects.
+    Every name in the tree is a prefix of the keys below it, which lets a
+    listing walk it in byte order and start right after `start_after`.
+    Writes go through a temporary file and a rename, so readers never see a
+    partial object. Presigned URLs are signed links to `LocalStorageView`
+    under `base_url`, which serves the file with FileResponse and thus
+    sendfile where the server supports it.
+    """
+    name = 'local'
+
+    def __init__(self, root, base_url=''):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/')
+        for directory in ('data', 'metadata', 'multipart', 'tmp'):
+            os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+
+    def _shard(self, key):
+        # Segment directories, shard directories and files are told apart by
+        # their first character, which quote() always escapes
+        *segments, name = key.split('/')
+        data = name.encode()
+        return [
+            *(SEGMENT_DIR + quote(segment, safe='') for segment in segments),
+            SHARD_DIR + data[:2].hex(), SHARD_DIR + data[2:4].hex(), OBJECT_FILE + quote(name, safe=''),
+        ]
+
+    def _path(self, key):
+        return os.path.join(self.root, 'data', *self._shard(key))
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, 'metadata', *self._shard(key))
+
+    def _write(self, path, chunks):
+        """Write `chunks` to `path` atomically, returns the MD5 of the content"""
+        md5 = hashlib.md5()
+        temp_path = os.path.join(self.root, 'tmp', uuid.uuid4().hex)
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    md5.update(chunk)
+                    f.write(chunk)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return md5.hexdigest()
+
+    def _set_meta(self, key, content_encoding):
+        path = self._meta_path(key)
+        if content_encoding:
+            self._write(path, [json.dumps({'ContentEncoding': content_encoding}).encode()])
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _get_meta(self, key):
+        try:
+            with open(self._meta_path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _sign(self, payload, expiration):
+        payload['x'] = int(time.time()) + expiration
+        return signing.dumps(payload, salt=LOCAL_URL_SALT, compress=True)
+
+    @staticmethod
+    def unsign(token):
+        """The payload of a signed URL token, None if it is forged or expired"""
+        try:
+            payload = signing.loads(token, salt=LOCAL_URL_SALT)
+        except signing.BadSignature:
+            return None
+        return payload if payload.get('x', 0) >= time.time() else None
+
+    def upload_fileobj(self, file_obj, key, content_encoding=None):
+        try:
+            self._write(self._path(key), iter(lambda: file_obj.read(1024 * 1024), b''))
+            self._set_meta(key, content_encoding)
+            return True
+        except OSError as e:
+            logger.error(f"Local upload failed for {key}: {e}")
+            return False
+
+    def _upload_dir(self, upload_id):
+        if not upload_id or not upload_id.isalnum():
+            raise FileNotFoundError(f"Unknown upload {upload_id!r}")
+        return os.path.join(self.root, 'multipart', upload_id)
+
+    def create_multipart_upload(self, key, content_encoding=None):
+        upload_id = uuid.uuid4().hex
+        try:
+            os.makedirs(self._upload_dir(upload_id))
+            with open(os.path.join(self._upload_dir(upload_id), 'upload.json'), 'w') as f:
+                json.dump({'key': key, 'content_encoding': content_encoding}, f)
+            return upload_id
+        except OSError as e:
+            logger.error(f"Failed to start multipart upload for {key}: {e}")
+            return None
+
+    def upload_part(self, key, upload_id, part_number, body):
+        try:
+            upload_dir = self._upload_dir(upload_id)
+            if not os.path.isdir(upload_dir):
+                raise FileNotFoundError(f"Unknown upload {upload_id}")
+            chunks = [body] if isinstance(body, bytes) else iter(lambda: body.read(1024 * 1024), b'')
+            return '"%s"' % self._write(os.path.join(upload_dir, f'{part_number:05d}'), chunks)
+        except OSError as e:
+            logger.error(f"Failed to upload part {part_number} for {key}: {e}")
+            return None
+
+    def list_parts(self, key, upload_id):
+        try:
+            upload_dir = self._upload_dir(upload_id)
+            parts = []
+            for name in sorted(os.listdir(upload_dir)):
+                if name.isdigit():
+                    path = os.path.join(upload_dir, name)
+                    with open(path, 'rb') as f:
+                        etag = hashlib.file_digest(f, 'md5').hexdigest()
+                    parts.append({'PartNumber': int(name), 'ETag': f'"{etag}"', 'Size': os.path.getsize(path)})
+            return parts
+        except OSError as e:
+            logger.error(f"Failed to list parts for {key}: {e}")
+            return None
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        try:
+            upload_dir = self._upload_dir(upload_id)
+            with open(os.path.join(upload_dir, 'upload.json')) as f:
+                upload = json.load(f)
+
+            def part_chunks():
+                for part in parts:
+                    with open(os.path.join(upload_dir, f"{part['PartNumber']:05d}"), 'rb') as f:
+                        yield from iter(lambda: f.read(1024 * 1024), b'')
+
+            self._write(self._path(key), part_chunks())
+            self._set_meta(key, upload['content_encoding'])
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            return True
+        except OSError as e:
+            logger.error(f"Failed to complete multipart upload for {key}: {e}")
+            return False
+
+    def abort_multipart_upload(self, key, upload_id):
+        try:
+            shutil.rmtree(self._upload_dir(upload_id))
+            return True
+        except OSError as e:
+            logger.error(f"Failed to abort multipart upload for {key}: {e}")
+            return False
+
+    def generate_presigned_part_url(self, key, upload_id, part_number, expiration=3600):
+        token = self._sign({'k': key, 'u': upload_id, 'p': part_number}, expiration)
+        return self.base_url + reverse('local-storage', args=[token])
+
+    def head_object(self, key):
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.error(f"Local head failed for {key}: {e}")
+            return None
+        head = {
+            'ContentLength': stat.st_size,
+            'LastModified': datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc),
+        }
+        head.update(self._get_meta(key))
+        return head
+
+    def get_object_stream(self, key, byte_range=None):
+        try:
+            if byte_range is None:
+                return LocalObjectBody(self._path(key))
+            first, last = byte_range
+            return LocalObjectBody(self._path(key), first, last - first + 1)
+        except OSError as e:
+            logger.error(f"Local read failed for {key}: {e}")
+            return None
+
+    def copy_object(self, source_key, key, content_encoding=None):
+        try:
+            with open(self._path(source_key), 'rb') as f:
+                self._write(self._path(key), iter(lambda: f.read(1024 * 1024), b''))
+            self._set_meta(key, content_encoding or self._get_meta(source_key).get('ContentEncoding'))
+            return True
+        except OSError as e:
+            logger.error(f"Local copy failed for {source_key} -> {key}: {e}")
+            return False
+
+    def list_objects(self, start_after='', max_keys=1000):
+        try:
+            page = list(itertools.islice(self._walk(start_after.encode()), max_keys + 1))
+            objects = []
+            for key in page[:max_keys]:
+                stat = os.stat(self._path(key))
+                objects.append({
+                    'Key': key,
+                    'Size': stat.st_size,
+                    'LastModified': datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc),
+                })
+            return objects, len(page) > max_keys
+        except OSError as e:
+            logger.error(f"Failed to list objects after {start_after!r}: {e}")
+            return None
+
+    def _walk(self, start_after):
+        """
+        Yield the keys after `start_after` (bytes) in byte order. A directory
+        waits in the heap under the prefix its keys share, and is only read
+        once every key before that prefix has been yielded; directories
+        whose keys all come before `start_after` are never read.
+        """
+        # (lower bound of the keys, tie-break, path, key prefix, is a file)
+        heap = [(b'', 0, os.path.join(self.root, 'data'), '', False)]
+        counter = itertools.count(1)
+        while heap:
+            bound, _, path, prefix, is_file = heapq.heappop(heap)
+            if is_file:
+                yield prefix
+                continue
+            for entry in os.scandir(path):
+                marker, name = entry.name[:1], entry.name[1:]
+                if marker == OBJECT_FILE:
+                    key = prefix + unquote(name)
+                    key_bound, child_prefix, child_is_file = key.encode(), key, True
+                    if key_bound <= start_after:
+                        continue
+                elif marker == SEGMENT_DIR:
+                    child_prefix = prefix + unquote(name) + '/'
+                    key_bound, child_is_file = child_prefix.encode(), False
+                elif marker == SHARD_DIR:
+                    key_bound, child_prefix, child_is_file = bound + bytes.fromhex(name), prefix, False
+                else:
+                    continue
+                if not child_is_file and key_bound < start_after[:len(key_bound)]:
+                    continue
+                heapq.heappush(heap, (key_bound, next(counter), entry.path, child_prefix, child_is_file))
+
+    def generate_presigned_url(self, key, expiration=3600):
+        return self.base_url + reverse('local-storage', args=[self._sign({'k': key}, expiration)])
+
+    def delete_object(self, key):
+        try:
+            for path in (self._path(key), self._meta_path(key)):
+                if os.path.exists(path):
+                    os.remove(path)
+            return True
+        except OSError as e:
+            logger.error(f"Local delete failed for {key}: {e}")
+            return False
+
+    def delete_objects(self, keys):
+        return {key for key in keys if not self.delete_object(key)}
+
+    def check_connection(self):
+        if os.access(os.path.join(self.root, 'data'), os.W_OK):
+            return True, f"Local storage at {self.root} is writable"
+        return False, f"Local storage at {self.root} is not writable"
+
+    def local_path(self, key):
+        return self._path(key)
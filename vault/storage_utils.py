@@ -0,0 +1,153 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .cache_utils import invalidate_listings
+from .chunk_utils import release_file_chunks
+from .models import Chunk, Folder, Rendition, StoredFile, ThumbnailJob, UserFile, UserProfile, UploadSession
+from .storage import storage
+from .upload_utils import delete_user_file, expire_upload_sessions
+
+
+def delete_folder_tree(folder):
+    """
+    Soft-delete `folder`, every folder below it and every file in them.
+
+    Runs a fixed number of statements whatever the size of the tree: stored
+    file references and the owner's quota are given back by aggregated
+    UPDATEs, and stored files left without references are marked orphaned
+    for `reclaim_storage`. Returns (files_deleted, bytes_freed), or None if
+    the folder was already deleted.
+    """
+    with transaction.atomic():
+        # The owner's profile is locked first, like every other quota change.
+        # Then the subtree, in a stable order so overlapping deletes and moves
+        # (of an ancestor and a descendant) wait for each other
+        UserProfile.objects.select_for_update().get(user_id=folder.user_id)
+        locked = list(
+            folder.subtree().filter(is_deleted=False).select_for_update().order_by('pk').values_list('pk', flat=True)
+        )
+        if folder.pk not in locked:
+            return None
+
+        files = folder.subtree_files()
+        references = files.filter(stored_file=OuterRef('pk')).values('stored_file').annotate(count=Count('pk')).values('count')
+        # Stored files that lose all their references are marked orphaned in the same statement
+        StoredFile.objects.filter(pk__in=files.values('stored_file')).update(
+            ref_count=F('ref_count') - Subquery(references),
+            orphaned_at=Case(When(ref_count=Subquery(references), then=Value(timezone.now())), default=F('orphaned_at')),
+        )
+
+        totals = files.aggregate(count=Count('pk'), size=Sum('size'))
+        files.update(is_deleted=True)
+        freed = totals['size'] or 0
+        UserProfile.objects.filter(user_id=folder.user_id).update(storage_used=F('storage_used') - freed)
+
+        folder.subtree().update(is_deleted=True)
+        invalidate_listings([folder.user_id])
+    folder.is_deleted = True
+    return totals['count'], freed
+
+
+def reclaim_orphaned_files(limit=1000):
+    """
+    Delete stored files that have been orphaned for longer than
+    VAULT_ORPHAN_GRACE_PERIOD, with their thumbnails and renditions. S3
+    objects are deleted in bulk first, rows only once their objects are
+    gone. Returns how many stored files were reclaimed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.VAULT_ORPHAN_GRACE_PERIOD)
+    with transaction.atomic():
+        # Rows stay locked until they are gone: a re-upload of the same content
+        # waits and then stores it again, and other reclaimers skip them
+        stored_files = list(
+            StoredFile.objects.filter(ref_count=0, orphaned_at__lte=cutoff)
+            .exclude(thumbnail_job__status=ThumbnailJob.RUNNING)
+            .select_for_update(skip_locked=True, of=('self',))
+            .only('pk', 's3_key', 'thumbnail_s3_key')[:limit]
+        )
+        if not stored_files:
+            return 0
+
+        keys = {stored_file.pk: {stored_file.s3_key} for stored_file in stored_files}
+        for stored_file in stored_files:
+            if stored_file.thumbnail_s3_key:
+                keys[stored_file.pk].add(stored_file.thumbnail_s3_key)
+        for stored_file_id, rendition_key in Rendition.objects.filter(stored_file__in=stored_files).values_list('stored_file_id', 's3_key'):
+            keys[stored_file_id].add(rendition_key)
+
+        failed = storage.delete_objects({key for file_keys in keys.values() for key in file_keys})
+        if failed is None:
+            return 0
+        # A row whose objects were not all deleted is retried by the next run
+        reclaimed = [pk for pk, file_keys in keys.items() if not file_keys & failed]
+        # Chunks shared with other files live on, the rest become orphans in turn
+        release_file_chunks(reclaimed)
+        StoredFile.objects.filter(pk__in=reclaimed).delete()
+    return len(reclaimed)
+
+
+def reclaim_orphaned_chunks(limit=1000):
+    """
+    Delete chunks that no chunked stored file has used for longer than
+    VAULT_ORPHAN_GRACE_PERIOD, including uploaded chunks that were never
+    assembled into a file. Returns how many chunks were reclaimed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.VAULT_ORPHAN_GRACE_PERIOD)
+    with transaction.atomic():
+        chunks = dict(
+            Chunk.objects.filter(ref_count=0, orphaned_at__lte=cutoff)
+            .select_for_update(skip_locked=True)
+            .values_list('pk', 's3_key')[:limit]
+        )
+        if not chunks:
+            return 0
+
+        failed = storage.delete_objects(chunks.values())
+        if failed is None:
+            return 0
+        reclaimed = [pk for pk, key in chunks.items() if key not in failed]
+        Chunk.objects.filter(pk__in=reclaimed).delete()
+    return len(reclaimed)
+
+
+def purge_deleted_folders(limit=500):
+    """
+    Remove the rows of deleted folders, deepest first, with their deleted
+    files. Returns how many folders were purged.
+
+    Only folders without subfolders are purged, a deep tree a level per
+    batch, so deleting a row never cascades onto another folder. Files and
+    upload sessions that reached a deleted folder while it was being deleted
+    are given back and aborted first; a folder that gains any while it is
+    being purged waits for the next run.
+    """
+    deleted = Folder.objects.filter(is_deleted=True)
+    for user_file in UserFile.objects.filter(folder__in=deleted, is_deleted=False).select_related('stored_file')[:limit]:
+        delete_user_file(user_file)
+    expire_upload_sessions(UploadSession.objects.filter(folder__in=deleted)[:limit])
+
+    with transaction.atomic():
+        # Locked rows take no new files, sessions or subfolders until they are gone
+        locked = list(
+            deleted.exclude(subfolders__isnull=False)
+            .order_by(Length('path').desc())
+            .select_for_update(skip_locked=True)
+            .values_list('pk', flat=True)[:limit]
+        )
+        folder_ids = list(
+            Folder.objects.filter(pk__in=locked)
+            .exclude(subfolders__isnull=False)
+            .exclude(files__is_deleted=False)
+            .exclude(upload_sessions__isnull=False)
+            .values_list('pk', flat=True)
+        )
+        if not folder_ids:
+            return 0
+        UserFile.objects.filter(folder_id__in=folder_ids, is_deleted=True).delete()
+        Folder.objects.filter(pk__in=folder_ids).delete()
+    return len(folder_ids)
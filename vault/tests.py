@@ -1,3 +1,695 @@
-from django.test import TestCase
+import hashlib
+import random
+import subprocess
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Sum
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .async_utils import aiter_in_pool
+from .chunk_utils import iter_chunks
+from .compression_utils import GZIP, IDENTITY, choose_encoding
+from .models import Chunk, Folder, QuotaReservation, RevokedToken, StoredFile, UploadSession, UserFile, UserProfile
+from .quota_utils import reconcile_quotas, release_quota, reserve_quota
+from .rendition_utils import render_preview
+from .s3_utils import TARGET_TRANSFER_PARTS, transfer_config
+from .storage_backends import LocalStorage
+from .storage_utils import delete_folder_tree, purge_deleted_folders
+from .thumbnail_queue import enqueue_thumbnail
+from .thumbnail_utils import detect_media_kind, generate_video_thumbnail, media_kind
+from .upload_utils import (
+    FolderDeleted, acquire_stored_file, claim_upload_verifications, create_stored_file, register_user_file,
+    verify_upload_session
+)
+from .views import (
+    FileDeleteView, FileListView, FileUploadView, UploadSessionCompleteView, UploadSessionCreateView,
+    UploadSessionDetailView, UploadSessionPartUploadView, parse_range
+)
+
+
+class FileListQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('lister', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_files(self, count, folder=None):
+        start = StoredFile.objects.count()
+        for i in range(start, start + count):
+            stored_file = StoredFile.objects.create(
+                file_hash=f'{i:064x}', s3_key=f'{i:064x}', thumbnail_s3_key=f'thumbnails/{i:064x}.jpg', size=i + 1
+            )
+            UserFile.objects.create(user=self.user, stored_file=stored_file, folder=folder, name=f'file-{i}.txt', size=i + 1)
+        # The rows were written behind the listing cache's back
+        cache.clear()
+
+    def test_listing_query_count_does_not_grow_with_folder_size(self):
+        folder = Folder.objects.create(user=self.user, name='docs')
+        Folder.objects.create(user=self.user, parent=folder, name='nested')
+
+        for ordering in ('name', '-created_at', 'size'):
+            StoredFile.objects.all().delete()
+            self.add_files(2, folder)
+            # The listing version, folders, files and the quota
+            with self.assertNumQueries(4):
+                response = self.client.get('/api/files/', {'folder_id': folder.id, 'ordering': ordering})
+            self.assertEqual(len(response.json()['data']['files']), 2)
+
+            self.add_files(40, folder)
+            with self.assertNumQueries(4):
+                response = self.client.get('/api/files/', {'folder_id': folder.id, 'ordering': ordering})
+            data = response.json()['data']
+            self.assertEqual(len(data['files']), 42)
+            self.assertEqual(len(data['folders']), 1)
+            self.assertIn('thumbnail_status', data['files'][0])
+
+    def test_paging_keeps_query_count(self):
+        self.add_files(25)
+        seen = []
+        cursor = None
+        queries = 4
+        while True:
+            params = {'limit': 10, 'ordering': '-size'}
+            if cursor:
+                params['cursor'] = cursor
+            # Once the cursor is past the folders they are not queried again
+            with self.assertNumQueries(queries):
+                data = self.client.get('/api/files/', params).json()['data']
+            seen += [f['size'] for f in data['files']]
+            cursor = data['next_cursor']
+            queries = 3
+            if not cursor:
+                break
+        self.assertEqual(seen, list(range(25, 0, -1)))
+
+    def test_repeat_listing_is_cached_until_a_change(self):
+        self.add_files(3)
+        response = self.client.get('/api/files/')
+        etag = response['ETag']
+        # Only the listing version is read
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get('/api/files/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(len(self.client.get('/api/files/').json()['data']['files']), 3)
+
+        stored_file, _ = create_stored_file('f' * 64, 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            register_user_file(self.user, stored_file, 'new.txt', None)
+        response = self.client.get('/api/files/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']['files']), 4)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class FolderMoveTests(TestCase):
+    def test_cycle_check_uses_the_current_paths(self):
+        user = User.objects.create_user('mover', password='pw')
+        first = Folder.objects.create(user=user, name='first')
+        second = Folder.objects.create(user=user, name='second')
+        stale_first, stale_second = Folder.objects.get(pk=first.pk), Folder.objects.get(pk=second.pk)
+        second.move_to(first)
+
+        # `second` is below `first` now, whatever the stale instances say
+        with self.assertRaises(ValueError):
+            stale_first.move_to(stale_second)
+        first.refresh_from_db()
+        self.assertIsNone(first.parent_id)
+        self.assertEqual(Folder.objects.get(pk=second.pk).path, f'{first.pk}/{second.pk}/')
+
+    def test_parent_must_belong_to_the_user(self):
+        owner = User.objects.create_user('owner', password='pw')
+        other = User.objects.create_user('other', password='pw')
+        folder = Folder.objects.create(user=owner, name='mine')
+        client = APIClient()
+        client.force_authenticate(other)
+        response = client.post('/api/folders/', {'name': 'inside', 'parent': str(folder.pk)}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(folder.subtree()), [folder])
+
+
+class FolderPurgeTests(TestCase):
+    def test_purge_gives_back_files_that_reached_a_deleted_folder(self):
+        user = User.objects.create_user('purger', password='password')
+        root = Folder.objects.create(user=user, name='root')
+        child = Folder.objects.create(user=user, parent=root, name='child')
+        stored_file, _ = create_stored_file('f' * 64, 100)
+        register_user_file(user, stored_file, 'early.bin', child)
+        delete_folder_tree(root)
+
+        with self.assertRaises(FolderDeleted):
+            register_user_file(user, acquire_stored_file('f' * 64), 'late.bin', child)
+        # A file that got in before the lock existed, as the purge may still find
+        UserFile.objects.create(user=user, folder=child, stored_file=stored_file, name='raced.bin', size=100)
+        StoredFile.objects.filter(pk=stored_file.pk).update(ref_count=1)
+        UserProfile.objects.filter(user=user).update(storage_used=100)
+
+        while purge_deleted_folders():
+            pass
+        self.assertFalse(Folder.objects.exists())
+        self.assertFalse(UserFile.objects.exists())
+        stored_file.refresh_from_db()
+        self.assertEqual(stored_file.ref_count, 0)
+        self.assertEqual(UserProfile.objects.get(user=user).storage_used, 0)
+
+
+class UploadCheckTests(TestCase):
+    def test_check_only_confirms_the_users_own_content(self):
+        owner, other = (User.objects.create_user(name, password='password') for name in ('owner', 'other'))
+        stored_file, _ = create_stored_file('e' * 64, 100)
+        register_user_file(owner, stored_file, 'mine.bin', None)
+        body = {'file_hash': 'e' * 64, 'size': 100, 'name': 'copy.bin'}
+
+        client = APIClient()
+        client.force_authenticate(other)
+        response = client.post('/api/files/upload/check/', body, format='json')
+        self.assertEqual(response.json()['data'], {'exists': False})
+
+        client.force_authenticate(owner)
+        response = client.post('/api/files/upload/check/', body, format='json')
+        self.assertEqual(response.status_code, 201)
+        stored_file.refresh_from_db()
+        self.assertEqual(stored_file.ref_count, 2)
+
+
+class ChunkScopeTests(TestCase):
+    def test_chunks_only_count_for_the_user_who_uploaded_them(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch('vault.chunk_utils.storage', LocalStorage(directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        owner, other = (User.objects.create_user(name, password='password') for name in ('chunker', 'guesser'))
+        chunk = b'chunk content'
+        chunk_hash = hashlib.sha256(chunk).hexdigest()
+        body = {'name': 'chunked.bin', 'chunks': [chunk_hash]}
+
+        client = APIClient()
+        client.force_authenticate(owner)
+        response = client.put(f'/api/chunks/{chunk_hash}/', chunk, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+
+        client.force_authenticate(other)
+        response = client.post('/api/chunks/', {'chunks': [chunk_hash]}, format='json')
+        self.assertEqual(response.json()['data'], {'missing': [chunk_hash]})
+        response = client.post('/api/files/chunked/', body, format='json')
+        self.assertEqual(response.status_code, 409)
+
+        client.force_authenticate(owner)
+        response = client.post('/api/files/chunked/', body, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['data']['size'], len(chunk))
+
+    def test_chunks_need_room_in_the_quota(self):
+        user = User.objects.create_user('hoarder', password='password')
+        UserProfile.objects.filter(user=user).update(storage_limit=4)
+        chunk = b'chunk content'
+        chunk_hash = hashlib.sha256(chunk).hexdigest()
+
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.put(f'/api/chunks/{chunk_hash}/', chunk, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Chunk.objects.exists())
+
+
+class UploadVerificationTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = LocalStorage(directory.name)
+        patcher = mock.patch('vault.upload_utils.storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('uploader', password='password')
+
+    def completed_session(self, body, declared):
+        session = UploadSession.objects.create(
+            user=self.user, name='upload.bin', size=len(body), file_hash=hashlib.sha256(declared).hexdigest(),
+            s3_key=f'tmp/uploads/{uuid.uuid4()}', upload_id='assembled', part_size=len(body),
+            status=UploadSession.VERIFYING,
+        )
+        reserve_quota(self.user.pk, len(body), upload_session=session)
+        self.storage.upload_fileobj(BytesIO(body), session.s3_key)
+        return session
+
+    def test_completed_sessions_are_verified_in_the_background(self):
+        good = self.completed_session(b'verified content', b'verified content')
+        bad = self.completed_session(b'tampered content', b'declared content')
+
+        statuses = {session.pk: verify_upload_session(session) for session in claim_upload_verifications(10)}
+        self.assertEqual(statuses, {good.pk: UploadSession.COMPLETED, bad.pk: UploadSession.FAILED})
+        self.assertEqual(claim_upload_verifications(10), [])
+
+        good.refresh_from_db()
+        self.assertEqual(good.user_file.stored_file.file_hash, good.file_hash)
+        self.assertIsNotNone(self.storage.head_object(good.file_hash))
+        self.assertIsNone(self.storage.head_object(bad.s3_key))
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.storage_used, profile.storage_reserved), (16, 0))
+        self.assertFalse(QuotaReservation.objects.exists())
+
+    def test_failed_promotion_is_retried(self):
+        session = self.completed_session(b'promoted content', b'promoted content')
+
+        with mock.patch.object(self.storage, 'copy_object', return_value=False):
+            self.assertEqual(verify_upload_session(claim_upload_verifications(10)[0]), UploadSession.VERIFYING)
+        self.assertIsNotNone(self.storage.head_object(session.s3_key))
+
+        self.assertEqual(verify_upload_session(claim_upload_verifications(10)[0]), UploadSession.COMPLETED)
+        self.assertIsNone(self.storage.head_object(session.s3_key))
+        self.assertIsNotNone(self.storage.head_object(session.file_hash))
+
+
+class RefCountStressTests(TransactionTestCase):
+    """Hundreds of concurrent uploads and deletes of one piece of content"""
+    THREADS = 16
+    OPERATIONS_PER_THREAD = 25
+    FILE_HASH = 'ab' * 32
+    FILE_SIZE = 1000
+
+    def run_in_threads(self, work):
+        errors = []
+
+        def run(n):
+            try:
+                work(n)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            list(pool.map(run, range(self.THREADS)))
+        self.assertEqual(errors, [])
+
+    def test_parallel_uploads_and_deletes_keep_ref_count_and_quota(self):
+        users = [User.objects.create_user(f'stress{i}', password='password') for i in range(4)]
+        stored_file, _ = create_stored_file(self.FILE_HASH, self.FILE_SIZE)
+        register_user_file(users[0], stored_file, 'seed.bin', None)
+        # The check only registers content the user already has
+        for user in users[1:]:
+            register_user_file(user, acquire_stored_file(self.FILE_HASH), 'seed.bin', None)
+        statuses = []
+
+        def work(n):
+            # Threads of the same user share file names, so they also race on
+            # re-uploading, reviving and deleting the same rows
+            client = APIClient()
+            client.force_authenticate(users[n % len(users)])
+            for i in range(self.OPERATIONS_PER_THREAD):
+                response = client.post('/api/files/upload/check/', {
+                    'file_hash': self.FILE_HASH, 'size': self.FILE_SIZE, 'name': f'copy-{i % 5}.bin'
+                }, format='json')
+                statuses.append(response.status_code)
+                if response.status_code == 201 and (n + i) % 2:
+                    file_id = response.json()['data']['file']['id']
+                    statuses.append(client.delete(f'/api/files/{file_id}/').status_code)
+
+        self.run_in_threads(work)
+
+        self.assertTrue(set(statuses) <= {200, 201, 404}, set(statuses))
+        stored_file.refresh_from_db()
+        live_files = UserFile.objects.filter(stored_file=stored_file, is_deleted=False)
+        self.assertEqual(stored_file.ref_count, live_files.count())
+        for user in users:
+            used = UserProfile.objects.get(user=user).storage_used
+            self.assertEqual(used, live_files.filter(user=user).aggregate(total=Sum('size'))['total'] or 0)
+
+    def test_parallel_creates_of_the_same_content_share_one_row(self):
+        created = []
+        lock = threading.Lock()
+
+        def work(n):
+            stored_file, was_created = create_stored_file(self.FILE_HASH, self.FILE_SIZE)
+            with lock:
+                created.append(was_created)
+
+        self.run_in_threads(work)
+
+        self.assertEqual(created.count(True), 1)
+        self.assertEqual(StoredFile.objects.get(file_hash=self.FILE_HASH).ref_count, self.THREADS)
+
+
+class QuotaReservationTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reserver', password='password')
+        UserProfile.objects.filter(user=self.user).update(storage_limit=10000)
+
+    def test_parallel_reservations_never_overshoot(self):
+        def reserve(n):
+            try:
+                return reserve_quota(self.user.pk, 1000)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            reservations = [r for r in pool.map(reserve, range(16)) if r is not None]
+
+        self.assertEqual(len(reservations), 10)
+        self.assertEqual(UserProfile.objects.get(user=self.user).storage_reserved, 10000)
+        # Committing charges what the file takes, the rest of the reservation is given back
+        stored_file, _ = create_stored_file('c' * 64, 600)
+        self.assertIsNotNone(register_user_file(self.user, stored_file, 'a.bin', None, reservations[0]))
+        for reservation in reservations:
+            release_quota(reservation)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.storage_used, profile.storage_reserved), (600, 0))
+        self.assertFalse(QuotaReservation.objects.exists())
+
+    def test_reconcile_corrects_drift(self):
+        stored_file, _ = create_stored_file('d' * 64, 700)
+        register_user_file(self.user, stored_file, 'b.bin', None)
+        live = reserve_quota(self.user.pk, 100)
+        leaked = reserve_quota(self.user.pk, 200)
+        QuotaReservation.objects.filter(pk=leaked.pk).update(expires_at=timezone.now())
+        UserProfile.objects.filter(user=self.user).update(storage_used=5)
+
+        corrections = [row for batch in reconcile_quotas(batch_size=1) for row in batch]
+        self.assertEqual(corrections, [(self.user.pk, 5, 700, 300, 100)])
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.storage_used, profile.storage_reserved), (700, 100))
+        self.assertEqual(list(QuotaReservation.objects.values_list('pk', flat=True)), [live.pk])
+        self.assertEqual([row for batch in reconcile_quotas() for row in batch], [])
+
+
+class ContentDefinedChunkingTests(SimpleTestCase):
+    SIZES = {'min_size': 2048, 'avg_size': 8192, 'max_size': 32768}
+
+    def chunks(self, data):
+        return list(iter_chunks(BytesIO(data), **self.SIZES))
+
+    def test_chunks_reassemble_within_size_bounds(self):
+        data = random.Random(1).randbytes(500000)
+        chunks = self.chunks(data)
+        self.assertEqual(b''.join(chunks), data)
+        self.assertTrue(all(self.SIZES['min_size'] <= len(c) <= self.SIZES['max_size'] for c in chunks[:-1]))
+
+    def test_insert_only_changes_nearby_chunks(self):
+        data = random.Random(2).randbytes(500000)
+        edited = data[:250000] + b'inserted' + data[250000:]
+        before, after = self.chunks(data), self.chunks(edited)
+        # Boundaries resynchronise after the edit, so all but a couple of chunks are shared
+        self.assertLessEqual(len(set(after) - set(before)), 2)
+
+
+class LocalStorageTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = LocalStorage(directory.name)
+
+    def test_ranged_reads_and_multipart_uploads(self):
+        self.assertTrue(self.storage.upload_fileobj(BytesIO(b'0123456789'), 'a', content_encoding='gzip'))
+        self.assertEqual(self.storage.get_object_stream('a', byte_range=(2, 5)).read(), b'2345')
+        self.assertEqual(self.storage.head_object('a')['ContentEncoding'], 'gzip')
+
+        upload_id = self.storage.create_multipart_upload('b')
+        for part_number, body in ((2, b'world'), (1, b'hello ')):
+            self.storage.upload_part('b', upload_id, part_number, body)
+        parts = self.storage.list_parts('b', upload_id)
+        self.assertEqual([part['Size'] for part in parts], [6, 5])
+        self.assertTrue(self.storage.complete_multipart_upload('b', upload_id, parts))
+        self.assertEqual(self.storage.get_object_stream('b').read(), b'hello world')
+
+    def test_presigned_urls_are_absolute(self):
+        storage = LocalStorage(self.storage.root, 'https://vault.example.com/')
+        self.assertTrue(storage.generate_presigned_url('a').startswith('https://vault.example.com/api/'))
+
+    def test_listing_pages_in_byte_order(self):
+        # Segment directories and the keys sharing their first bytes interleave
+        keys = ['chunks/ff', 'a/b', 'a-c', 'a', 'ab', 'abcdef', 'Z', 'tmp/x', '0', 'ü/1', '/lead']
+        for key in keys:
+            self.storage.upload_fileobj(BytesIO(b'x'), key)
+        listed, after = [], ''
+        while True:
+            objects, truncated = self.storage.list_objects(start_after=after, max_keys=2)
+            listed += [obj['Key'] for obj in objects]
+            if not truncated:
+                break
+            after = listed[-1]
+        self.assertEqual(listed, sorted(keys))
+        objects, _ = self.storage.list_objects(start_after='a.', max_keys=3)
+        self.assertEqual([obj['Key'] for obj in objects], ['a/b', 'ab', 'abcdef'])
+        self.assertEqual(self.storage.delete_objects(keys), set())
+        self.assertEqual(self.storage.list_objects(), ([], False))
+
+
+class LocalStorageViewTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = LocalStorage(directory.name)
+        patcher = mock.patch('vault.views.storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_part_uploads_are_capped_at_the_part_size(self):
+        key = 'tmp/uploads/direct'
+        upload_id = self.storage.create_multipart_upload(key)
+        UploadSession.objects.create(
+            user=User.objects.create_user('direct', password='password'), name='direct.bin', size=8,
+            file_hash='0' * 64, s3_key=key, upload_id=upload_id, part_size=5,
+        )
+        url = self.storage.generate_presigned_part_url(key, upload_id, 1)
+
+        response = self.client.put(url, b'x' * 6, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.storage.list_parts(key, upload_id), [])
+
+        response = self.client.put(url, b'x' * 5, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.storage.list_parts(key, upload_id)[0]['ETag'], response['ETag'])
+
+
+class ThumbnailSourceTests(SimpleTestCase):
+    def test_thumbnail_is_rendered_from_the_whole_object(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        local = LocalStorage(directory.name)
+        # Noise doesn't compress, so the PNG is far larger than the sniffed head of an upload
+        image = Image.frombytes('RGB', (400, 300), random.Random(3).randbytes(400 * 300 * 3))
+        source = BytesIO()
+        image.save(source, format='PNG')
+        self.assertGreater(source.tell(), 4 * settings.VAULT_THUMBNAIL_SNIFF_SIZE)
+        source.seek(0)
+        local.upload_fileobj(source, 'image')
+
+        with mock.patch('vault.rendition_utils.storage', local):
+            thumbnail = render_preview('image', 'image', 128, 'jpeg')
+        self.assertEqual(Image.open(thumbnail).size, (128, 96))
+
+    @override_settings(VAULT_VIDEO_THUMBNAIL_TIMEOUT=0.01)
+    def test_video_timeouts_are_retried_not_recorded(self):
+        # Busy slots and slow ffmpeg runs raise, so the job fails and is retried instead of completing with None
+        with mock.patch('vault.thumbnail_utils._video_slots', threading.Semaphore(0)):
+            with self.assertRaises(RuntimeError):
+                generate_video_thumbnail('video.mp4')
+        timeout = subprocess.TimeoutExpired('ffmpeg', 0.01)
+        with mock.patch('vault.thumbnail_utils.subprocess.run', side_effect=timeout):
+            with self.assertRaises(RuntimeError):
+                generate_video_thumbnail('video.mp4')
+        undecodable = subprocess.CompletedProcess([], 1, b'', b'video.mp4: Invalid data found when processing input')
+        with mock.patch('vault.thumbnail_utils.subprocess.run', return_value=undecodable):
+            self.assertIsNone(generate_video_thumbnail('video.mp4'))
+
+
+class MediaKindTests(SimpleTestCase):
+    def test_bmp_needs_a_valid_header(self):
+        bmp = BytesIO()
+        Image.new('RGB', (4, 4)).save(bmp, format='BMP')
+        self.assertEqual(detect_media_kind(bmp.getvalue()), 'image')
+        self.assertIsNone(detect_media_kind(b'BM is for bookmarks, not a bitmap'))
+
+    def test_iso_media_is_classified_by_brand(self):
+        def iso(brand, *boxes):
+            return b'\x00\x00\x00\x18ftyp' + brand + b'\x00' * 12 + b''.join(boxes)
+
+        audio_track = b'moov' + b'hdlr' + b'\x00' * 8 + b'soun'
+        video_track = b'moov' + b'hdlr' + b'\x00' * 8 + b'vide'
+        self.assertIsNone(media_kind(iso(b'M4A '), 'song.mp4'))
+        self.assertIsNone(media_kind(iso(b'3gp4', audio_track), 'voice.3gp'))
+        self.assertEqual(media_kind(iso(b'3gp4', video_track), 'clip.3gp'), 'video')
+        self.assertEqual(media_kind(iso(b'isom', video_track), 'clip'), 'video')
+        self.assertEqual(media_kind(iso(b'heic'), 'photo'), 'image')
+
+
+class CompressionChoiceTests(SimpleTestCase):
+    @override_settings(VAULT_COMPRESSION_ENABLED=True)
+    def test_encoding_depends_on_the_content_only(self):
+        text = b'the same content under any name ' * 1000
+        self.assertNotEqual(choose_encoding(text), IDENTITY)
+        # Media is stored as-is, whatever it is named
+        self.assertEqual(choose_encoding(b'\xff\xd8\xff\xe0' + text), IDENTITY)
+
+    def test_compressed_content_gets_no_thumbnail(self):
+        # Content that was compressed is not media, an image extension does not queue a thumbnail of it
+        stored_file = StoredFile(file_hash='0' * 64, s3_key='0' * 64, size=1, encoding=GZIP)
+        self.assertFalse(enqueue_thumbnail(stored_file, b'plain text', 'notes.jpg'))
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=990-2000', 1000), (990, 999))
+        self.assertFalse(parse_range('bytes=1000-', 1000))
+        # Malformed and multi-range headers are ignored, the whole file is sent
+        self.assertIsNone(parse_range('bytes=5-1', 1000))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 1000))
+
+
+class AsyncStreamingTests(SimpleTestCase):
+    async def test_aiter_in_pool_streams_and_closes_early(self):
+        closed = []
+
+        def pieces():
+            try:
+                for i in range(1000):
+                    yield bytes([i % 256]) * 10
+            finally:
+                closed.append(True)
+
+        stream = aiter_in_pool(pieces())
+        received = [await anext(stream) for _ in range(3)]
+        await stream.aclose()
+        self.assertEqual(received, [b'\x00' * 10, b'\x01' * 10, b'\x02' * 10])
+        # A client that disconnects closes the storage read too
+        self.assertEqual(closed, [True])
+
+
+class AsyncFileViewTests(TransactionTestCase):
+    """The file views are async views, served on the event loop under ASGI"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = LocalStorage(directory.name)
+        for target in ('vault.upload_utils.storage', 'vault.views.storage'):
+            patcher = mock.patch(target, self.storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('streamer', password='password')
+
+    def test_file_views_are_async(self):
+        for view in (FileUploadView, FileListView, FileDeleteView, UploadSessionCreateView,
+                     UploadSessionDetailView, UploadSessionPartUploadView, UploadSessionCompleteView):
+            self.assertTrue(view.view_is_async, view.__name__)
+
+    def test_upload_without_a_length_is_refused(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/files/upload/', {'file': SimpleUploadedFile('a.bin', b'abc')}, CONTENT_LENGTH='')
+        self.assertEqual(response.status_code, 411)
+        self.assertFalse(QuotaReservation.objects.exists())
+
+    async def authorization(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.user).access_token))()
+        return {'Authorization': f'Bearer {token}'}
+
+    async def test_upload_list_and_delete(self):
+        client, headers = AsyncClient(), await self.authorization()
+        content = random.Random(5).randbytes(1024 * 1024)
+
+        response = await client.post('/api/files/upload/', {'file': SimpleUploadedFile('big.bin', content)}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        file_id = response.json()['data']['id']
+        stored_file = await StoredFile.objects.aget()
+        self.assertEqual(stored_file.file_hash, hashlib.sha256(content).hexdigest())
+
+        listing = (await client.get('/api/files/', headers=headers)).json()['data']
+        self.assertEqual([item['id'] for item in listing['files']], [file_id])
+        self.assertEqual(listing['storage_used'], len(content))
+
+        self.assertEqual((await client.delete(f'/api/files/{file_id}/', headers=headers)).status_code, 200)
+        self.assertEqual((await UserProfile.objects.aget(user=self.user)).storage_used, 0)
+
+    async def test_over_quota_upload_is_refused(self):
+        await UserProfile.objects.filter(user=self.user).aupdate(storage_limit=1000)
+        response = await AsyncClient().post(
+            '/api/files/upload/', {'file': SimpleUploadedFile('big.bin', b'x' * 4096)}, headers=await self.authorization()
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(await StoredFile.objects.aexists())
+
+
+    async def test_status_counts_parts_sent_to_storage_directly(self):
+        client, headers = AsyncClient(), await self.authorization()
+        content = b'direct part'
+        response = await client.post('/api/files/uploads/', {
+            'file_hash': hashlib.sha256(content).hexdigest(), 'size': len(content), 'name': 'direct.bin',
+        }, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 201)
+        session = await UploadSession.objects.aget()
+
+        # As a PUT to a presigned part URL would, bypassing the API
+        self.storage.upload_part(session.s3_key, session.upload_id, 1, content)
+        status = (await client.get(f'/api/files/uploads/{session.id}/', headers=headers)).json()['data']
+        self.assertEqual(status['missing_parts'], [])
+        self.assertEqual(status['bytes_received'], len(content))
+
+
+class TransferConfigTests(SimpleTestCase):
+    def test_part_size_and_concurrency_follow_object_size(self):
+        small = transfer_config(20 * 1024 * 1024)
+        self.assertLessEqual(small.max_concurrency, 2)
+
+        huge_size = 2 * 1024 ** 4
+        huge = transfer_config(huge_size)
+        self.assertLessEqual(-(-huge_size // huge.multipart_chunksize), TARGET_TRANSFER_PARTS)
+        self.assertGreater(huge.max_concurrency, small.max_concurrency)
+
+
+class StatelessAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader', password='password')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = self.refresh.access_token
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+
+    def test_cached_listing_only_reads_its_version(self):
+        self.client.get('/api/files/')
+        # Authentication needs no query
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/files/').status_code, 200)
+
+    def test_logout_revokes_the_access_token(self):
+        self.assertEqual(self.client.get('/api/files/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/logout/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(self.client.get('/api/files/').status_code, 401)
+
+    @override_settings(VAULT_REVOKED_TOKENS_REFRESH=0)
+    def test_revocation_by_another_process_is_seen_without_the_cache(self):
+        self.assertEqual(self.client.get('/api/files/').status_code, 200)
+        RevokedToken.objects.create(jti=self.access['jti'], expires_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self.client.get('/api/files/').status_code, 401)
+
+    def test_deleted_user_gets_401(self):
+        self.user.delete()
+        self.assertEqual(self.client.post('/api/folders/', {'name': 'docs'}, format='json').status_code, 401)
+        self.assertEqual(self.client.get('/api/files/').status_code, 401)
+        self.assertEqual(self.client.get('/api/quota/').status_code, 401)
+        self.assertEqual(self.client.get('/api/token/verify/').status_code, 401)
+        self.assertFalse(Folder.objects.exists())
+
+    def test_deactivated_user_cannot_write(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.post('/api/folders/', {'name': 'docs'}, format='json').status_code, 401)
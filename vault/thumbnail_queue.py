@@ -0,0 +1,115 @@
+"""
+Background thumbnail generation.
+
+Uploads only enqueue a `ThumbnailJob`; the `run_thumbnail_worker` management
+command claims jobs from the database and renders them in a process pool.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache_utils import invalidate_stored_file_listings
+from .compression_utils import IDENTITY
+from .models import Rendition, StoredFile, ThumbnailJob
+from .rendition_utils import render_preview
+from .storage import storage
+from .thumbnail_utils import media_kind
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 128
+
+
+def enqueue_thumbnail(stored_file, head, name):
+    """Queue a thumbnail for a newly stored file if its content supports one"""
+    if stored_file.encoding != IDENTITY:
+        # Recognised media is always stored as is, so this content is not media
+        # whatever its extension, and the renderers could not read it compressed
+        return False
+    kind = media_kind(head, name)
+    if not kind:
+        return False
+
+    ThumbnailJob.objects.get_or_create(stored_file=stored_file, defaults={'source_name': name})
+    StoredFile.objects.filter(pk=stored_file.pk).update(
+        thumbnail_status=StoredFile.THUMBNAIL_PENDING, media_kind=kind
+    )
+    stored_file.thumbnail_status = StoredFile.THUMBNAIL_PENDING
+    stored_file.media_kind = kind
+    return True
+
+
+def claim_thumbnail_jobs(limit):
+    """
+    Lock up to `limit` runnable jobs and mark them running. Jobs left running
+    by a crashed worker become claimable again after VAULT_THUMBNAIL_JOB_TIMEOUT.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.VAULT_THUMBNAIL_JOB_TIMEOUT)
+    with transaction.atomic():
+        jobs = list(
+            ThumbnailJob.objects.select_for_update(skip_locked=True)
+            .select_related('stored_file')
+            .filter(status__in=[ThumbnailJob.QUEUED, ThumbnailJob.RUNNING], run_after__lte=now)
+            .exclude(status=ThumbnailJob.RUNNING, updated_at__gt=stale)
+            .order_by('run_after')[:limit]
+        )
+        ThumbnailJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=ThumbnailJob.RUNNING, attempts=F('attempts') + 1, updated_at=now
+        )
+    for job in jobs:
+        job.status = ThumbnailJob.RUNNING
+        job.attempts += 1
+    return jobs
+
+
+def complete_thumbnail_job(job, thumbnail_s3_key):
+    status = StoredFile.THUMBNAIL_READY if thumbnail_s3_key else StoredFile.THUMBNAIL_NONE
+    StoredFile.objects.filter(pk=job.stored_file_id).update(
+        thumbnail_s3_key=thumbnail_s3_key, thumbnail_status=status
+    )
+    invalidate_stored_file_listings([job.stored_file_id])
+    if thumbnail_s3_key:
+        # The thumbnail doubles as the smallest JPEG rendition
+        Rendition.objects.get_or_create(
+            stored_file_id=job.stored_file_id,
+            size=THUMBNAIL_SIZE,
+            format='jpeg',
+            defaults={'s3_key': thumbnail_s3_key}
+        )
+    job.delete()
+
+
+def fail_thumbnail_job(job, error):
+    logger.error(f"Thumbnail job for {job.stored_file_id} failed (attempt {job.attempts}): {error}")
+    job.last_error = str(error)
+    if job.attempts < settings.VAULT_THUMBNAIL_MAX_ATTEMPTS:
+        job.status = ThumbnailJob.QUEUED
+        job.run_after = timezone.now() + timedelta(seconds=30 * 2 ** job.attempts)
+        job.save()
+        return
+
+    job.status = ThumbnailJob.FAILED
+    job.save()
+    StoredFile.objects.filter(pk=job.stored_file_id).update(thumbnail_status=StoredFile.THUMBNAIL_FAILED)
+    invalidate_stored_file_listings([job.stored_file_id])
+
+
+def render_thumbnail(s3_key, file_hash, kind):
+    """
+    Runs inside a worker process: read the source from S3, render the
+    thumbnail and upload it. Returns the thumbnail key, or None when the
+    source cannot be thumbnailed.
+    """
+    thumbnail_obj = render_preview(s3_key, kind, THUMBNAIL_SIZE, 'jpeg')
+    if not thumbnail_obj:
+        return None
+
+    thumbnail_s3_key = f"thumb_{file_hash}.jpg"
+    if not storage.upload_fileobj(thumbnail_obj, thumbnail_s3_key):
+        raise RuntimeError(f"Could not upload {thumbnail_s3_key} to S3")
+    return thumbnail_s3_key
@@ -1,62 +1,153 @@
 from PIL import Image
-from moviepy import VideoFileClip
-import psutil
+from django.conf import settings
 from io import BytesIO
-import os
+import imageio_ffmpeg
+import re
+import struct
+import subprocess
+import threading
+import time
 
-def generate_image_thumbnail(file_obj):
+# Limits concurrent ffmpeg processes; the thumbnail worker swaps in a cross-process semaphore
+_video_slots = threading.BoundedSemaphore(settings.VAULT_VIDEO_THUMBNAIL_CONCURRENCY)
+
+# DIB header sizes: BITMAPCOREHEADER, BITMAPINFOHEADER, the V2/V3 extensions, OS/2 2.x, V4 and V5
+BMP_DIB_HEADER_SIZES = (12, 40, 52, 56, 64, 108, 124)
+# ISO base media major brands
+HEIF_BRANDS = (b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif', b'avis')
+AUDIO_BRANDS = (b'M4A ', b'M4B ', b'M4P ', b'F4A ', b'F4B ')
+VIDEO_BRANDS = (b'qt  ', b'M4V ', b'M4VH', b'M4VP', b'avc1', b'f4v ', b'MSNV')
+# Brands used for both audio and video; the track handlers tell them apart
+MIXED_BRANDS = (b'isom', b'iso2', b'iso4', b'iso5', b'iso6', b'mp41', b'mp42', b'dash', b'mmp4',
+                b'3gp4', b'3gp5', b'3gp6', b'3gp7', b'3ge6', b'3ge7', b'3gg6', b'3g2a', b'3g2b', b'3g2c')
+VIDEO_HANDLER = re.compile(rb'hdlr.{8}vide', re.DOTALL)
+# ffmpeg errors reading the source, as opposed to content it cannot decode
+FFMPEG_READ_ERRORS = re.compile(
+    rb'Server returned 5|Connection (refused|reset|timed out)|Network is unreachable|Input/output error'
+)
+
+def is_bmp(head):
+    """A BMP file header followed by a known DIB header, not just any file starting with 'BM'"""
+    if len(head) < 18 or head[:2] != b'BM':
+        return False
+    file_size, pixel_offset, dib_size = struct.unpack_from('<I4xII', head, 2)
+    return dib_size in BMP_DIB_HEADER_SIZES and 14 + dib_size <= pixel_offset <= file_size
+
+def iso_media_kind(head):
+    """The kind of an ISO base media file (MP4, MOV, 3GP, HEIF) from its major brand"""
+    brand = head[8:12]
+    if brand in HEIF_BRANDS:
+        return 'image'
+    if brand in AUDIO_BRANDS:
+        return 'audio'
+    if brand in VIDEO_BRANDS:
+        return 'video'
+    if brand in MIXED_BRANDS or brand.startswith((b'3gp', b'3g2')):
+        if b'moov' not in head:
+            # The index is at the end of the file, past the sniffed head: assume video
+            return 'video'
+        return 'video' if VIDEO_HANDLER.search(head) else 'audio'
+    return None
+
+def detect_media_kind(head):
+    """'image', 'video', 'audio' or None from the magic bytes at the start of a file"""
+    head = bytes(head)
+    if head.startswith((b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'II*\x00', b'MM\x00*')):
+        return 'image'
+    if is_bmp(head):
+        return 'image'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image'
+    if head[4:8] == b'ftyp':
+        return iso_media_kind(head)
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'video'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):  # Matroska / WebM
+        return 'video'
+    return None
+
+def generate_image_thumbnail(file_obj, size=128, format='JPEG'):
     try:
         file_obj.seek(0)
         image = Image.open(file_obj)
-        image.thumbnail((128, 128))
+        # Let the JPEG decoder downscale by DCT while decoding, then shrink with reduce()
+        image.draft('RGB', (size, size))
+        image.thumbnail((size, size), reducing_gap=2.0)
+        if format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
         thumb_io = BytesIO()
-        image.save(thumb_io, format='JPEG')
+        image.save(thumb_io, format=format)
         thumb_io.seek(0)
         return thumb_io
     except Exception:
         # Log error
         return None
 
-def generate_video_thumbnail(file_obj):
-    import tempfile
-    temp_file_path = None
-    try:
-        # Check available memory to avoid crashing
-        if psutil.virtual_memory().available < 1 * 1024 * 1024 * 1024: # 1 GB
-            return None
+def set_video_thumbnail_limiter(semaphore):
+    """Share one semaphore between worker processes instead of the per-process default"""
+    global _video_slots
+    _video_slots = semaphore
 
-        file_obj.seek(0)
-        # Create a secure temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.tmp') as temp_file:
-            temp_file_path = temp_file.name
-            temp_file.write(file_obj.read())
-        
-        clip = VideoFileClip(temp_file_path)
-        frame = clip.get_frame(1) # Get frame at 1 second
-        clip.close()
-        
-        image = Image.fromarray(frame)
-        image.thumbnail((128, 128))
-        
-        thumb_io = BytesIO()
-        image.save(thumb_io, format='JPEG')
-        thumb_io.seek(0)
-        return thumb_io
-    except Exception:
-        # Log error
+def generate_video_thumbnail(source, size=128, format='JPEG'):
+    """
+    Grab the frame at t=1s from a video file path or (presigned) URL.
+
+    ffmpeg seeks on the input, so it only reads the container index and the
+    data up to the nearest keyframe, over HTTP range requests for URLs,
+    instead of the whole file. Memory stays bounded to one decoded frame.
+
+    Returns None when the content has no frame to grab. Waiting too long for
+    a slot, ffmpeg timing out and errors reading the source raise
+    RuntimeError instead, so the job is retried later.
+    """
+    budget = settings.VAULT_VIDEO_THUMBNAIL_TIMEOUT
+    deadline = time.monotonic() + budget
+    if not _video_slots.acquire(timeout=budget):
+        raise RuntimeError(f"No ffmpeg slot free within {budget}s")
+    try:
+        for position in ('1', '0'):  # clips shorter than a second have no frame at 1s
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"ffmpeg took longer than {budget}s")
+            result = subprocess.run(
+                [
+                    imageio_ffmpeg.get_ffmpeg_exe(), '-loglevel', 'error',
+                    '-rw_timeout', str(budget * 1000000),
+                    '-ss', position, '-i', source,
+                    '-frames:v', '1',
+                    '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+                    '-f', 'image2pipe', '-c:v', 'png', '-',
+                ],
+                capture_output=True,
+                timeout=remaining,
+            )
+            if result.returncode == 0 and result.stdout:
+                return generate_image_thumbnail(BytesIO(result.stdout), size, format)
+            if FFMPEG_READ_ERRORS.search(result.stderr):
+                raise RuntimeError(f"ffmpeg could not read the source: {result.stderr.decode(errors='replace').strip()}")
         return None
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"ffmpeg took longer than {budget}s")
+    except OSError as e:
+        raise RuntimeError(f"Could not run ffmpeg: {e}")
     finally:
-        # Always cleanup temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except OSError:
-                pass  # File might already be deleted
-
-def generate_thumbnail(file_obj, filename):
+        _video_slots.release()
+
+def thumbnail_kind(filename):
+    """'image', 'video' or None from the file extension, when no content is at hand"""
     file_type = filename.split('.')[-1].lower()
     if file_type in ['jpg', 'jpeg', 'png', 'gif']:
-        return generate_image_thumbnail(file_obj)
+        return 'image'
     elif file_type in ['mp4', 'mov', 'avi', 'mkv']:
-        return generate_video_thumbnail(file_obj)
+        return 'video'
     return None
+
+def media_kind(head, filename):
+    """
+    'image', 'video' or None: content type wins, the extension only covers
+    content we cannot recognise. Recognised audio has no thumbnail.
+    """
+    kind = detect_media_kind(head)
+    if kind is None:
+        return thumbnail_kind(filename)
+    return kind if kind in ('image', 'video') else None
@@ -0,0 +1,457 @@
+import hashlib
+import logging
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .cache_utils import invalidate_listings
+from .compression_utils import IDENTITY, choose_encoding, compressor, stored_object_key
+from .models import Folder, StoredFile, UserFile, UserProfile, UploadSession, upload_session_expiry
+from .quota_utils import consume_reservation, release_quota, session_reservation
+from .storage import storage
+from .thumbnail_queue import enqueue_thumbnail
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_PARTS = 10000
+
+
+class StreamedUploadedFile(UploadedFile):
+    """
+    An uploaded file processed in one pass as the request body is parsed.
+
+    Every chunk is fed once into the SHA-256 hasher and a bounded sniff
+    buffer, and what is to be stored is written to a spooled temporary file
+    (in memory up to FILE_UPLOAD_MAX_MEMORY_SIZE). Once the sniff buffer is
+    full it also picks the `stored_encoding`, and the body is compressed on
+    its way to the spool when that is worth it. Nothing is sent to storage
+    until `acommit`, once the hash is known: a dedup hit costs no storage
+    request at all, and the rest goes straight to its final key.
+    """
+
+    def __init__(self, name, content_type, charset=None, content_type_extra=None, max_size=None):
+        super().__init__(
+            tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE),
+            name, content_type, 0, charset, content_type_extra
+        )
+        self.max_size = max_size
+        self.file_hash = None
+        self.head = bytearray()
+        self.quota_exceeded = False
+        # Chosen from the sniff buffer, None until then
+        self.stored_encoding = None
+        self.stored_size = 0
+        self._compressor = None
+        self._sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+
+    def write(self, data):
+        if self.quota_exceeded:
+            return
+
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.quota_exceeded = True
+            self.discard()
+            return
+
+        self._sha256.update(data)
+        missing = settings.VAULT_THUMBNAIL_SNIFF_SIZE - len(self.head)
+        if missing > 0:
+            self.head += data[:missing]
+
+        if self.stored_encoding is None:
+            # Held back until the head is complete and the encoding known
+            self._buffer += data
+            if len(self.head) >= settings.VAULT_THUMBNAIL_SNIFF_SIZE:
+                self._choose_encoding()
+        else:
+            self._store(data)
+
+    def finish(self):
+        if not self.quota_exceeded:
+            if self.stored_encoding is None:
+                self._choose_encoding()
+            if self._compressor is not None:
+                self._store_raw(self._compressor.flush())
+            self.file.seek(0)
+        self.file_hash = self._sha256.hexdigest()
+
+    @property
+    def content_encoding(self):
+        """The S3 Content-Encoding of the stored body"""
+        return None if self.stored_encoding in (None, IDENTITY) else self.stored_encoding
+
+    def _choose_encoding(self):
+        self.stored_encoding = choose_encoding(bytes(self.head))
+        if self.stored_encoding != IDENTITY:
+            self._compressor = compressor(self.stored_encoding)
+        pending, self._buffer = self._buffer, bytearray()
+        self._store(pending)
+
+    def _store(self, data):
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._store_raw(data)
+
+    def _store_raw(self, data):
+        self.stored_size += len(data)
+        self.file.write(data)
+
+    async def acommit(self, key):
+        """Store the spooled body under its final key, returns True on success"""
+        stored = await storage.aupload_fileobj(self.file, key, self.content_encoding)
+        self.discard()
+        return stored
+
+    def discard(self):
+        """Throw away the spooled body (dedup hit, failed or finished request)"""
+        self._buffer = bytearray()
+        self.file.close()
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """
+    Upload handler that streams the `file` field into a `StreamedUploadedFile`
+    instead of Django's memory/temp-file handlers.
+
+    `max_size` is the quota reserved for the upload; once the body grows past it
+    the upload is aborted and the rest of the body is drained without being
+    stored.
+    """
+    stream_field = 'file'
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.upload = None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if field_name == self.stream_field:
+            self.upload = StreamedUploadedFile(
+                file_name, content_type, charset, content_type_extra, max_size=self.max_size
+            )
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.field_name == self.stream_field:
+            self.upload.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.field_name != self.stream_field:
+            return None
+        self.upload.finish()
+        return self.upload
+
+    def upload_interrupted(self):
+        if self.upload is not None:
+            logger.info(f"Upload of {self.upload.name} interrupted, discarding it")
+            self.upload.discard()
+
+
+def multipart_part_size(size):
+    """Part size for a multipart upload of `size` bytes (S3 allows at most 10,000 parts)"""
+    part_size = settings.VAULT_UPLOAD_PART_SIZE
+    if size > part_size * MAX_UPLOAD_PARTS:
+        mib = 1024 * 1024
+        part_size = -(-size // MAX_UPLOAD_PARTS)
+        part_size = -(-part_size // mib) * mib
+    return part_size
+
+
+def promote_temp_object(temp_key, key, content_encoding=None):
+    """
+    Move a fully uploaded temporary object to its content-hash key. When the
+    copy fails the temporary object is kept, so the promotion can be retried.
+    """
+    # S3 has no rename, promote the temporary object with a server-side copy
+    if not storage.copy_object(temp_key, key, content_encoding):
+        return False
+    storage.delete_object(temp_key)
+    return True
+
+
+def hash_stored_object(key):
+    """
+    Stream an object back from S3 and return (sha256, size, head), where
+    head is the sniffed prefix of the content. Returns None on failure.
+    """
+    body = storage.get_object_stream(key)
+    if body is None:
+        return None
+
+    sha256 = hashlib.sha256()
+    size = 0
+    head = bytearray()
+    try:
+        for chunk in body.iter_chunks(chunk_size=1024 * 1024):
+            sha256.update(chunk)
+            size += len(chunk)
+            missing = settings.VAULT_THUMBNAIL_SNIFF_SIZE - len(head)
+            if missing > 0:
+                head += chunk[:missing]
+    except Exception as e:
+        logger.error(f"Failed to read back {key} from S3: {e}")
+        return None
+    finally:
+        body.close()
+    return sha256.hexdigest(), size, head
+
+
+def acquire_stored_file(file_hash, size=None):
+    """
+    Take a reference on the stored file with this content, returns it or
+    None when the content is not stored.
+    """
+    stored_files = StoredFile.objects.filter(file_hash=file_hash)
+    if size is not None:
+        stored_files = stored_files.filter(size=size)
+    # A single UPDATE, so concurrent references never overwrite each other.
+    # It revives an orphaned row, or waits for a reclaimer holding the row
+    # and then finds it gone
+    if not stored_files.update(ref_count=F('ref_count') + 1, orphaned_at=None):
+        return None
+    return stored_files.get()
+
+
+def create_stored_file(file_hash, size, encoding=IDENTITY, stored_size=None):
+    """
+    Record content that was just stored in S3 under its hash (and encoding,
+    see `stored_object_key`), holding one reference. Returns (stored_file, created).
+
+    Rows are only inserted once their content is in S3. When another request
+    stored the same content meanwhile, a reference is taken on its row
+    instead (the S3 object is content-addressed, so both wrote the same bytes).
+    """
+    while True:
+        try:
+            with transaction.atomic():
+                stored_file = StoredFile.objects.create(
+                    file_hash=file_hash, s3_key=stored_object_key(file_hash, encoding), size=size,
+                    encoding=encoding, stored_size=size if stored_size is None else stored_size, ref_count=1
+                )
+            return stored_file, True
+        except IntegrityError:
+            stored_file = acquire_stored_file(file_hash)
+            if stored_file is not None:
+                return stored_file, False
+            # The other row was reclaimed in between, try inserting again
+
+
+def release_stored_file(stored_file):
+    """
+    Drop one reference to `stored_file`. Dropping the last one only marks it
+    orphaned, `reclaim_storage` deletes it from S3 once the grace period is over.
+    """
+    # SET expressions see the old row, so `ref_count=1` means this drops the last reference
+    StoredFile.objects.filter(pk=stored_file.pk).update(
+        ref_count=F('ref_count') - 1,
+        orphaned_at=Case(When(ref_count=1, then=Value(timezone.now())), default=F('orphaned_at')),
+    )
+
+
+class FolderDeleted(ValueError):
+    pass
+
+
+def register_user_file(user, stored_file, name, folder, reservation=None):
+    """
+    Point the user's file `name` in `folder` at `stored_file` and update the quota.
+
+    The caller must already hold a reference on `stored_file` for this file.
+    Re-uploading over an existing name swaps the content and releases the
+    old reference, reusing a soft-deleted row with the same name if any.
+    The quota `reservation` made for the upload, if any, is committed: the
+    file's growth is charged instead. Returns None, releasing the caller's
+    reference, when the file does not fit in the user's quota, and raises
+    FolderDeleted, releasing it too, when `folder` was deleted meanwhile.
+    """
+    try:
+        return _register_user_file(user, stored_file, name, folder, reservation)
+    except FolderDeleted:
+        # The transaction was rolled back, the reference is released on its own
+        release_stored_file(stored_file)
+        raise
+
+
+def _register_user_file(user, stored_file, name, folder, reservation):
+    with transaction.atomic():
+        # Every quota change of a user locks their profile first, which
+        # serializes them and keeps the lock order the same everywhere
+        profile = UserProfile.objects.select_for_update().get(user=user)
+        # Then the folder, which delete_folder_tree and the purge lock too: a
+        # file is never added to a folder that is being or has been deleted
+        if folder is not None and not Folder.objects.select_for_update().filter(pk=folder.pk, is_deleted=False).exists():
+            raise FolderDeleted("Folder not found.")
+        # What other uploads reserved stays unavailable to this one
+        profile.storage_reserved -= consume_reservation(reservation)
+        user_file = UserFile.objects.select_for_update().filter(user=user, name=name, folder=folder).first()
+
+        old_stored_file = None
+        if user_file is None or user_file.is_deleted:
+            # A deleted row already gave back its reference and quota
+            growth = stored_file.size
+        elif user_file.stored_file_id == stored_file.pk:
+            # Same content under the same name, the caller's reference is redundant
+            release_stored_file(stored_file)
+            return user_file
+        else:
+            old_stored_file = user_file.stored_file
+            growth = stored_file.size - user_file.size
+
+        if growth > 0 and profile.storage_used + profile.storage_reserved + growth > profile.storage_limit:
+            release_stored_file(stored_file)
+            return None
+
+        if user_file is None:
+            user_file = UserFile.objects.create(
+                user=user, name=name, folder=folder, stored_file=stored_file, size=stored_file.size
+            )
+        else:
+            user_file.is_deleted = False
+            user_file.stored_file = stored_file
+            user_file.size = stored_file.size
+            user_file.save()
+
+        UserProfile.objects.filter(pk=profile.pk).update(storage_used=F('storage_used') + growth)
+        if old_stored_file is not None:
+            release_stored_file(old_stored_file)
+        invalidate_listings([user.pk])
+    return user_file
+
+
+def delete_user_file(user_file):
+    """Soft-delete a user's file, giving back its quota and its stored file reference"""
+    with transaction.atomic():
+        UserProfile.objects.select_for_update().get(user_id=user_file.user_id)
+        # Only the request that flips is_deleted gives anything back
+        if not UserFile.objects.filter(pk=user_file.pk, is_deleted=False).update(is_deleted=True):
+            return False
+        user_file.is_deleted = True
+        UserProfile.objects.filter(user_id=user_file.user_id).update(storage_used=F('storage_used') - user_file.size)
+        release_stored_file(user_file.stored_file)
+        invalidate_listings([user_file.user_id])
+    return True
+
+
+def expire_upload_sessions(sessions):
+    """
+    Delete `sessions` with their quota reservations and what they left in
+    S3 (the multipart upload, or the assembled object awaiting verification),
+    returns the count
+    """
+    count = 0
+    for session in sessions:
+        if session.status == UploadSession.UPLOADING:
+            storage.abort_multipart_upload(session.s3_key, session.upload_id)
+        elif session.status == UploadSession.VERIFYING:
+            storage.delete_object(session.s3_key)
+        discard_upload_session(session)
+        count += 1
+    return count
+
+
+def discard_upload_session(session):
+    """Delete an upload session that will not be registered, giving back the quota it reserved"""
+    release_quota(session_reservation(session))
+    session.delete()
+
+
+def expired_upload_sessions():
+    return UploadSession.objects.filter(expires_at__lte=timezone.now()).order_by('expires_at')
+
+
+def claim_upload_verifications(limit):
+    """
+    Claim up to `limit` completed sessions awaiting verification. Sessions
+    claimed by a verifier that crashed are claimed again after
+    VAULT_UPLOAD_VERIFY_TIMEOUT.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.VAULT_UPLOAD_VERIFY_TIMEOUT)
+    with transaction.atomic():
+        sessions = list(
+            UploadSession.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('user', 'folder')
+            .filter(status=UploadSession.VERIFYING)
+            .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lte=stale))
+            .order_by('created_at')[:limit]
+        )
+        # Not expired while it is being verified
+        UploadSession.objects.filter(pk__in=[session.pk for session in sessions]).update(
+            claimed_at=now, attempts=F('attempts') + 1, expires_at=upload_session_expiry()
+        )
+    for session in sessions:
+        session.claimed_at = now
+        session.attempts += 1
+    return sessions
+
+
+def verify_upload_session(session):
+    """
+    Check a claimed session's assembled object against the declared size and
+    hash, then register the file with the same dedup and quota rules as
+    FileUploadView, committing the session's quota reservation. Returns the
+    session's new status.
+    """
+    if session.folder is not None and session.folder.is_deleted:
+        storage.delete_object(session.s3_key)
+        return fail_upload_session(session, "Folder not found.")
+
+    head = storage.head_object(session.s3_key)
+    if head is None:
+        return retry_upload_verification(session)
+    if head['ContentLength'] != session.size:
+        storage.delete_object(session.s3_key)
+        return fail_upload_session(session, "Uploaded content does not match the declared size.")
+
+    # S3 cannot compute a full-object SHA-256, so the object is read back once
+    result = hash_stored_object(session.s3_key)
+    if result is None:
+        return retry_upload_verification(session)
+    file_hash, size, sniffed = result
+    if file_hash != session.file_hash or size != session.size:
+        storage.delete_object(session.s3_key)
+        return fail_upload_session(session, "Uploaded content does not match the declared hash.")
+
+    stored_file = acquire_stored_file(file_hash)
+    if stored_file is not None:
+        storage.delete_object(session.s3_key)
+    else:
+        if not promote_temp_object(session.s3_key, stored_object_key(file_hash, IDENTITY)):
+            return retry_upload_verification(session)
+        stored_file, created = create_stored_file(file_hash, size)
+        if created:
+            enqueue_thumbnail(stored_file, sniffed, session.name)
+
+    try:
+        user_file = register_user_file(session.user, stored_file, session.name, session.folder, session_reservation(session))
+    except FolderDeleted as e:
+        return fail_upload_session(session, str(e))
+    if user_file is None:
+        return fail_upload_session(session, "Storage limit exceeded.")
+
+    UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.COMPLETED, user_file=user_file, error='')
+    return UploadSession.COMPLETED
+
+
+def fail_upload_session(session, error):
+    release_quota(session_reservation(session))
+    UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.FAILED, error=error)
+    return UploadSession.FAILED
+
+
+def retry_upload_verification(session):
+    """Storage could not be read or written, let the next claim try again unless the attempts are used up"""
+    if session.attempts >= settings.VAULT_UPLOAD_VERIFY_MAX_ATTEMPTS:
+        storage.delete_object(session.s3_key)
+        return fail_upload_session(session, "Failed to verify upload.")
+    UploadSession.objects.filter(pk=session.pk).update(claimed_at=None)
+    return UploadSession.VERIFYING
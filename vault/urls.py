@@ -2,8 +2,11 @@ from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     RegisterView, LoginView, LogoutView, TokenVerifyView, S3StatusView,
-    FileUploadView, FileListView, FileDeleteView, FileDownloadView,
-    FolderCreateView
+    FileUploadView, FileUploadCheckView, FileListView, FileDeleteView, FileDownloadView,
+    FolderCreateView, UploadSessionCreateView, UploadSessionDetailView, UploadSessionPartsView,
+    UploadSessionPartUploadView, UploadSessionCompleteView, FilePreviewView, SearchView,
+    FolderDetailView, ChunkView, ChunkUploadView, ChunkedFileCreateView, FileContentView,
+    LocalStorageView, QuotaView
 )
 
 urlpatterns = [
@@ -14,8 +17,23 @@ urlpatterns = [
     path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('s3/status/', S3StatusView.as_view(), name='s3-status'),
     path('files/upload/', FileUploadView.as_view(), name='file-upload'),
+    path('files/upload/check/', FileUploadCheckView.as_view(), name='file-upload-check'),
+    path('files/uploads/', UploadSessionCreateView.as_view(), name='upload-session-create'),
+    path('files/uploads/<uuid:session_id>/', UploadSessionDetailView.as_view(), name='upload-session-detail'),
+    path('files/uploads/<uuid:session_id>/parts/', UploadSessionPartsView.as_view(), name='upload-session-parts'),
+    path('files/uploads/<uuid:session_id>/parts/<int:part_number>/', UploadSessionPartUploadView.as_view(), name='upload-session-part'),
+    path('files/uploads/<uuid:session_id>/complete/', UploadSessionCompleteView.as_view(), name='upload-session-complete'),
+    path('files/chunked/', ChunkedFileCreateView.as_view(), name='chunked-file-create'),
+    path('chunks/', ChunkView.as_view(), name='chunks'),
+    path('chunks/<str:chunk_hash>/', ChunkUploadView.as_view(), name='chunk-upload'),
     path('files/', FileListView.as_view(), name='file-list'),
     path('files/<uuid:file_id>/download/', FileDownloadView.as_view(), name='file-download'),
+    path('files/<uuid:file_id>/content/', FileContentView.as_view(), name='file-content'),
+    path('files/<uuid:file_id>/preview/', FilePreviewView.as_view(), name='file-preview'),
     path('files/<uuid:file_id>/', FileDeleteView.as_view(), name='file-delete'),
     path('folders/', FolderCreateView.as_view(), name='folder-create'),
+    path('folders/<uuid:folder_id>/', FolderDetailView.as_view(), name='folder-detail'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('quota/', QuotaView.as_view(), name='quota'),
+    path('storage/<str:token>/', LocalStorageView.as_view(), name='local-storage'),
 ]
@@ -1,14 +1,132 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
 from rest_framework import generics, status, renderers
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
-from .serializers import UserSerializer, UserFileSerializer, FolderSerializer
-from .models import StoredFile, UserFile, Folder
-from .s3_utils import s3_client
-from .thumbnail_utils import generate_thumbnail
+from .serializers import UserSerializer, UserFileSerializer, FolderSerializer, UploadSessionSerializer
+from .models import UserProfile, UserFile, Folder, UploadSession, UploadPart, upload_session_expiry
+from .storage import storage
+from .storage_backends import LocalStorage
+from .async_utils import AsyncAPIView, file_response, request_data, streaming_response
+from .auth_utils import UserNotFound, revoke_token
+from .cache_utils import cache_listing, get_cached_listing, invalidate_listings, listing_cache_key
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_order, keyset_seek
+from .storage_utils import delete_folder_tree
+from .compression_utils import IDENTITY, accepts_encoding, decode_stream, presignable, stored_object_key
+from .chunk_utils import chunking_params, create_chunked_stored_file, iter_stored_content, missing_chunks, store_chunk
+from .search_utils import folder_paths, parse_search_query, search_names
+from .rendition_utils import RENDITION_FORMATS, get_or_create_rendition
+from .thumbnail_queue import enqueue_thumbnail
+from .thumbnail_utils import thumbnail_kind
+from .upload_utils import (
+    FolderDeleted, StreamingUploadHandler, acquire_stored_file, create_stored_file, register_user_file, delete_user_file,
+    multipart_part_size, expire_upload_sessions, expired_upload_sessions, discard_upload_session
+)
+from .quota_utils import quota_usage, release_quota, reserve_quota
 import hashlib
+import re
+import uuid
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+MAX_PRESIGNED_PARTS = 1000
+LISTING_ORDERINGS = ('name', '-name', 'created_at', '-created_at', 'size', '-size')
+LISTING_PAGE_SIZE = 200
+LISTING_MAX_PAGE_SIZE = 1000
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 200
+LISTING_FILE_COLUMNS = (
+    'id', 'name', 'size', 'created_at', 'folder_id', 'stored_file',
+    'stored_file__s3_key', 'stored_file__chunked', 'stored_file__encoding',
+    'stored_file__thumbnail_s3_key', 'stored_file__thumbnail_status',
+)
+MAX_MANIFEST_CHUNKS = 100000
+
+
+def parse_range(header, length):
+    """
+    The inclusive (first, last) byte range a `Range: bytes=...` header asks
+    for in content of `length` bytes. None when the header is malformed or
+    asks for several ranges, so the whole content is sent, and False when
+    the range is unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        # Suffix range: the last `end` bytes
+        suffix = int(end)
+        if not suffix or not length:
+            return False
+        return max(length - suffix, 0), length - 1
+    first = int(start)
+    if end and int(end) < first:
+        return None
+    if first >= length:
+        return False
+    last = min(int(end), length - 1) if end else length - 1
+    return first, last
+
+
+def etag_matches(header, etag):
+    """Whether an If-None-Match header matches `etag` (weak comparison)"""
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+
+def parse_declared_file(data):
+    """Read the (file_hash, size, name) a client declares before sending a body"""
+    file_hash = str(data.get('file_hash') or '').lower()
+    name = data.get('name')
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return None
+
+    if not name or size < 0 or not SHA256_RE.match(file_hash):
+        return None
+    return file_hash, size, name
+
+
+def parse_chunk_hashes(value, limit=MAX_MANIFEST_CHUNKS):
+    """Validate a list of chunk SHA-256s, None if it is not one"""
+    if not isinstance(value, list) or not value or len(value) > limit:
+        return None
+    chunk_hashes = [str(chunk_hash).lower() for chunk_hash in value]
+    if not all(SHA256_RE.match(chunk_hash) for chunk_hash in chunk_hashes):
+        return None
+    return chunk_hashes
+
+
+def parse_part_numbers(value, part_count):
+    """Parse "1-100,150" style part lists, defaulting to the first parts"""
+    if not value:
+        return list(range(1, min(part_count, MAX_PRESIGNED_PARTS) + 1))
+
+    part_numbers = set()
+    for item in value.split(','):
+        first, _, last = item.strip().partition('-')
+        first = int(first)
+        last = int(last) if last else first
+        part_numbers.update(range(first, last + 1))
+        if len(part_numbers) > MAX_PRESIGNED_PARTS:
+            raise ValueError("too many parts")
+
+    if any(n < 1 or n > part_count for n in part_numbers):
+        raise ValueError("part number out of range")
+    return sorted(part_numbers)
 
 class CustomJSONRenderer(renderers.JSONRenderer):
     def render(self, data, accepted_media_type=None, renderer_context=None):
@@ -79,11 +197,18 @@ class TokenVerifyView(APIView):
     renderer_classes = [CustomJSONRenderer]
 
     def get(self, request):
-        if request.user.is_authenticated:
+        user = request.user
+        if user.is_authenticated:
+            # Authentication trusts the token, the account itself is checked here
+            try:
+                user.refresh_from_db()
+            except user.DoesNotExist:
+                user = None
+        if user is not None and user.is_authenticated and user.is_active:
             return Response({
                 "success": True,
                 "message": "Token is valid.",
-                "data": UserSerializer(request.user).data
+                "data": UserSerializer(user).data
             })
         return Response({
             "success": False,
@@ -103,6 +228,8 @@ class LogoutView(APIView):
                 token.blacklist()
         except Exception:
             pass  # Token might already be blacklisted or invalid
+        # The access token would otherwise stay usable until it expires
+        revoke_token(request.auth)
         
         return Response({
             "success": True,
@@ -128,7 +255,7 @@ class S3StatusView(APIView):
         }
         
         # Check S3 connection
-        connection_status, connection_message = s3_client.check_connection()
+        connection_status, connection_message = storage.check_connection()
         
         return Response({
             "success": True,
@@ -137,191 +264,674 @@ class S3StatusView(APIView):
                 "s3_config": s3_config,
                 "connection_status": connection_status,
                 "connection_message": connection_message,
-                "s3_client_initialized": s3_client.client is not None,
+                "storage_backend": storage.name,
+                "s3_client_initialized": getattr(storage, 'client', None) is not None,
             }
         })
 
 
-class FileUploadView(APIView):
+class FileUploadView(AsyncAPIView):
     renderer_classes = [CustomJSONRenderer]
 
-    def post(self, request):
-        file_obj = request.FILES.get('file')
-        folder_id = request.data.get('folder_id')
+    async def post(self, request):
+        # Reserve quota for the whole body before any of it is stored, so
+        # concurrent uploads can't overshoot the quota between them. That
+        # takes its length up front: a chunked body has none
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            return Response({"success": False, "message": "Content-Length is required."}, status=status.HTTP_411_LENGTH_REQUIRED)
+        reservation = await sync_to_async(reserve_quota)(request.user.pk, content_length)
+        if reservation is None:
+            return Response({"success": False, "message": "Storage limit exceeded."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return await self.upload(request, reservation)
+        finally:
+            # A no-op once the file is registered, which commits the reservation
+            await sync_to_async(release_quota)(reservation)
 
+    async def upload(self, request, reservation):
+        # Hash, sniff and compress the file while the body is parsed instead of spooling it as is first
+        request.upload_handlers = [StreamingUploadHandler(request, max_size=reservation.size)]
+        file_obj = (await sync_to_async(lambda: request.FILES)()).get('file')
         if not file_obj:
             return Response({"success": False, "message": "No file provided."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return await self.store(request, file_obj, reservation)
+        finally:
+            file_obj.discard()
+
+    async def store(self, request, file_obj, reservation):
+        folder_id = request.data.get('folder_id')
 
         # Check storage quota
-        profile = request.user.profile
-        if profile.storage_used + file_obj.size > profile.storage_limit:
+        if file_obj.quota_exceeded:
             return Response({"success": False, "message": "Storage limit exceeded."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Calculate file hash
-        sha256 = hashlib.sha256()
-        for chunk in file_obj.chunks():
-            sha256.update(chunk)
-        file_hash = sha256.hexdigest()
+        # Get folder
+        folder = None
+        if folder_id:
+            try:
+                folder = await Folder.objects.aget(id=folder_id, user=request.user, is_deleted=False)
+            except Folder.DoesNotExist:
+                return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        file_hash = file_obj.file_hash
 
-        # Reset file pointer
-        file_obj.seek(0)
+        # Deduplication check: when the content is already stored, the spooled copy is just thrown away
+        stored_file = await sync_to_async(acquire_stored_file)(file_hash)
+        if stored_file is None:
+            if not await file_obj.acommit(stored_object_key(file_hash, file_obj.stored_encoding)):
+                return Response({"success": False, "message": "Failed to upload file to S3."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            stored_file, created = await sync_to_async(create_stored_file)(
+                file_hash, file_obj.size, file_obj.stored_encoding, file_obj.stored_size
+            )
+            if created:
+                await sync_to_async(enqueue_thumbnail)(stored_file, file_obj.head, file_obj.name)
 
-        # Generate thumbnail
-        thumbnail_obj = generate_thumbnail(file_obj, file_obj.name)
-        thumbnail_s3_key = None
-        if thumbnail_obj:
-            thumbnail_s3_key = f"thumb_{file_hash}.jpg"
-        
-        # Reset file pointer after thumbnail generation
-        file_obj.seek(0)
+        try:
+            user_file = await sync_to_async(register_user_file)(request.user, stored_file, file_obj.name, folder, reservation)
+        except FolderDeleted:
+            return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
+        if user_file is None:
+            return Response({"success": False, "message": "Storage limit exceeded."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Deduplication check
-        stored_file, created = StoredFile.objects.get_or_create(
-            file_hash=file_hash,
-            defaults={
-                'size': file_obj.size,
-                's3_key': file_hash,
-                'thumbnail_s3_key': thumbnail_s3_key
-            }
+        serializer = UserFileSerializer(user_file, context={'request': request})
+        return Response({
+            "success": True,
+            "message": "File uploaded successfully.",
+            "data": await sync_to_async(lambda: serializer.data)()
+        }, status=status.HTTP_201_CREATED)
+
+
+class FileUploadCheckView(APIView):
+    """
+    Check-then-upload: the client sends the SHA-256 and size of a file before
+    its body. When the user already has a file with that content, the new
+    file is registered right away and the client can skip the upload.
+
+    Content only other users have is never confirmed: a hash is no proof of
+    holding the bytes, and the answer would tell who stores what. Such an
+    upload still deduplicates in storage, it just has to be sent.
+    """
+    renderer_classes = [CustomJSONRenderer]
+
+    def post(self, request):
+        declared = parse_declared_file(request.data)
+        if not declared:
+            return Response({"success": False, "message": "file_hash, size and name are required."}, status=status.HTTP_400_BAD_REQUEST)
+        file_hash, size, name = declared
+        folder_id = request.data.get('folder_id')
+
+        owned = UserFile.objects.filter(
+            user=request.user, is_deleted=False, stored_file__file_hash=file_hash, stored_file__size=size
         )
+        if not owned.exists():
+            return Response({
+                "success": True,
+                "message": "File not stored yet, upload required.",
+                "data": {"exists": False}
+            })
 
-        print(f"Stored file: {stored_file}")
+        folder = None
+        if folder_id:
+            try:
+                folder = Folder.objects.get(id=folder_id, user=request.user, is_deleted=False)
+            except Folder.DoesNotExist:
+                return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Nothing is transferred, so no reservation: register_user_file checks the quota
+        stored_file = acquire_stored_file(file_hash, size)
+        if stored_file is None:
+            # Reclaimed since the lookup above
+            return Response({
+                "success": True,
+                "message": "File not stored yet, upload required.",
+                "data": {"exists": False}
+            })
+
+        try:
+            user_file = register_user_file(request.user, stored_file, name, folder)
+        except FolderDeleted:
+            return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
+        if user_file is None:
+            return Response({"success": False, "message": "Storage limit exceeded."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "success": True,
+            "message": "File uploaded successfully.",
+            "data": {"exists": True, "file": UserFileSerializer(user_file, context={'request': request}).data}
+        }, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionCreateView(AsyncAPIView):
+    """
+    Start a direct-to-S3 multipart upload. The client PUTs the parts to the
+    presigned URLs from `UploadSessionPartsView` and then calls
+    `UploadSessionCompleteView`, so the body never passes through Django.
+    """
+    renderer_classes = [CustomJSONRenderer]
+
+    async def post(self, request):
+        data = await request_data(request)
+        declared = parse_declared_file(data)
+        if not declared:
+            return Response({"success": False, "message": "file_hash, size and name are required."}, status=status.HTTP_400_BAD_REQUEST)
+        file_hash, size, name = declared
+        folder_id = data.get('folder_id')
 
-        if created:
-            print(f"Uploading new file to S3 with key: {file_hash}")
-            upload_success = s3_client.upload_fileobj(file_obj, file_hash)
-            print(f"S3 upload result: {upload_success}")
-            
-            if not upload_success:
-                print(f"Failed to upload file {file_hash} to S3")
-                stored_file.delete()
-                return Response({"success": False, "message": "Failed to upload file to S3."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            
-            if thumbnail_obj:
-                print(f"Uploading thumbnail to S3 with key: {thumbnail_s3_key}")
-                thumbnail_upload_success = s3_client.upload_fileobj(thumbnail_obj, thumbnail_s3_key)
-                print(f"Thumbnail upload result: {thumbnail_upload_success}")
-
-            stored_file.ref_count = 1
-            stored_file.save()
-            print(f"File successfully uploaded to S3 and saved to database")
-        else:
-            print(f"File already exists in database, incrementing ref_count")
-            stored_file.ref_count += 1
-            stored_file.save()
-        
-        # Get folder
         folder = None
         if folder_id:
             try:
-                folder = Folder.objects.get(id=folder_id, user=request.user)
+                folder = await Folder.objects.aget(id=folder_id, user=request.user, is_deleted=False)
             except Folder.DoesNotExist:
                 return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Create a UserFile instance
-        user_file, created = UserFile.objects.get_or_create(
+        # Clean up this user's abandoned uploads (and their reservations) before starting a new one
+        await sync_to_async(expire_upload_sessions)(expired_upload_sessions().filter(user=request.user))
+
+        # The session holds its quota until it is completed, cancelled or expired
+        reservation = await sync_to_async(reserve_quota)(request.user.pk, size)
+        if reservation is None:
+            return Response({"success": False, "message": "Storage limit exceeded."}, status=status.HTTP_400_BAD_REQUEST)
+
+        session_id = uuid.uuid4()
+        s3_key = f"tmp/uploads/{session_id}"
+        upload_id = await storage.acreate_multipart_upload(s3_key)
+        if not upload_id:
+            await sync_to_async(release_quota)(reservation)
+            return Response({"success": False, "message": "Failed to start upload."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        session = await UploadSession.objects.acreate(
+            id=session_id,
             user=request.user,
-            name=file_obj.name,
             folder=folder,
-            defaults={'stored_file': stored_file}
+            name=name,
+            size=size,
+            file_hash=file_hash,
+            s3_key=s3_key,
+            upload_id=upload_id,
+            part_size=multipart_part_size(size),
         )
+        reservation.upload_session = session
+        await reservation.asave(update_fields=['upload_session'])
 
-        print("user file", user_file)
+        return Response({
+            "success": True,
+            "message": "Upload started.",
+            "data": UploadSessionSerializer(session).data
+        }, status=status.HTTP_201_CREATED)
 
-        if not created:
-            # If file with same name exists, update it
-            old_stored_file = user_file.stored_file
-            old_file_size = old_stored_file.size
-            
-            # Update to new stored file
-            user_file.stored_file = stored_file
-            user_file.save()
-            
-            # Update storage calculation (subtract old, add new if different)
-            if old_stored_file != stored_file:
-                profile.storage_used = profile.storage_used - old_file_size + file_obj.size
-                profile.save()
-                
-                # Decrement old file reference count
-                old_stored_file.ref_count -= 1
-                old_stored_file.save()
-                
-                # Delete old file from S3 if no longer referenced
-                if old_stored_file.ref_count == 0:
-                    s3_client.delete_object(old_stored_file.s3_key)
-                    if old_stored_file.thumbnail_s3_key:
-                        s3_client.delete_object(old_stored_file.thumbnail_s3_key)
-                    old_stored_file.delete()
-        else:
-            # Update storage used
-            profile.storage_used += file_obj.size
-            profile.save()
 
-        serializer = UserFileSerializer(user_file)
+class UploadSessionDetailView(AsyncAPIView):
+    renderer_classes = [CustomJSONRenderer]
+
+    async def get(self, request, session_id):
+        """
+        Upload status: which parts have arrived, so a client can resume, and
+        once completed the outcome of the verification (`file` or `error`)
+        """
+        try:
+            session = await UploadSession.objects.select_related('user_file__stored_file').aget(
+                id=session_id, user=request.user, expires_at__gt=timezone.now()
+            )
+        except UploadSession.DoesNotExist:
+            return Response({"success": False, "message": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        received = {part['part_number']: part['size'] async for part in session.parts.values('part_number', 'size')}
+        if session.status == UploadSession.UPLOADING:
+            # Parts sent through presigned URLs go straight to storage and have no UploadPart row
+            stored_parts = await storage.alist_parts(session.s3_key, session.upload_id)
+            for part in stored_parts or []:
+                received[part['PartNumber']] = part['Size']
+        parts = [{'part_number': n, 'size': size} for n, size in sorted(received.items())]
+        data = UploadSessionSerializer(session).data
+        data.update({
+            "parts": parts,
+            "missing_parts": [n for n in range(1, session.part_count + 1) if n not in received],
+            "bytes_received": sum(received.values()),
+        })
+        if session.status == UploadSession.COMPLETED and session.user_file is not None:
+            serializer = UserFileSerializer(session.user_file, context={'request': request})
+            data["file"] = await sync_to_async(lambda: serializer.data)()
+        return Response({"success": True, "message": "Upload status retrieved successfully.", "data": data})
+
+    async def delete(self, request, session_id):
+        try:
+            session = await UploadSession.objects.aget(id=session_id, user=request.user, expires_at__gt=timezone.now())
+        except UploadSession.DoesNotExist:
+            return Response({"success": False, "message": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if session.status == UploadSession.VERIFYING:
+            return Response({"success": False, "message": "Upload is being verified."}, status=status.HTTP_409_CONFLICT)
+        if session.status == UploadSession.UPLOADING:
+            await storage.aabort_multipart_upload(session.s3_key, session.upload_id)
+        await sync_to_async(discard_upload_session)(session)
+        return Response({"success": True, "message": "Upload cancelled.", "data": None})
+
+
+class UploadSessionPartsView(APIView):
+    renderer_classes = [CustomJSONRenderer]
+
+    def get(self, request, session_id):
+        try:
+            session = UploadSession.objects.get(id=session_id, user=request.user, expires_at__gt=timezone.now())
+        except UploadSession.DoesNotExist:
+            return Response({"success": False, "message": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+        if session.status != UploadSession.UPLOADING:
+            return Response({"success": False, "message": "Upload is already complete."}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            part_numbers = parse_part_numbers(request.query_params.get('part_numbers'), session.part_count)
+        except ValueError:
+            return Response({"success": False, "message": "Invalid part_numbers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        parts = []
+        for part_number in part_numbers:
+            url = storage.generate_presigned_part_url(session.s3_key, session.upload_id, part_number)
+            if not url:
+                return Response({"success": False, "message": "Failed to generate upload URLs."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            parts.append({"part_number": part_number, "url": url})
+
+        return Response({
+            "success": True,
+            "message": "Upload URLs generated successfully.",
+            "data": {"part_size": session.part_size, "part_count": session.part_count, "parts": parts}
+        })
+
+
+class UploadSessionPartUploadView(AsyncAPIView):
+    """
+    Resumable upload through the API: the client PUTs each part as a raw body,
+    retrying only the parts missing from the session status after a drop.
+    """
+    renderer_classes = [CustomJSONRenderer]
+
+    async def put(self, request, session_id, part_number):
+        try:
+            session = await UploadSession.objects.aget(id=session_id, user=request.user, expires_at__gt=timezone.now())
+        except UploadSession.DoesNotExist:
+            return Response({"success": False, "message": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+        if session.status != UploadSession.UPLOADING:
+            return Response({"success": False, "message": "Upload is already complete."}, status=status.HTTP_409_CONFLICT)
+
+        if part_number < 1 or part_number > session.part_count:
+            return Response({"success": False, "message": "Invalid part number."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Read the raw stream, request.body would enforce DATA_UPLOAD_MAX_MEMORY_SIZE
+        expected_size = session.expected_part_size(part_number)
+        body = await sync_to_async(request._request.read)(expected_size + 1)
+        if len(body) != expected_size:
+            return Response({"success": False, "message": f"Part {part_number} must be {expected_size} bytes."}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag = await storage.aupload_part(session.s3_key, session.upload_id, part_number, body)
+        if not etag:
+            return Response({"success": False, "message": "Failed to upload part to S3."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        await UploadPart.objects.aupdate_or_create(
+            session=session,
+            part_number=part_number,
+            defaults={'etag': etag, 'size': expected_size}
+        )
+        # Keep sessions that are still receiving parts alive
+        session.expires_at = upload_session_expiry()
+        await session.asave(update_fields=['expires_at'])
+
+        return Response({
+            "success": True,
+            "message": "Part uploaded successfully.",
+            "data": {"part_number": part_number, "size": expected_size}
+        })
+
+
+class UploadSessionCompleteView(AsyncAPIView):
+    renderer_classes = [CustomJSONRenderer]
+
+    async def post(self, request, session_id):
+        try:
+            session = await UploadSession.objects.aget(id=session_id, user=request.user, expires_at__gt=timezone.now())
+        except UploadSession.DoesNotExist:
+            return Response({"success": False, "message": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+        if session.status != UploadSession.UPLOADING:
+            return Response({"success": False, "message": "Upload is already complete."}, status=status.HTTP_409_CONFLICT)
+
+        parts = await storage.alist_parts(session.s3_key, session.upload_id)
+        if parts is None:
+            return Response({"success": False, "message": "Failed to read upload state."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if [part['PartNumber'] for part in parts] != list(range(1, session.part_count + 1)):
+            return Response({"success": False, "message": "Upload is incomplete."}, status=status.HTTP_400_BAD_REQUEST)
+
+        completed = await storage.acomplete_multipart_upload(
+            session.s3_key,
+            session.upload_id,
+            [{'PartNumber': part['PartNumber'], 'ETag': part['ETag']} for part in parts]
+        )
+        if not completed:
+            return Response({"success": False, "message": "Failed to assemble upload."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Hashing the whole object is left to `run_upload_verifier`, the
+        # client polls the session until it is completed or failed
+        session.status = UploadSession.VERIFYING
+        session.expires_at = upload_session_expiry()
+        await session.asave(update_fields=['status', 'expires_at'])
+        return Response({
+            "success": True,
+            "message": "Upload assembled, verifying.",
+            "data": UploadSessionSerializer(session).data
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class ChunkView(APIView):
+    """
+    Chunk-level dedup, step one. GET returns the chunking parameters, POST
+    {"chunks": [sha256, ...]} returns the chunks the user hasn't uploaded
+    yet. The client then PUTs only those to `ChunkUploadView`.
+    """
+    renderer_classes = [CustomJSONRenderer]
+
+    def get(self, request):
+        return Response({"success": True, "message": "Chunking parameters retrieved successfully.", "data": chunking_params()})
+
+    def post(self, request):
+        chunk_hashes = parse_chunk_hashes(request.data.get('chunks'))
+        if chunk_hashes is None:
+            return Response({"success": False, "message": "A list of chunk hashes is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "success": True,
+            "message": "Missing chunks retrieved successfully.",
+            "data": {"missing": missing_chunks(request.user, chunk_hashes)}
+        })
+
+
+class ChunkUploadView(APIView):
+    renderer_classes = [CustomJSONRenderer]
+
+    def put(self, request, chunk_hash):
+        chunk_hash = chunk_hash.lower()
+        if not SHA256_RE.match(chunk_hash):
+            return Response({"success": False, "message": "Invalid chunk hash."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Read the raw stream, request.body would enforce DATA_UPLOAD_MAX_MEMORY_SIZE
+        max_size = settings.VAULT_CHUNK_MAX_SIZE
+        body = request._request.read(max_size + 1)
+        if not body or len(body) > max_size:
+            return Response({"success": False, "message": f"Chunks must be 1 to {max_size} bytes."}, status=status.HTTP_400_BAD_REQUEST)
+        if hashlib.sha256(body).hexdigest() != chunk_hash:
+            return Response({"success": False, "message": "Chunk does not match its hash."}, status=status.HTTP_400_BAD_REQUEST)
+        # Chunks are charged when a file uses them, but a user without room for one cannot store it meanwhile
+        if len(body) > quota_usage(request.user.pk)['storage_available']:
+            return Response({"success": False, "message": "Storage limit exceeded."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not store_chunk(request.user, chunk_hash, body):
+            return Response({"success": False, "message": "Failed to upload chunk to S3."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "success": True,
+            "message": "Chunk uploaded successfully.",
+            "data": {"chunk_hash": chunk_hash, "size": len(body)}
+        })
+
+
+class ChunkedFileCreateView(APIView):
+    """
+    Chunk-level dedup, last step: create a file from its ordered list of
+    chunks. Responds 409 with the missing chunks if any are not stored
+    (anymore) or were not uploaded by the user, who uploads them and retries.
+    """
+    renderer_classes = [CustomJSONRenderer]
+
+    def post(self, request):
+        name = request.data.get('name')
+        chunk_hashes = parse_chunk_hashes(request.data.get('chunks'))
+        if not name or chunk_hashes is None:
+            return Response({"success": False, "message": "name and a list of chunk hashes are required."}, status=status.HTTP_400_BAD_REQUEST)
+        folder_id = request.data.get('folder_id')
+
+        folder = None
+        if folder_id:
+            try:
+                folder = Folder.objects.get(id=folder_id, user=request.user, is_deleted=False)
+            except Folder.DoesNotExist:
+                return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        stored_file, missing = create_chunked_stored_file(request.user, chunk_hashes)
+        if stored_file is None:
+            if missing:
+                return Response({
+                    "success": False,
+                    "message": "Some chunks are not stored, upload them and retry.",
+                    "data": {"missing": missing}
+                }, status=status.HTTP_409_CONFLICT)
+            return Response({"success": False, "message": "Failed to upload file to S3."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        try:
+            user_file = register_user_file(request.user, stored_file, name, folder)
+        except FolderDeleted:
+            return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
+        if user_file is None:
+            return Response({"success": False, "message": "Storage limit exceeded."}, status=status.HTTP_400_BAD_REQUEST)
+
         return Response({
             "success": True,
             "message": "File uploaded successfully.",
-            "data": serializer.data
+            "data": UserFileSerializer(user_file, context={'request': request}).data
         }, status=status.HTTP_201_CREATED)
 
 
-class FileListView(generics.ListAPIView):
+class FileListView(AsyncAPIView, generics.GenericAPIView):
     serializer_class = UserFileSerializer
     renderer_classes = [CustomJSONRenderer]
-    pagination_class = None # We are handling pagination manually
+    pagination_class = None # Keyset pagination is handled in `list`
 
     def get_queryset(self):
         # This method is kept for compatibility but the main logic is in `list`
         return UserFile.objects.filter(user=self.request.user, is_deleted=False)
 
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(self.list)(request, *args, **kwargs)
+
     def list(self, request, *args, **kwargs):
+        """
+        Listings are cached until the user's next change, see cache_utils.
+        A poll of an unchanged folder costs a read of the listing version
+        and one cache round trip, and a 304 when the client sends back the
+        ETag.
+        """
+        key = listing_cache_key(request.user.pk, request)
+        entry = get_cached_listing(key)
+        if entry is None:
+            data = self.build_listing(request)
+            if isinstance(data, Response):
+                return data
+            entry = cache_listing(key, data)
+
+        # Clients must revalidate, the presigned URLs inside expire
+        headers = {'ETag': entry['etag'], 'Cache-Control': 'private, no-cache'}
+        if etag_matches(request.headers.get('If-None-Match'), entry['etag']):
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(entry['data'], headers=headers)
+
+    def build_listing(self, request):
+        """The listing's data, or an error Response"""
         folder_id = request.query_params.get('folder_id')
-        
-        # Get root files and folders if no folder_id is provided
-        files_queryset = UserFile.objects.filter(user=request.user, is_deleted=False, folder_id=folder_id)
-        folders_queryset = Folder.objects.filter(user=request.user, parent_id=folder_id)
-        
+
+        # Get root files and folders if no folder_id is provided.
+        # Only the columns the serializers read are loaded, and each file's
+        # StoredFile comes in the same query instead of one query per file
+        files_queryset = UserFile.objects.filter(
+            user=request.user, is_deleted=False, folder_id=folder_id
+        ).select_related('stored_file').only(*LISTING_FILE_COLUMNS)
+        folders_queryset = Folder.objects.filter(
+            user=request.user, parent_id=folder_id, is_deleted=False
+        ).only('id', 'name', 'parent_id', 'created_at')
+
         # Filtering
         name = request.query_params.get('name')
         if name:
             files_queryset = files_queryset.filter(name__icontains=name)
             folders_queryset = folders_queryset.filter(name__icontains=name)
 
-        # Ordering
+        # Ordering, folders don't have a size so they stay ordered by name
         ordering = request.query_params.get('ordering')
-        if ordering in ['name', '-name', 'created_at', '-created_at']:
-            files_queryset = files_queryset.order_by(ordering)
-            folders_queryset = folders_queryset.order_by(ordering)
-        elif ordering == 'size':
-            # For size ordering, we need to order by the related StoredFile's size
-            files_queryset = files_queryset.order_by('stored_file__size')
-            # Folders don't have size, so we'll keep them at the top
-            folders_queryset = folders_queryset.order_by('name')
-        elif ordering == '-size':
-            # For descending size ordering
-            files_queryset = files_queryset.order_by('-stored_file__size')
-            # Folders don't have size, so we'll keep them at the top
-            folders_queryset = folders_queryset.order_by('name')
-        else:
-            # Default ordering by name if no valid ordering is provided
-            files_queryset = files_queryset.order_by('name')
-            folders_queryset = folders_queryset.order_by('name')
-        
-        # Combine and serialize
-        files_data = self.get_serializer(files_queryset, many=True).data
-        folders_data = FolderSerializer(folders_queryset, many=True).data
+        if ordering not in LISTING_ORDERINGS:
+            ordering = 'name'
+        descending = ordering.startswith('-')
+        file_field = ordering.lstrip('-')
+        folder_field = file_field if file_field != 'size' else 'name'
+        folder_descending = descending if file_field != 'size' else False
 
-        # Debug logging removed for production
-        
-        combined_data = {
+        try:
+            limit = min(int(request.query_params.get('limit', LISTING_PAGE_SIZE)), LISTING_MAX_PAGE_SIZE)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response({"success": False, "message": "Invalid limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        fields = request.query_params.get('fields')
+        fields = [field.strip() for field in fields.split(',')] if fields else None
+        if fields and not set(fields) <= set(UserFileSerializer.Meta.fields):
+            return Response({"success": False, "message": "Invalid fields."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Folders and files form one stream: all folders first, then all files
+        try:
+            cursor = request.query_params.get('cursor')
+            kind, value, pk = decode_cursor(cursor) if cursor else (None, None, None)
+            if kind not in (None, 'folder', 'file'):
+                raise InvalidCursor("Invalid cursor.")
+
+            folders = []
+            if kind != 'file':
+                folders_queryset = keyset_order(folders_queryset, folder_field, folder_descending)
+                if kind == 'folder':
+                    folders_queryset = keyset_seek(folders_queryset, folder_field, folder_descending, value, pk)
+                folders = list(folders_queryset[:limit + 1])
+
+            files = []
+            remaining = limit - len(folders)
+            if remaining >= 0:
+                files_queryset = keyset_order(files_queryset, file_field, descending)
+                if kind == 'file':
+                    files_queryset = keyset_seek(files_queryset, file_field, descending, value, pk)
+                files = list(files_queryset[:remaining + 1])
+        except (InvalidCursor, ValidationError, ValueError):
+            return Response({"success": False, "message": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One extra row was fetched to tell whether another page follows
+        next_cursor = None
+        if len(folders) > limit:
+            folders = folders[:limit]
+            last = folders[-1]
+            next_cursor = encode_cursor('folder', getattr(last, folder_field), last.pk)
+        elif len(files) > remaining:
+            files = files[:remaining]
+            last = files[-1] if files else folders[-1]
+            if files:
+                next_cursor = encode_cursor('file', getattr(last, file_field), last.pk)
+            else:
+                next_cursor = encode_cursor('folder', getattr(last, folder_field), last.pk)
+
+        files_data = self.get_serializer(files, many=True, fields=fields).data
+        folders_data = FolderSerializer(folders, many=True).data
+
+        try:
+            quota = UserProfile.objects.values('storage_used', 'storage_limit').get(user=request.user)
+        except UserProfile.DoesNotExist:
+            raise UserNotFound()
+        return {
             'files': files_data,
             'folders': folders_data,
-            'storage_used': request.user.profile.storage_used,
-            'storage_limit': request.user.profile.storage_limit
+            'next_cursor': next_cursor,
+            'storage_used': quota['storage_used'],
+            'storage_limit': quota['storage_limit']
+        }
+
+
+class QuotaView(APIView):
+    """The user's quota in bytes, including what uploads in progress have reserved"""
+    renderer_classes = [CustomJSONRenderer]
+
+    def get(self, request):
+        try:
+            quota = quota_usage(request.user.pk)
+        except UserProfile.DoesNotExist:
+            raise UserNotFound()
+        return Response({"success": True, "message": "Quota retrieved successfully.", "data": quota})
+
+
+class SearchView(APIView):
+    """
+    Vault-wide search over file and folder names (?q=...&type=file|folder).
+    Results are ranked best first and paged with `limit`/`cursor` like the listing.
+    """
+    renderer_classes = [CustomJSONRenderer]
+
+    def get(self, request):
+        query = parse_search_query(request.query_params.get('q', ''))
+        if query is None:
+            return Response({"success": False, "message": "A search query is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        result_type = request.query_params.get('type')
+        if result_type not in (None, 'file', 'folder'):
+            return Response({"success": False, "message": "Invalid type."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = min(int(request.query_params.get('limit', SEARCH_PAGE_SIZE)), SEARCH_MAX_PAGE_SIZE)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response({"success": False, "message": "Invalid limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        files_queryset = search_names(
+            UserFile.objects.filter(user=request.user, is_deleted=False).select_related('stored_file'), query
+        ).only(*LISTING_FILE_COLUMNS)
+        folders_queryset = search_names(Folder.objects.filter(user=request.user, is_deleted=False), query)
+        files_queryset = keyset_order(files_queryset, 'rank', True)
+        folders_queryset = keyset_order(folders_queryset, 'rank', True)
+
+        # Both result streams are ordered by (rank, id), so one cursor seeks both
+        try:
+            cursor = request.query_params.get('cursor')
+            if cursor:
+                kind, value, pk = decode_cursor(cursor)
+                if kind != 'rank':
+                    raise InvalidCursor("Invalid cursor.")
+                files_queryset = keyset_seek(files_queryset, 'rank', True, float(value), pk)
+                folders_queryset = keyset_seek(folders_queryset, 'rank', True, float(value), pk)
+
+            files = list(files_queryset[:limit + 1]) if result_type != 'folder' else []
+            folders = list(folders_queryset[:limit + 1]) if result_type != 'file' else []
+        except (InvalidCursor, ValidationError, TypeError, ValueError):
+            return Response({"success": False, "message": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches = sorted(files + folders, key=lambda item: (item.rank, item.pk), reverse=True)
+        next_cursor = None
+        if len(matches) > limit:
+            matches = matches[:limit]
+            next_cursor = encode_cursor('rank', matches[-1].rank, matches[-1].pk)
+
+        page_files = [item for item in matches if isinstance(item, UserFile)]
+        page_folders = [item for item in matches if isinstance(item, Folder)]
+        paths = folder_paths(
+            request.user,
+            [f.folder_id for f in page_files] + [f.parent_id for f in page_folders]
+        )
+
+        serialized = {item['id']: item for item in self.serialize(page_files, page_folders, paths)}
+        combined_data = {
+            'results': [serialized[str(item.pk)] for item in matches],
+            'next_cursor': next_cursor,
         }
-        
         return Response(combined_data)
 
+    def serialize(self, files, folders, paths):
+        for item in UserFileSerializer(files, many=True).data:
+            yield {'type': 'file', **item, 'path': paths.get(item['folder'], [])}
+        for item in FolderSerializer(folders, many=True).data:
+            yield {'type': 'folder', **item, 'path': paths.get(item['parent'], [])}
+
 
 class FolderCreateView(generics.CreateAPIView):
     serializer_class = FolderSerializer
@@ -329,49 +939,86 @@ class FolderCreateView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+        invalidate_listings([self.request.user.pk])
 
 
-class FileDeleteView(APIView):
+class FolderDetailView(APIView):
+    """
+    GET a folder with its breadcrumb path and the total size of everything under it,
+    PATCH {"parent": id|null} to move it, DELETE it with everything under it.
+    """
     renderer_classes = [CustomJSONRenderer]
 
-    def delete(self, request, file_id):
+    def get_folder(self, request, folder_id):
         try:
-            user_file = UserFile.objects.get(id=file_id, user=request.user, is_deleted=False)
-        except UserFile.DoesNotExist:
-            return Response({"success": False, "message": "File not found."}, status=status.HTTP_404_NOT_FOUND)
+            return Folder.objects.get(id=folder_id, user=request.user, is_deleted=False)
+        except Folder.DoesNotExist:
+            return None
 
-        # Recalculate storage
-        file_size = user_file.stored_file.size
-        profile = request.user.profile
-        profile.storage_used -= file_size
-        profile.save()
+    def get(self, request, folder_id):
+        folder = self.get_folder(request, folder_id)
+        if folder is None:
+            return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Soft delete the user file
-        user_file.is_deleted = True
-        user_file.save()
+        data = FolderSerializer(folder).data
+        data['path'] = folder_paths(request.user, [folder.id])[folder.id]
+        data['size'] = folder.subtree_size()
+        return Response(data)
 
-        # Decrement ref count on the stored file
-        stored_file = user_file.stored_file
-        stored_file.ref_count -= 1
-        stored_file.save()
+    def patch(self, request, folder_id):
+        folder = self.get_folder(request, folder_id)
+        if folder is None:
+            return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
+        if 'parent' not in request.data:
+            return Response({"success": False, "message": "A parent folder is required, null for the root."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # If no other user is using this file, delete it from S3
-        if stored_file.ref_count == 0:
-            if s3_client.delete_object(stored_file.s3_key):
-                stored_file.delete()
-            else:
-                # If S3 deletion fails, we should probably log this
-                # and maybe have a cleanup job for orphaned S3 files.
-                # For now, we'll restore the ref_count and soft delete status
-                stored_file.ref_count += 1
-                stored_file.save()
-                user_file.is_deleted = False
-                user_file.save()
-                # Also restore storage used
-                profile.storage_used += file_size
-                profile.save()
-                return Response({"success": False, "message": "Failed to delete file from S3."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        parent = None
+        parent_id = request.data.get('parent')
+        if parent_id:
+            try:
+                parent = Folder.objects.get(id=parent_id, user=request.user, is_deleted=False)
+            except (Folder.DoesNotExist, ValidationError):
+                return Response({"success": False, "message": "Parent folder not found."}, status=status.HTTP_404_NOT_FOUND)
 
+        try:
+            folder.move_to(parent)
+        except ValueError as e:
+            return Response({"success": False, "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            return Response({"success": False, "message": "A folder with this name already exists there."}, status=status.HTTP_400_BAD_REQUEST)
+        invalidate_listings([request.user.pk])
+
+        return Response({
+            "success": True,
+            "message": "Folder moved successfully.",
+            "data": FolderSerializer(folder).data
+        })
+
+    def delete(self, request, folder_id):
+        folder = self.get_folder(request, folder_id)
+        result = delete_folder_tree(folder) if folder is not None else None
+        if result is None:
+            return Response({"success": False, "message": "Folder not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        files_deleted, bytes_freed = result
+        return Response({
+            "success": True,
+            "message": "Folder deleted successfully.",
+            "data": {"files_deleted": files_deleted, "bytes_freed": bytes_freed}
+        })
+
+
+class FileDeleteView(AsyncAPIView):
+    renderer_classes = [CustomJSONRenderer]
+
+    async def delete(self, request, file_id):
+        try:
+            user_file = await UserFile.objects.select_related('stored_file').aget(id=file_id, user=request.user, is_deleted=False)
+        except UserFile.DoesNotExist:
+            return Response({"success": False, "message": "File not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if not await sync_to_async(delete_user_file)(user_file):
+            return Response({"success": False, "message": "File not found."}, status=status.HTTP_404_NOT_FOUND)
 
         return Response({"success": True, "message": "File deleted successfully."}, status=status.HTTP_200_OK)
 
@@ -386,12 +1033,14 @@ class FileDownloadView(APIView):
             return Response({"success": False, "message": "File not found."}, status=status.HTTP_404_NOT_FOUND)
 
         stored_file = user_file.stored_file
-        print(f"Generating presigned URL for file: {stored_file.s3_key}")
-        
-        # Generate presigned URL for download
-        presigned_url = s3_client.generate_presigned_url(stored_file.s3_key, expiration=3600)
-        print(f"Generated presigned URL: {presigned_url}")
-        
+        if not presignable(stored_file, request):
+            # Chunked content is reassembled, and compressed content decoded for
+            # clients that can't, by the API rather than served from one object
+            presigned_url = request.build_absolute_uri(reverse('file-content', args=[user_file.id]))
+        else:
+            # Generate presigned URL for download
+            presigned_url = storage.generate_presigned_url(stored_file.s3_key, expiration=3600)
+
         if not presigned_url:
             return Response({"success": False, "message": "Failed to generate download URL."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -400,7 +1049,179 @@ class FileDownloadView(APIView):
             "message": "Download URL generated successfully.",
             "data": {
                 "download_url": presigned_url,
+                # Streams through the API, with Range support
+                "stream_url": request.build_absolute_uri(reverse('file-content', args=[user_file.id])),
                 "filename": user_file.name,
                 "size": stored_file.size
             }
         })
+
+
+class FileContentView(APIView):
+    """
+    Stream a file's content through the API, a fixed-size piece at a time,
+    so memory use does not depend on the file size. Chunked files are
+    reassembled chunk by chunk. Compressed content is sent as stored to
+    clients that accept its encoding and decompressed on the fly for the
+    others. Supports single byte ranges and conditional requests on the
+    ETag, which is the content hash. Whole files on local storage are sent
+    with sendfile where the server supports it. Under ASGI the transfer
+    runs on the event loop, see async_utils.
+    """
+    renderer_classes = [CustomJSONRenderer]
+
+    def get(self, request, file_id):
+        try:
+            user_file = UserFile.objects.select_related('stored_file').get(id=file_id, user=request.user, is_deleted=False)
+        except UserFile.DoesNotExist:
+            return Response({"success": False, "message": "File not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        stored_file = user_file.stored_file
+        encoded = stored_file.encoding != IDENTITY and accepts_encoding(request, stored_file.encoding)
+        decoded = stored_file.encoding != IDENTITY and not encoded
+        # The encoded bytes are a different representation, with their own tag
+        etag = f'"{stored_file.file_hash}-{stored_file.encoding}"' if encoded else f'"{stored_file.file_hash}"'
+        length = stored_file.stored_size if encoded else stored_file.size
+
+        headers = {'ETag': etag, 'Accept-Ranges': 'none' if decoded else 'bytes'}
+        if stored_file.encoding != IDENTITY:
+            headers['Vary'] = 'Accept-Encoding'
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        byte_range = None
+        # Ranges of the decoded stream would need decoding from the start, those requests get it whole
+        if not decoded and 'Range' in request.headers and request.headers.get('If-Range', etag) == etag:
+            byte_range = parse_range(request.headers['Range'], length)
+            if byte_range is False:
+                headers['Content-Range'] = f'bytes */{length}'
+                return HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+
+        local_path = not stored_file.chunked and byte_range is None and storage.local_path(stored_file.s3_key)
+        if local_path and not decoded:
+            try:
+                response = file_response(request, local_path, content_type='application/octet-stream')
+            except OSError:
+                return Response({"success": False, "message": "Failed to read file from storage."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        else:
+            content = iter_stored_content(stored_file, settings.VAULT_DOWNLOAD_CHUNK_SIZE, byte_range)
+            if decoded:
+                content = decode_stream(content, stored_file.encoding)
+            response = streaming_response(request, content, content_type='application/octet-stream')
+            response['Content-Length'] = str(length)
+
+        if byte_range is not None:
+            first, last = byte_range
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response['Content-Range'] = f'bytes {first}-{last}/{length}'
+            response['Content-Length'] = str(last - first + 1)
+        for header, value in headers.items():
+            response[header] = value
+        if encoded:
+            response['Content-Encoding'] = stored_file.encoding
+        response['Content-Disposition'] = content_disposition_header(True, user_file.name)
+        return response
+
+
+class FilePreviewView(APIView):
+    """
+    Presigned URL for a resized preview (?size=128|512|1024&image_format=webp|jpeg).
+    Missing renditions are rendered on first request and reused afterwards.
+    """
+    renderer_classes = [CustomJSONRenderer]
+
+    def get(self, request, file_id):
+        try:
+            user_file = UserFile.objects.select_related('stored_file').get(id=file_id, user=request.user, is_deleted=False)
+        except UserFile.DoesNotExist:
+            return Response({"success": False, "message": "File not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Not `format`, DRF reserves that query parameter for renderer selection
+        rendition_format = request.query_params.get('image_format', 'webp')
+        try:
+            size = int(request.query_params.get('size', 128))
+        except ValueError:
+            size = None
+        if size not in settings.VAULT_RENDITION_SIZES or rendition_format not in RENDITION_FORMATS:
+            return Response({"success": False, "message": "Unsupported preview size or format."}, status=status.HTTP_400_BAD_REQUEST)
+
+        stored_file = user_file.stored_file
+        kind = stored_file.media_kind or thumbnail_kind(user_file.name)
+        if not kind or stored_file.chunked or stored_file.encoding != IDENTITY:
+            return Response({"success": False, "message": "No preview available for this file."}, status=status.HTTP_404_NOT_FOUND)
+
+        rendition = get_or_create_rendition(stored_file, kind, size, rendition_format)
+        if rendition is None:
+            return Response({"success": False, "message": "Failed to generate preview."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        presigned_url = storage.generate_presigned_url(rendition.s3_key, expiration=3600)
+        if not presigned_url:
+            return Response({"success": False, "message": "Failed to generate preview URL."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "success": True,
+            "message": "Preview URL generated successfully.",
+            "data": {"preview_url": presigned_url, "size": size, "format": rendition_format}
+        })
+
+
+class LocalStorageView(APIView):
+    """
+    What presigned URLs point to on local storage. The signed token names
+    the object (and for part uploads the upload and part), so like S3's
+    URLs these need no authentication. Parts larger than the upload's part
+    size are refused, others are written to disk as they are read.
+    Downloads are FileResponses, which servers with a wsgi.file_wrapper
+    (gunicorn, uWSGI) send with sendfile, and are streamed from the event
+    loop under ASGI.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def _payload(self, token):
+        if not isinstance(storage, LocalStorage):
+            return None
+        return storage.unsign(token)
+
+    def get(self, request, token):
+        payload = self._payload(token)
+        if payload is None or 'u' in payload:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+        head = storage.head_object(payload['k'])
+        if head is None:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        try:
+            response = file_response(request, storage.local_path(payload['k']), content_type='application/octet-stream')
+        except OSError:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        if 'ContentEncoding' in head:
+            response['Content-Encoding'] = head['ContentEncoding']
+        return response
+
+    def put(self, request, token):
+        payload = self._payload(token)
+        if payload is None or 'u' not in payload:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+        part_size = UploadSession.objects.filter(
+            s3_key=payload['k'], upload_id=payload['u'], status=UploadSession.UPLOADING
+        ).values_list('part_size', flat=True).first()
+        if part_size is None:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            return HttpResponse(status=status.HTTP_411_LENGTH_REQUIRED)
+        if content_length > part_size:
+            return HttpResponse(status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        # The request stream stops at Content-Length, the part is copied to its file in blocks
+        etag = storage.upload_part(payload['k'], payload['u'], payload['p'], request._request)
+        if not etag:
+            return HttpResponse(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        response = HttpResponse()
+        response['ETag'] = etag
+        return response